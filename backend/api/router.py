@@ -1,33 +1,269 @@
-from fastapi import APIRouter, Depends
+import asyncio
+import json
+import os
+import time
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
 from typing import Any
 
-from api.schemas import CompletionResponse, Movie, MovieSearchParams, MoviesResponse
-from services.search import ESManager, SearchManager
+from api.schemas import (
+    CompletionResponse,
+    EmbeddingCacheStatsResponse,
+    MovieSearchParams,
+    MoviesResponse,
+    SearchCacheStatsResponse,
+)
+from services.embeddings import EmbeddingType, close_async_clients, embeddings_cache
+from services.metrics import (
+    REGISTRY,
+    SEARCH_REQUEST_SECONDS,
+    SEARCH_STAGE_SECONDS,
+    stats_collector,
+)
+from services.search import (
+    AsyncESManager,
+    AsyncSearchManager,
+    LocalCompletionEngine,
+    LocalVectorEngine,
+    SearchResultCache,
+)
+from services.search.pagination import (
+    InvalidCursorError,
+    candidate_window_params,
+    decode_cursor,
+    encode_cursor,
+    slice_candidates,
+)
+from services.search.queries import is_browse
+from services.resilience import Deadline, embeddings_breaker, knn_breaker
+from services.search.search_manager import SearchResults
+
+
+# Results, degraded reason and per-leg took (see search below).
+CachedSearch = tuple[SearchResults, str | None, dict[str, int]]
+
 
+# "local" serves /completion from an in-process trie, falling back to
+# Elasticsearch until it is built. COMPLETION_PARQUET_FILES (comma separated)
+# builds it from the parquet files instead of scanning the index.
+COMPLETION_ENGINE = os.environ.get("COMPLETION_ENGINE", "es")
+COMPLETION_PARQUET_FILES = os.environ.get("COMPLETION_PARQUET_FILES")
+# "local" runs the kNN part of hybrid search as an exact search over the
+# embeddings in VECTOR_ENGINE_PARQUET_FILES (comma separated) instead of ES kNN.
+VECTOR_ENGINE = os.environ.get("VECTOR_ENGINE", "es")
+VECTOR_ENGINE_PARQUET_FILES = os.environ.get("VECTOR_ENGINE_PARQUET_FILES", "")
+# "rrf" or "weighted" fuse the lexical and kNN legs client side from a single
+# _msearch, optionally with a kNN leg per HYBRID_EMBEDDING_TYPES (comma
+# separated) and HYBRID_WEIGHTS, a JSON object of leg name -> weight.
+# "es" keeps Elasticsearch's score sum.
+HYBRID_FUSION = os.environ.get("HYBRID_FUSION", "es")
+HYBRID_EMBEDDING_TYPES = [
+    EmbeddingType(t) for t in os.environ.get("HYBRID_EMBEDDING_TYPES", "").split(",") if t
+]
+HYBRID_WEIGHTS = json.loads(os.environ.get("HYBRID_WEIGHTS", "{}"))
+CURSOR_RETRY_AFTER_SECONDS = 1
 
 router = APIRouter()
 
-sm = SearchManager()
-em = ESManager()
+sm = AsyncSearchManager()
+em = AsyncESManager()
+search_cache = SearchResultCache(em.get_index_generation)
+completion_engine = (
+    LocalCompletionEngine(
+        em,
+        parquet_files=COMPLETION_PARQUET_FILES.split(",")
+        if COMPLETION_PARQUET_FILES
+        else None,
+    )
+    if COMPLETION_ENGINE == "local"
+    else None
+)
+vector_engine: LocalVectorEngine | None = None
+
+REGISTRY.add_collector(
+    stats_collector(
+        "charla_embedding_cache",
+        lambda: embeddings_cache.stats.to_dict(),
+        gauges=["entries", "bytes", "hit_rate"],
+    )
+)
+REGISTRY.add_collector(
+    stats_collector("charla_search_cache", search_cache.stats_dict, gauges=["entries"])
+)
+for breaker in [embeddings_breaker, knn_breaker]:
+    REGISTRY.add_collector(
+        stats_collector(
+            f"charla_circuit_{breaker.name}", breaker.stats_dict, gauges=["open", "failures"]
+        )
+    )
+
+
+@router.on_event("startup")
+async def start_completion_engine() -> None:
+    if completion_engine:
+        await completion_engine.start()
+
+
+@router.on_event("startup")
+async def load_vector_engine() -> None:
+    global vector_engine
+    if VECTOR_ENGINE == "local":
+        vector_engine = await asyncio.get_running_loop().run_in_executor(
+            None, LocalVectorEngine.from_parquet, VECTOR_ENGINE_PARQUET_FILES.split(",")
+        )
+
+
+@router.on_event("shutdown")
+async def close_clients() -> None:
+    if completion_engine:
+        await completion_engine.stop()
+    await em.close()
+    await close_async_clients()
 
 
 @router.get("/movies", response_model=MoviesResponse)
-def traditional_movie_search(params: MovieSearchParams = Depends()) -> Any:
-    if params.semantic_search:
-        movies, total, did_you_mean, did_you_mean_html = sm.execute_hybrid_search(params, em)
+async def traditional_movie_search(params: MovieSearchParams = Depends()) -> Any:
+    start = time.perf_counter()
+    # Without a text search there is nothing to embed or score, the filtered
+    # movies are browsed in popularity order instead.
+    browse = is_browse(params)
+    semantic_search = params.semantic_search and not browse
+    if browse:
+        mode = "browse" if params.cursor is None else "browse_cursor"
+    elif not semantic_search:
+        mode = "traditional" if params.cursor is None else "traditional_cursor"
+    elif HYBRID_FUSION != "es":
+        mode = f"hybrid_{HYBRID_FUSION}"
     else:
-        movies, total, did_you_mean, did_you_mean_html = sm.execute_traditional_search(params, em)
-    return MoviesResponse(
-        total=total,
-        size=params.size,
-        offset=params.offset,
-        did_you_mean=did_you_mean,
-        did_you_mean_html=did_you_mean_html,
-        movies=movies,
+        mode = "hybrid_local" if vector_engine else "hybrid"
+
+    # Started before the cache lookup, which counts against the budget too.
+    deadline = Deadline()
+
+    async def search(search_params: MovieSearchParams) -> CachedSearch:
+        # Returns the results, why they are lexical only if they are, and the
+        # per-leg took, all cached together so hits and coalesced requests
+        # report the took of the search that produced them.
+        degraded: list[str] = []
+        took: dict[str, int] = {}
+        hybrid = search_params.semantic_search and not browse
+        if hybrid and HYBRID_FUSION != "es":
+            results = await sm.execute_fused_hybrid_search(
+                search_params,
+                em,
+                fusion=HYBRID_FUSION,
+                emb_types=HYBRID_EMBEDDING_TYPES or None,
+                weights=HYBRID_WEIGHTS,
+                took=took,
+                deadline=deadline,
+                degraded=degraded,
+            )
+        elif hybrid:
+            results = await sm.execute_hybrid_search(
+                search_params,
+                em,
+                vector_engine=vector_engine,
+                deadline=deadline,
+                degraded=degraded,
+            )
+        else:
+            results = await sm.execute_traditional_search(search_params, em, deadline=deadline)
+        return results, degraded[0] if degraded else None, took
+
+    def cacheable(value: CachedSearch) -> bool:
+        # Degraded results would outlive the outage that caused them.
+        return value[1] is None
+
+    offset = params.offset
+    next_cursor = None
+    if params.cursor is None:
+        results, degraded_reason, took = await search_cache.get_or_search(
+            params, lambda: search(params), cacheable
+        )
+    else:
+        try:
+            cursor = decode_cursor(params.cursor, params)
+            offset = cursor.position
+            if semantic_search:
+                window_params = candidate_window_params(params)
+                if cursor.degraded:
+                    # The pagination started on lexical candidates, its later
+                    # pages come from the same (cacheable) lexical window.
+                    window_params.semantic_search = False
+                candidates, degraded_reason, took = await search_cache.get_or_search(
+                    window_params, lambda: search(window_params), cacheable
+                )
+                degraded_reason = cursor.degraded or degraded_reason
+                if degraded_reason and cursor.position and not cursor.degraded:
+                    # The hybrid window expired and couldn't be rebuilt, a
+                    # lexical page would repeat or skip movies.
+                    raise HTTPException(
+                        status_code=503,
+                        detail=f"Hybrid search unavailable ({degraded_reason})",
+                        headers={"Retry-After": str(CURSOR_RETRY_AFTER_SECONDS)},
+                    )
+                results, next_cursor = slice_candidates(
+                    candidates, params, cursor, degraded_reason
+                )
+            else:
+                degraded_reason, took = None, {}
+                results, next_cursor = await sm.execute_traditional_cursor_search(
+                    params, em, cursor, deadline=deadline
+                )
+        except InvalidCursorError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    movies, total, total_is_exact, did_you_mean, did_you_mean_html = results
+    # The movies already have the Movie shape and types (see
+    # SearchManager._serialize_es_results); returning a response directly skips
+    # response_model validation, MoviesResponse only documents the schema.
+    render_start = time.perf_counter()
+    response = JSONResponse(
+        {
+            "total": total,
+            "total_is_exact": total_is_exact,
+            "size": params.size,
+            "offset": offset,
+            "did_you_mean": did_you_mean,
+            "did_you_mean_html": did_you_mean_html,
+            "movies": movies,
+            "took": took or None,
+            "next_cursor": encode_cursor(next_cursor) if next_cursor else None,
+            "degraded": degraded_reason is not None,
+            "degraded_reason": degraded_reason,
+        }
+    )
+    end = time.perf_counter()
+    SEARCH_STAGE_SECONDS.observe(end - render_start, mode=mode, stage="render")
+    SEARCH_REQUEST_SECONDS.observe(
+        end - start,
+        mode=mode,
+        emb_type=params.emb_type.value if semantic_search else "none",
+        suggestions=str(params.include_suggestions).lower(),
     )
+    return response
 
 
 @router.get("/completion", response_model=CompletionResponse)
-def get_completion_suggestions(query: str) -> Any:
-    suggestions = sm.get_completion_suggestions(query, em)
+async def get_completion_suggestions(query: str) -> Any:
+    suggestions = completion_engine.suggest(query) if completion_engine else None
+    if suggestions is None:
+        suggestions = await sm.get_completion_suggestions(query, em)
     return CompletionResponse(suggestions=suggestions)
+
+
+@router.get("/embeddings/cache", response_model=EmbeddingCacheStatsResponse)
+def get_embeddings_cache_stats() -> Any:
+    return embeddings_cache.stats.to_dict()
+
+
+@router.get("/movies/cache", response_model=SearchCacheStatsResponse)
+def get_search_cache_stats() -> Any:
+    return search_cache.stats_dict()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics() -> Any:
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -8,8 +8,29 @@ class CompletionResponse(BaseModel):
     suggestions: list[str]
 
 
+class EmbeddingCacheStatsResponse(BaseModel):
+    hits: int
+    misses: int
+    evictions: int
+    shared_hits: int
+    entries: int
+    bytes: int
+    hit_rate: float
+
+
+class SearchCacheStatsResponse(BaseModel):
+    hits: int
+    misses: int
+    coalesced: int
+    evictions: int
+    invalidations: int
+    entries: int
+    generation: str | None = None
+
+
 class Movie(BaseModel):
-    score: float
+    # None when browsing, the hits are sorted instead of scored.
+    score: float | None
     title: str
     tmbdId: int | None = None
     item_id: int
@@ -27,11 +48,23 @@ class Movie(BaseModel):
 
 class MoviesResponse(BaseModel):
     total: int
+    # False when total is a lower bound (the count stopped at track_total_hits)
+    # or, for fused hybrid searches, an upper bound.
+    total_is_exact: bool = True
     size: int
     offset: int
     did_you_mean: str | None = None
     did_you_mean_html: str | None = None
     movies: list[Movie]
+    # Per-leg Elasticsearch took (ms) of the fused hybrid search that produced
+    # the results, cached along with them.
+    took: dict[str, int] | None = None
+    # Pass as cursor (with the same search parameters) to get the next page.
+    next_cursor: str | None = None
+    # Lexical results only, because the embedding or kNN stage failed or ran
+    # out of time (degraded_reason says which, e.g. embedding_timeout).
+    degraded: bool = False
+    degraded_reason: str | None = None
 
 
 class MovieSearchParams:
@@ -47,7 +80,9 @@ class MovieSearchParams:
         min_rating: int | None = None,
         include_suggestions: bool = False,
         emb_type: EmbeddingType = EmbeddingType.SYMMETRIC,
-        semantic_search: bool = False
+        semantic_search: bool = False,
+        # An empty cursor starts cursor pagination, offset is ignored then.
+        cursor: str | None = None,
     ):
         self.offset = offset
         self.size = size
@@ -60,3 +95,4 @@ class MovieSearchParams:
         self.include_suggestions = include_suggestions
         self.emb_type = emb_type
         self.semantic_search = semantic_search
+        self.cursor = cursor
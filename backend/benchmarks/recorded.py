@@ -0,0 +1,292 @@
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+from typing import Any
+
+import numpy as np
+from elastic_transport import (
+    AiohttpHttpNode,
+    ApiResponseMeta,
+    BaseAsyncNode,
+    BaseNode,
+    HttpHeaders,
+    Urllib3HttpNode,
+)
+from elastic_transport._node import NodeApiResponse
+from elastic_transport.client_utils import DEFAULT, DefaultType
+
+from services import embeddings
+from services.embeddings import EmbeddingType
+
+
+RESPONSE_HEADERS = {
+    "content-type": "application/json",
+    "x-elastic-product": "Elasticsearch",
+}
+SYNTHETIC_GENRES = ["Action", "Adventure", "Comedy", "Drama", "Horror", "Science Fiction"]
+SYNTHETIC_VECTOR_DIMS = {
+    "openai_embedding": 1536,
+    "sbert_symmetric_embedding": 768,
+    "sbert_asymmetric_embedding": 768,
+}
+
+
+def _request_key(method: str, target: str, body: bytes | None) -> str:
+    digest = hashlib.sha1(method.encode() + target.encode() + (body or b""))
+    return digest.hexdigest()
+
+
+def _synthetic_movie(item_id: int, rng: random.Random) -> dict:
+    movie = {
+        "tmdbId": str(item_id + 1000),
+        "item_id": item_id,
+        "title": f"Movie {item_id}",
+        "year": rng.randint(1950, 2023),
+        "overview": " ".join(f"word{rng.randint(0, 5000)}" for _ in range(60)),
+        "runtime": rng.randint(80, 180),
+        "genres": rng.sample(SYNTHETIC_GENRES, 2),
+        "vote_average": rng.randint(1, 10),
+        "director": f"Director {rng.randint(0, 500)}",
+        "protagonists": [f"Actor {rng.randint(0, 5000)}" for _ in range(3)],
+        "backdrop_path": f"/{item_id}_backdrop.jpg",
+        "poster_path": f"/{item_id}_poster.jpg",
+        "popularity": rng.randint(0, 500),
+    }
+    for field, dims in SYNTHETIC_VECTOR_DIMS.items():
+        movie[field] = [round(rng.uniform(-0.1, 0.1), 8) for _ in range(dims)]
+    return movie
+
+
+# Requests recorded from a real cluster are replayed byte for byte; anything
+# else gets a synthetic response shaped like the real one, so workloads that
+# were never recorded still go through the whole client path.
+class ResponseStore:
+    def __init__(self, corpus_size: int = 200, took_ms: int = 5, seed: int = 0) -> None:
+        self.took_ms = took_ms
+        self.recorded: dict[str, tuple[int, bytes]] = {}
+        self.requests = 0
+        self.replayed = 0
+        rng = random.Random(seed)
+        self.corpus = [_synthetic_movie(i, rng) for i in range(corpus_size)]
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str, **kwargs: Any) -> "ResponseStore":
+        store = cls(**kwargs)
+        with open(path) as f:
+            for line in f:
+                entry = json.loads(line)
+                store.recorded[entry["key"]] = (entry["status"], entry["body"].encode())
+        return store
+
+    def save(self, path: str) -> None:
+        with open(path, "w") as f:
+            for key, (status, body) in self.recorded.items():
+                f.write(json.dumps({"key": key, "status": status, "body": body.decode()}) + "\n")
+
+    def record(
+        self, method: str, target: str, body: bytes | None, status: int, response: bytes
+    ) -> None:
+        with self._lock:
+            self.recorded[_request_key(method, target, body)] = (status, response)
+
+    def _source(self, movie: dict, source: Any) -> dict:
+        if source is False:
+            return {}
+        if isinstance(source, dict):
+            source = source.get("includes", list(movie))
+        if isinstance(source, list):
+            return {k: v for k, v in movie.items() if k in source}
+        return movie
+
+    def _search_response(self, request: dict) -> dict:
+        size = request.get("size", 10)
+        offset = request.get("from", 0)
+        hits = [
+            {
+                "_index": "recorded",
+                "_id": str(movie["item_id"]),
+                "_score": 10.0 / (rank + 1),
+                "_source": self._source(movie, request.get("_source", True)),
+            }
+            for rank, movie in enumerate(self.corpus[offset : offset + size], start=offset)
+        ]
+        response: dict[str, Any] = {
+            "took": self.took_ms,
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {
+                "total": {"value": len(self.corpus), "relation": "eq"},
+                "max_score": hits[0]["_score"] if hits else None,
+                "hits": hits,
+            },
+        }
+        suggest = request.get("suggest") or {}
+        if "did_you_mean" in suggest:
+            text = suggest["did_you_mean"]["text"]
+            response["suggest"] = {
+                "did_you_mean": [
+                    {
+                        "text": text,
+                        "offset": 0,
+                        "length": len(text),
+                        "options": [
+                            {"text": text, "highlighted": f"<strong>{text}</strong>", "score": 0.1}
+                        ],
+                    }
+                ]
+            }
+        if "complete" in suggest:
+            text = suggest["complete"]["text"]
+            response["suggest"] = {
+                "complete": [
+                    {
+                        "text": text,
+                        "offset": 0,
+                        "length": len(text),
+                        "options": [{"text": m["title"], "_score": 1.0} for m in self.corpus[:10]],
+                    }
+                ]
+            }
+        return response
+
+    def _synthetic_response(self, method: str, target: str, body: bytes | None) -> dict:
+        path = target.split("?")[0]
+        if path.endswith("/_msearch"):
+            lines = (body or b"").decode().strip().split("\n")
+            return {
+                "took": self.took_ms,
+                "responses": [
+                    {**self._search_response(json.loads(request)), "status": 200}
+                    for request in lines[1::2]
+                ],
+            }
+        if path.endswith("/_search"):
+            return self._search_response(json.loads(body or b"{}"))
+        if path.endswith("/_mapping"):
+            return {"recorded": {"mappings": {"_meta": {"generation": "recorded"}}}}
+        return {"acknowledged": True}
+
+    def respond(self, method: str, target: str, body: bytes | None) -> tuple[int, bytes]:
+        with self._lock:
+            self.requests += 1
+            recorded = self.recorded.get(_request_key(method, target, body))
+            if recorded is not None:
+                self.replayed += 1
+        if recorded is not None:
+            return recorded
+        return 200, json.dumps(self._synthetic_response(method, target, body)).encode()
+
+
+def _node_response(node: BaseNode, status: int, body: bytes, duration: float) -> NodeApiResponse:
+    meta = ApiResponseMeta(
+        node=node.config,
+        duration=duration,
+        http_version="1.1",
+        status=status,
+        headers=HttpHeaders(RESPONSE_HEADERS),
+    )
+    return NodeApiResponse(meta, body)
+
+
+def make_recorded_node_classes(store: ResponseStore) -> tuple[type[BaseNode], type[BaseAsyncNode]]:
+    class RecordedNode(BaseNode):
+        _CLIENT_META_HTTP_CLIENT = ("rn", "1")
+
+        def perform_request(
+            self,
+            method: str,
+            target: str,
+            body: bytes | None = None,
+            headers: HttpHeaders | None = None,
+            request_timeout: DefaultType | float | None = DEFAULT,
+        ) -> NodeApiResponse:
+            start = time.perf_counter()
+            status, response = store.respond(method, target, body)
+            return _node_response(self, status, response, time.perf_counter() - start)
+
+    class AsyncRecordedNode(BaseAsyncNode):
+        _CLIENT_META_HTTP_CLIENT = ("rn", "1")
+
+        async def perform_request(  # type: ignore[override]
+            self,
+            method: str,
+            target: str,
+            body: bytes | None = None,
+            headers: HttpHeaders | None = None,
+            request_timeout: DefaultType | float | None = DEFAULT,
+        ) -> NodeApiResponse:
+            start = time.perf_counter()
+            status, response = store.respond(method, target, body)
+            return _node_response(self, status, response, time.perf_counter() - start)
+
+        async def close(self) -> None:  # type: ignore[override]
+            pass
+
+    return RecordedNode, AsyncRecordedNode
+
+
+def make_recording_node_classes(
+    store: ResponseStore,
+) -> tuple[type[BaseNode], type[BaseAsyncNode]]:
+    class RecordingNode(Urllib3HttpNode):
+        def perform_request(
+            self,
+            method: str,
+            target: str,
+            body: bytes | None = None,
+            headers: HttpHeaders | None = None,
+            request_timeout: DefaultType | float | None = DEFAULT,
+        ) -> NodeApiResponse:
+            response = super().perform_request(method, target, body, headers, request_timeout)
+            store.record(method, target, body, response.meta.status, response.body)
+            return response
+
+    class AsyncRecordingNode(AiohttpHttpNode):
+        async def perform_request(  # type: ignore[override]
+            self,
+            method: str,
+            target: str,
+            body: bytes | None = None,
+            headers: HttpHeaders | None = None,
+            request_timeout: DefaultType | float | None = DEFAULT,
+        ) -> NodeApiResponse:
+            response = await super().perform_request(
+                method, target, body, headers, request_timeout
+            )
+            store.record(method, target, body, response.meta.status, response.body)
+            return response
+
+    return RecordingNode, AsyncRecordingNode
+
+
+# Stands in for the embeddings generator: vectors are seeded from the text and
+# latency_ms simulates the round trip.
+class RecordedEmbeddings:
+    def __init__(self, latency_ms: float = 0.0, dims: int = 768) -> None:
+        self.latency_ms = latency_ms
+        self.dims = dims
+        self.calls = 0
+
+    def _vector(self, text: str, embedding_type: EmbeddingType) -> np.ndarray:
+        self.calls += 1
+        seed = int(hashlib.md5(f"{embedding_type}:{text}".encode()).hexdigest()[:8], 16)
+        vector = np.random.default_rng(seed).standard_normal(self.dims).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def get(self, text: str, embedding_type: EmbeddingType) -> np.ndarray:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return self._vector(text, embedding_type)
+
+    async def aget(self, text: str, embedding_type: EmbeddingType) -> np.ndarray:
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        return self._vector(text, embedding_type)
+
+    def install(self) -> None:
+        embeddings._get_sbert_embedding = self.get  # type: ignore[assignment]
+        embeddings._aget_sbert_embedding = self.aget  # type: ignore[assignment]
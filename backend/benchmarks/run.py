@@ -0,0 +1,414 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Any, Awaitable, Callable
+
+import numpy as np
+from elasticsearch import AsyncElasticsearch, Elasticsearch
+from fastapi.responses import JSONResponse
+from starlette.types import Message
+
+from benchmarks.recorded import (
+    RecordedEmbeddings,
+    ResponseStore,
+    make_recorded_node_classes,
+    make_recording_node_classes,
+)
+from benchmarks.workloads import (
+    iter_repeated,
+    load_workload,
+    synthetic_workload,
+    to_query_string,
+    to_search_params,
+)
+from services import embeddings
+from services.embedding_cache import EmbeddingCache
+from services.search import ESManager, SearchManager
+from services.search import search_manager as search_manager_module
+from services.search.es_manager import ELASTICSEARCH_URL
+
+
+DEFAULT_WORKLOAD = os.path.join(os.path.dirname(__file__), "data", "requests.jsonl")
+DEFAULT_REGRESSION_THRESHOLD = 0.2
+# Stages faster than this are mostly timer noise and aren't compared.
+MIN_COMPARED_MS = 0.05
+PERCENTILES = [50, 90, 99]
+STAGE_ORDER = ["embedding", "query_build", "es", "parse", "render", "app", "total"]
+
+
+class StageTimer:
+    def __init__(self) -> None:
+        self.samples: dict[str, list[float]] = defaultdict(list)
+        self._current: dict[str, float] = defaultdict(float)
+
+    def add(self, stage: str, seconds: float) -> None:
+        self._current[stage] += seconds
+
+    def wrap(self, stage: str, func: Callable) -> Callable:
+        def timed(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+
+        return timed
+
+    def wrap_async(self, stage: str, func: Callable[..., Awaitable]) -> Callable:
+        async def timed(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+
+        return timed
+
+    def finish(self, total: float, remainder_stage: str) -> None:
+        # Whatever isn't wrapped is attributed to remainder_stage. Concurrent
+        # stages (the async hybrid search) can overlap, hence the clamp.
+        measured = sum(self._current.values())
+        self._current[remainder_stage] += max(total - measured, 0.0)
+        self._current["total"] = total
+        for stage, seconds in self._current.items():
+            self.samples[stage].append(seconds * 1000)
+        self._current.clear()
+
+    def discard(self) -> None:
+        self._current.clear()
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        return {
+            stage: {
+                **{f"p{p}": float(np.percentile(values, p)) for p in PERCENTILES},
+                "mean": float(np.mean(values)),
+            }
+            for stage, values in sorted(
+                self.samples.items(), key=lambda item: STAGE_ORDER.index(item[0])
+            )
+        }
+
+
+class SearchManagerTarget:
+    name = "search_manager"
+
+    def __init__(self, es_client: Elasticsearch, timer: StageTimer) -> None:
+        self.sm = SearchManager()
+        self.em = ESManager()
+        self.em.es_client = es_client
+        self.timer = timer
+        es_client.search = timer.wrap("es", es_client.search)  # type: ignore[method-assign]
+        es_client.msearch = timer.wrap("es", es_client.msearch)  # type: ignore[method-assign]
+        self.sm._parse_search_response = timer.wrap(  # type: ignore[method-assign]
+            "parse", self.sm._parse_search_response
+        )
+        search_manager_module.get_embedding_for_text = timer.wrap(  # type: ignore[assignment]
+            "embedding", search_manager_module.get_embedding_for_text
+        )
+
+    def _render(self, entry: dict[str, Any], results: Any) -> bytes:
+        movies, total, total_is_exact, did_you_mean, did_you_mean_html = results
+        return JSONResponse(
+            {
+                "total": total,
+                "total_is_exact": total_is_exact,
+                "size": entry.get("size", 50),
+                "offset": entry.get("offset", 0),
+                "did_you_mean": did_you_mean,
+                "did_you_mean_html": did_you_mean_html,
+                "movies": movies,
+            }
+        ).body
+
+    def run(self, entry: dict[str, Any]) -> None:
+        start = time.perf_counter()
+        params = to_search_params(entry)
+        if params.semantic_search:
+            results = self.sm.execute_hybrid_search(params, self.em)
+        else:
+            results = self.sm.execute_traditional_search(params, self.em)
+        render_start = time.perf_counter()
+        self._render(entry, results)
+        end = time.perf_counter()
+        self.timer.add("render", end - render_start)
+        self.timer.finish(end - start, "query_build")
+
+
+class AppTarget:
+    name = "app"
+
+    def __init__(
+        self, es_client: AsyncElasticsearch | None, timer: StageTimer, warm_caches: bool
+    ) -> None:
+        from api import router
+        from main import app
+
+        self.app = app
+        self.router = router
+        self.timer = timer
+        self.warm_caches = warm_caches
+        self.loop = asyncio.new_event_loop()
+        if es_client is not None:
+            router.em.es_client = es_client
+        es = router.em.es_client
+        es.search = timer.wrap_async("es", es.search)  # type: ignore[method-assign]
+        es.msearch = timer.wrap_async("es", es.msearch)  # type: ignore[method-assign]
+        router.sm._parse_search_response = timer.wrap(  # type: ignore[method-assign]
+            "parse", router.sm._parse_search_response
+        )
+        search_manager_module.aget_embedding_for_text = (  # type: ignore[assignment]
+            timer.wrap_async("embedding", search_manager_module.aget_embedding_for_text)
+        )
+
+    async def _get(self, path: str, query_string: str) -> tuple[int, bytes]:
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "root_path": "",
+            "query_string": query_string.encode(),
+            "headers": [(b"host", b"benchmark")],
+            "client": ("127.0.0.1", 0),
+            "server": ("benchmark", 80),
+        }
+        messages = []
+
+        async def receive() -> Message:
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message: Message) -> None:
+            messages.append(message)
+
+        await self.app(scope, receive, send)
+        status = next(m["status"] for m in messages if m["type"] == "http.response.start")
+        body = b"".join(m.get("body", b"") for m in messages if m["type"] == "http.response.body")
+        return status, body
+
+    def run(self, entry: dict[str, Any]) -> None:
+        if not self.warm_caches:
+            self.router.search_cache.clear()
+        start = time.perf_counter()
+        status, body = self.loop.run_until_complete(
+            self._get("/api/movies", to_query_string(entry))
+        )
+        total = time.perf_counter() - start
+        if status != 200:
+            self.timer.discard()
+            raise RuntimeError(f"/api/movies returned {status}: {body[:200]!r}")
+        # Routing, parameter parsing, the search cache, query building and rendering.
+        self.timer.finish(total, "app")
+
+    def close(self) -> None:
+        self.loop.run_until_complete(self.router.em.close())
+        self.loop.run_until_complete(embeddings.close_async_clients())
+        self.loop.close()
+
+
+def _run_target(
+    target: SearchManagerTarget | AppTarget,
+    workload: list[dict[str, Any]],
+    requests: int,
+    warmup: int,
+    allocations: bool,
+) -> dict[str, Any]:
+    for entry in iter_repeated(workload, warmup):
+        target.run(entry)
+    target.timer.samples.clear()
+
+    start = time.perf_counter()
+    for entry in iter_repeated(workload, requests):
+        target.run(entry)
+    elapsed = time.perf_counter() - start
+    report: dict[str, Any] = {
+        "requests": requests,
+        "throughput_rps": requests / elapsed,
+        "stages": target.timer.summary(),
+    }
+
+    if allocations:
+        # A separate pass, tracemalloc slows everything down several times.
+        peaks = []
+        tracemalloc.start()
+        for entry in iter_repeated(workload, min(requests, len(workload))):
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            target.run(entry)
+            peaks.append((tracemalloc.get_traced_memory()[1] - current) / 1024)
+        tracemalloc.stop()
+        target.timer.samples.clear()
+        report["allocations"] = {
+            "peak_kb_p50": float(np.percentile(peaks, 50)),
+            "peak_kb_max": float(np.max(peaks)),
+        }
+    return report
+
+
+def _compare(
+    baseline: dict[str, Any], current: dict[str, Any], threshold: float
+) -> list[str]:
+    regressions = []
+    for target, report in current["targets"].items():
+        base = baseline.get("targets", {}).get(target)
+        if base is None:
+            continue
+        for stage, stats in report["stages"].items():
+            for stat in ["p50", "p99"]:
+                before = base["stages"].get(stage, {}).get(stat)
+                if before is None or before < MIN_COMPARED_MS:
+                    continue
+                if stats[stat] > before * (1 + threshold):
+                    regressions.append(
+                        f"{target} {stage} {stat}: {before:.3f}ms -> {stats[stat]:.3f}ms"
+                    )
+        if report["throughput_rps"] < base["throughput_rps"] * (1 - threshold):
+            regressions.append(
+                f"{target} throughput: {base['throughput_rps']:.0f}/s "
+                f"-> {report['throughput_rps']:.0f}/s"
+            )
+        before_kb = base.get("allocations", {}).get("peak_kb_p50")
+        after_kb = report.get("allocations", {}).get("peak_kb_p50")
+        if before_kb and after_kb and after_kb > before_kb * (1 + threshold):
+            regressions.append(
+                f"{target} allocations peak p50: {before_kb:.0f}KB -> {after_kb:.0f}KB"
+            )
+    return regressions
+
+
+def _print_report(report: dict[str, Any]) -> None:
+    for target, result in report["targets"].items():
+        print(f"\n{target}: {result['requests']} requests, {result['throughput_rps']:.0f} req/s")
+        print(f"{'stage':<15}" + "".join(f"{c:>10}" for c in ["p50", "p90", "p99", "mean"]))
+        for stage, stats in result["stages"].items():
+            print(
+                f"{stage:<15}"
+                + "".join(f"{stats[c]:>10.3f}" for c in ["p50", "p90", "p99", "mean"])
+            )
+        if "allocations" in result:
+            allocations = result["allocations"]
+            print(
+                f"allocations: peak {allocations['peak_kb_p50']:.0f}KB p50, "
+                f"{allocations['peak_kb_max']:.0f}KB max per request"
+            )
+
+
+def _main(args: argparse.Namespace) -> int:
+    if args.synthetic:
+        workload = synthetic_workload(args.synthetic, semantic_ratio=args.semantic_ratio)
+    else:
+        workload = load_workload(args.workload)
+
+    store = None
+    if args.es == "recorded":
+        store = (
+            ResponseStore.load(args.responses)
+            if args.responses
+            else ResponseStore(corpus_size=args.corpus_size)
+        )
+        node_class, async_node_class = make_recorded_node_classes(store)
+        es_client = Elasticsearch("http://recorded:9200", node_class=node_class)
+        async_es_client = AsyncElasticsearch(
+            "http://recorded:9200", node_class=async_node_class
+        )
+    elif args.record:
+        store = ResponseStore(corpus_size=0)
+        node_class, async_node_class = make_recording_node_classes(store)
+        es_client = Elasticsearch(ELASTICSEARCH_URL, node_class=node_class)
+        async_es_client = AsyncElasticsearch(ELASTICSEARCH_URL, node_class=async_node_class)
+    else:
+        es_client = Elasticsearch(ELASTICSEARCH_URL)
+        async_es_client = None
+
+    if args.embeddings == "recorded":
+        RecordedEmbeddings(latency_ms=args.embedding_latency_ms).install()
+    if not args.warm_caches:
+        # A zero sized cache evicts every vector as soon as it is stored.
+        embeddings.embeddings_cache = EmbeddingCache(max_bytes=0, ttl=None)
+
+    report: dict[str, Any] = {
+        "es": args.es,
+        "embeddings": args.embeddings,
+        "workload": f"synthetic-{args.synthetic}" if args.synthetic else args.workload,
+        "targets": {},
+    }
+    targets = ["search_manager", "app"] if args.target == "all" else [args.target]
+    for name in targets:
+        timer = StageTimer()
+        if name == "search_manager":
+            target: SearchManagerTarget | AppTarget = SearchManagerTarget(es_client, timer)
+        else:
+            target = AppTarget(async_es_client, timer, args.warm_caches)
+        try:
+            report["targets"][name] = _run_target(
+                target, workload, args.requests, args.warmup, not args.no_allocations
+            )
+        finally:
+            if isinstance(target, AppTarget):
+                target.close()
+
+    _print_report(report)
+    if args.responses and store is not None:
+        print(f"\nreplayed {store.replayed} of {store.requests} requests from {args.responses}")
+    if args.record and store is not None:
+        store.save(args.record)
+        print(f"\nrecorded {len(store.recorded)} responses to {args.record}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = _compare(json.load(f), report, args.threshold)
+        if regressions:
+            print(f"\nregressions over {args.threshold:.0%} against {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"\nno regressions over {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replays search workloads through SearchManager and the FastAPI app "
+        "and reports per-stage latency, throughput and allocations"
+    )
+    parser.add_argument("--target", choices=["all", "search_manager", "app"], default="all")
+    parser.add_argument("--workload", default=DEFAULT_WORKLOAD, help="JSON lines of search params")
+    parser.add_argument(
+        "--synthetic", type=int, help="use a synthetic mix of this many queries instead"
+    )
+    parser.add_argument("--semantic_ratio", type=float, default=0.5)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument(
+        "--es",
+        choices=["recorded", "live"],
+        default="recorded",
+        help="recorded serves responses in-process, live uses ELASTICSEARCH_URL",
+    )
+    parser.add_argument("--responses", help="responses saved with --record to replay")
+    parser.add_argument("--record", help="save the live cluster's responses to this file")
+    parser.add_argument("--corpus_size", type=int, default=200)
+    parser.add_argument("--embeddings", choices=["recorded", "live"], default="recorded")
+    parser.add_argument("--embedding_latency_ms", type=float, default=0.0)
+    parser.add_argument(
+        "--warm_caches", action="store_true", help="keep the embedding and search caches"
+    )
+    parser.add_argument("--no_allocations", action="store_true")
+    parser.add_argument("--output", help="write the report as JSON, e.g. to use as a baseline")
+    parser.add_argument("--baseline", help="report to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+    if args.record and args.es != "live":
+        parser.error("--record needs --es live")
+
+    sys.exit(_main(args))
@@ -0,0 +1,74 @@
+import json
+import random
+from typing import Any, Iterator
+from urllib.parse import urlencode
+
+from api.schemas import MovieSearchParams
+from services.embeddings import EmbeddingType
+
+
+SYNTHETIC_TERMS = (
+    "star wars love lord rings space adventure war dark knight family christmas "
+    "zombie detective island robot summer ghost king dragon murder city heist school"
+).split()
+SYNTHETIC_GENRES = ["Action", "Comedy", "Drama", "Horror", "Romance", "Science Fiction"]
+SYNTHETIC_EMBEDDING_TYPES = [EmbeddingType.SYMMETRIC, EmbeddingType.ASYMMETRIC]
+
+
+# A workload entry is a dict of MovieSearchParams arguments, e.g.
+# {"search": "star wars", "semantic_search": true, "genres_in": ["Action"]}.
+def load_workload(path: str) -> list[dict[str, Any]]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def synthetic_workload(
+    size: int,
+    semantic_ratio: float = 0.5,
+    filter_ratio: float = 0.3,
+    suggestions_ratio: float = 0.2,
+    seed: int = 0,
+) -> list[dict[str, Any]]:
+    rng = random.Random(seed)
+    workload = []
+    for _ in range(size):
+        entry: dict[str, Any] = {
+            "search": " ".join(rng.sample(SYNTHETIC_TERMS, rng.randint(1, 4))),
+            "size": rng.choice([10, 20, 50]),
+        }
+        if rng.random() < semantic_ratio:
+            entry["semantic_search"] = True
+            entry["emb_type"] = rng.choice(SYNTHETIC_EMBEDDING_TYPES).value
+        if rng.random() < filter_ratio:
+            entry["genres_in"] = [rng.choice(SYNTHETIC_GENRES)]
+            entry["min_year"] = rng.randint(1960, 2000)
+            entry["min_rating"] = rng.randint(3, 7)
+        if rng.random() < suggestions_ratio:
+            entry["include_suggestions"] = True
+        workload.append(entry)
+    return workload
+
+
+def to_search_params(entry: dict[str, Any]) -> MovieSearchParams:
+    # MovieSearchParams' list defaults are fastapi Query objects outside a request.
+    kwargs = {"genres_in": [], "genres_out": [], **entry}
+    if "emb_type" in kwargs:
+        kwargs["emb_type"] = EmbeddingType(kwargs["emb_type"])
+    return MovieSearchParams(**kwargs)
+
+
+def to_query_string(entry: dict[str, Any]) -> str:
+    items: list[tuple[str, Any]] = []
+    for key, value in entry.items():
+        if isinstance(value, list):
+            items.extend((key, v) for v in value)
+        elif isinstance(value, bool):
+            items.append((key, str(value).lower()))
+        else:
+            items.append((key, value))
+    return urlencode(items)
+
+
+def iter_repeated(workload: list[dict[str, Any]], requests: int) -> Iterator[dict[str, Any]]:
+    for i in range(requests):
+        yield workload[i % len(workload)]
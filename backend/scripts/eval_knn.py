@@ -0,0 +1,198 @@
+import argparse
+import json
+import time
+from dataclasses import replace
+from typing import Any
+
+import numpy as np
+from elasticsearch import ApiError, TransportError
+
+from api.schemas import MovieSearchParams
+from services.movies_reader import MovieParquetReader, read_embedding_matrix
+from services.search import ESManager, LocalVectorEngine, SearchManager
+from services.search.es_manager import ES_INDEX_NAME, get_vector_fields
+from services.search.search_manager import EMBEDDING_FIELDS
+
+
+# int8_hnsw needs Elasticsearch 8.12+, pass it with --variants on those.
+DEFAULT_VARIANTS = {
+    "hnsw-m16-ef50": {"index_type": "hnsw", "m": 16, "ef_construction": 50},
+    "hnsw-m32-ef100": {"index_type": "hnsw", "m": 32, "ef_construction": 100},
+}
+
+
+def _exact_neighbours(
+    vectors: np.ndarray, queries: np.ndarray, similarity: str, k: int
+) -> np.ndarray:
+    if similarity == "cosine":
+        vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    scores = queries @ vectors.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(scores, top, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(top, order, axis=1)
+
+
+def _load_variant(em: ESManager, file_paths: list[str]) -> float:
+    reader = MovieParquetReader()
+    em.create_index(drop_index_if_exists=True)
+    start = time.perf_counter()
+    with em.bulk_load_settings():
+        em.bulk_save_documents(
+            movie for file_path in file_paths for movie in reader.iter_documents(file_path)
+        )
+    # Searching a single segment makes the variants comparable.
+    em.es_client.indices.forcemerge(index=em.index_name, max_num_segments=1)
+    return time.perf_counter() - start
+
+
+def _evaluate_variant(
+    em: ESManager,
+    field: str,
+    item_ids: np.ndarray,
+    queries: np.ndarray,
+    expected: np.ndarray,
+    k: int,
+) -> dict[str, Any]:
+    sm = SearchManager()
+    emb_type = next(t for t, f in EMBEDDING_FIELDS.items() if f == field)
+    params = MovieSearchParams(emb_type=emb_type, genres_in=[], genres_out=[])
+    num_candidates = em.vector_fields[field].num_candidates
+    latencies = []
+    took = []
+    recalls = []
+    for query_vector, expected_rows in zip(queries, expected):
+        knn_query = sm._get_knn_query(params, query_vector.tolist(), k, num_candidates)
+        start = time.perf_counter()
+        response = em.es_client.search(
+            index=em.index_name, knn=knn_query["knn"], source={"includes": ["item_id"]}, size=k
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+        took.append(response["took"])
+        found = {str(hit["_source"]["item_id"]) for hit in response["hits"]["hits"]}
+        recalls.append(len(found & {str(i) for i in item_ids[expected_rows]}) / k)
+    stats = em.es_client.indices.stats(index=em.index_name, metric="store")
+    return {
+        f"recall@{k}": float(np.mean(recalls)),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "took_p50_ms": float(np.percentile(took, 50)),
+        "index_size_mb": stats["_all"]["primaries"]["store"]["size_in_bytes"] / 1024 / 1024,
+    }
+
+
+def _evaluate_local_engine(
+    file_paths: list[str],
+    field: str,
+    item_ids: np.ndarray,
+    queries: np.ndarray,
+    expected: np.ndarray,
+    k: int,
+) -> dict[str, Any]:
+    start = time.perf_counter()
+    engine = LocalVectorEngine.from_parquet(file_paths, fields=[field])
+    load_seconds = time.perf_counter() - start
+    latencies = []
+    for query_vector in queries:
+        start = time.perf_counter()
+        engine.search(field, query_vector, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    start = time.perf_counter()
+    found, _ = engine.search_batch(field, queries, k)
+    batch_ms = (time.perf_counter() - start) * 1000
+    recalls = [
+        len(set(row.tolist()) & set(item_ids[expected_rows].tolist())) / k
+        for row, expected_rows in zip(found, expected)
+    ]
+    return {
+        f"recall@{k}": float(np.mean(recalls)),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "took_p50_ms": batch_ms / len(queries),
+        "index_size_mb": engine.vectors[field].nbytes / 1024 / 1024,
+        "load_s": load_seconds,
+    }
+
+
+def _main(
+    file_paths: list[str],
+    field: str,
+    variants: dict[str, dict],
+    num_queries: int,
+    k: int,
+    keep: bool,
+    local: bool,
+) -> None:
+    item_ids, vectors = read_embedding_matrix(file_paths, field)
+    rng = np.random.default_rng(0)
+    query_rows = rng.choice(len(vectors), size=min(num_queries, len(vectors)), replace=False)
+    queries = vectors[query_rows]
+    base_fields = get_vector_fields()
+    expected = _exact_neighbours(vectors, queries, base_fields[field].similarity, k)
+
+    results = {}
+    for name, overrides in variants.items():
+        vector_fields = {**base_fields, field: replace(base_fields[field], **overrides)}
+        em = ESManager(index_name=f"{ES_INDEX_NAME}-eval-{name}", vector_fields=vector_fields)
+        try:
+            load_seconds = _load_variant(em, file_paths)
+            results[name] = {
+                **_evaluate_variant(em, field, item_ids, queries, expected, k),
+                "load_s": load_seconds,
+            }
+        except (ApiError, TransportError) as e:
+            # e.g. an index type this Elasticsearch version doesn't support.
+            print(name, "failed:", e)
+            continue
+        finally:
+            if not keep:
+                em.es_client.indices.delete(index=em.index_name, ignore_unavailable=True)
+        print(name, json.dumps(results[name]))
+    if local:
+        # took_p50_ms is the per-query cost when all queries go in one batch.
+        results["local-exact"] = _evaluate_local_engine(
+            file_paths, field, item_ids, queries, expected, k
+        )
+        print("local-exact", json.dumps(results["local-exact"]))
+
+    if not results:
+        return
+    columns = list(next(iter(results.values())).keys())
+    print(f"\n{'variant':<20}" + "".join(f"{c:>15}" for c in columns))
+    for name, result in results.items():
+        print(f"{name:<20}" + "".join(f"{result[c]:>15.3f}" for c in columns))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Builds vector index variants and reports recall@k against exact "
+        "neighbours, kNN latency and index size"
+    )
+    parser.add_argument("file_paths", nargs="+", help="parquet files with embeddings")
+    parser.add_argument(
+        "--field", default="sbert_symmetric_embedding", choices=list(EMBEDDING_FIELDS.values())
+    )
+    parser.add_argument(
+        "--variants",
+        type=str,
+        help="JSON object of variant name -> index options, "
+        'e.g. {"int8": {"index_type": "int8_hnsw", "num_candidates": 200}} '
+        "(int8_hnsw needs Elasticsearch 8.12+)",
+    )
+    parser.add_argument("--num_queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--keep", action="store_true", help="don't delete the variant indices")
+    parser.add_argument(
+        "--local", action="store_true", help="also evaluate the in-process exact vector engine"
+    )
+    args = parser.parse_args()
+
+    _main(
+        args.file_paths,
+        args.field,
+        json.loads(args.variants) if args.variants else DEFAULT_VARIANTS,
+        args.num_queries,
+        args.k,
+        args.keep,
+        args.local,
+    )
@@ -1,62 +1,248 @@
+import argparse
+import os
+import time
 from typing import Any, Generator
 
-import pandas as pd
-
+from services.movies_reader import MOVIES_READER_BATCH_SIZE, MovieParquetReader
 from services.search import ESManager
+from services.search.es_manager import (
+    ES_BULK_CHUNK_SIZE,
+    ES_BULK_INITIAL_BACKOFF,
+    ES_BULK_MAX_CHUNK_BYTES,
+    ES_BULK_MAX_RETRIES,
+    ES_BULK_THREAD_COUNT,
+    ES_FORCEMERGE_MAX_NUM_SEGMENTS,
+    ES_INDEX_VERSIONS_TO_KEEP,
+    BulkChunkReport,
+    SyncReport,
+)
 
 
-def _get_movies(file_path: str) -> Generator[dict, Any, Any]:
-    df = pd.read_parquet(file_path)
-    df.drop(
-        columns=[
-            "vote_count",
-            "release_date",
-            "created_at",
-            "timestamp",
-            "original_language",
-            "collection",
-            "producers",
-            "production_countries",
-            "tagline",
-            "adult",
-            "avg_cast_popularity",
-            "avg_crew_popularity",
-        ],
-        inplace=True,
-    )
-    df.rename(columns={"protagonist": "protagonists"}, inplace=True)
-    df["protagonists"] = df["protagonists"].apply(lambda x: x.tolist())
-    df["genres"] = df["genres"].apply(lambda x: x.tolist())
-    df["openai_embedding"] = df["openai_embedding"].apply(lambda x: x.tolist())
-    df["sbert_symmetric_embedding"] = df["sbert_symmetric_embedding"].apply(
-        lambda x: x.tolist()
-    )
-    df["sbert_asymmetric_embedding"] = df["sbert_asymmetric_embedding"].apply(
-        lambda x: x.tolist()
-    )
-    for _, row in df.iterrows():
-        movie_dict = row.to_dict()
-        movie_dict['title_completion'] = {'input': movie_dict['title'], 'weight': int(movie_dict['popularity'])}
-        yield movie_dict
-
-
-def _main(file_paths: list[str]) -> None:
-    em = ESManager()
-    em.create_index(drop_index_if_exists=True)
-    count = 0
+DATA_FOLDER = "/data"
+# What embeddings_generator/gen_movie_embeddings.py writes (OUTPUT_FILE_NAME),
+# as Arrow IPC with --vector_dtype float16.
+MOVIES_FILE_NAMES = ["movies_with_embeddings.parquet", "movies_with_embeddings.arrow"]
+# What its per_row mode writes, one file per 1000 movies.
+PER_ROW_SLICES = [(0, 1), (1, 2), (2, 3), (3, 4), (4, 5), (5, 6), (6, 7)]
+PER_ROW_SLICE_SIZE = 1000
+
+
+def _default_file_paths() -> list[str]:
+    # The most recently generated one when both exist.
+    existing = [
+        name for name in MOVIES_FILE_NAMES if os.path.exists(os.path.join(DATA_FOLDER, name))
+    ]
+    if not existing:
+        return MOVIES_FILE_NAMES[:1]
+    return [max(existing, key=lambda name: os.path.getmtime(os.path.join(DATA_FOLDER, name)))]
+
+
+def _per_row_file_paths() -> list[str]:
+    return [
+        f"movies_with_embeddings_{start * PER_ROW_SLICE_SIZE}-{end * PER_ROW_SLICE_SIZE}.parquet"
+        for start, end in PER_ROW_SLICES
+    ]
+
+
+def _print_chunk_report(chunk_report: BulkChunkReport) -> None:
+    print(
+        f"Chunk {chunk_report.chunk_number}: {chunk_report.documents - chunk_report.failed}"
+        f"/{chunk_report.documents} movies uploaded in {chunk_report.elapsed:.2f}s"
+    )
+    for error in chunk_report.errors[:5]:
+        print(f"  Failed: {error}")
+    if len(chunk_report.errors) > 5:
+        print(f"  ... and {len(chunk_report.errors) - 5} more errors")
+
+
+def _get_all_movies(
+    file_paths: list[str], reader: MovieParquetReader
+) -> Generator[dict, Any, Any]:
     for file_path in file_paths:
-        for movie in _get_movies(f"/data/{file_path}"):
-            em.save_document(movie)
-            count += 1
-            if count % 500 == 0:
-                print(f"Uploaded {count} movies into ES")
+        yield from reader.iter_documents(os.path.join(DATA_FOLDER, file_path))
+
+
+def _print_sync_report(report: SyncReport, index_name: str) -> None:
+    print(
+        f"Scanned {report.existing} indexed movies in {report.scan_elapsed:.2f}s: "
+        f"{report.unchanged} unchanged, {report.upserts} upserts, {report.deletes} deletes"
+    )
+    print(
+        f"Synced {index_name} in {report.elapsed:.2f}s, {report.bulk.indexed}"
+        f"/{report.bulk.documents} bulk operations succeeded in {report.bulk.chunks} chunks"
+    )
+    if report.bulk.failed:
+        print(
+            f"{report.bulk.failed} operations failed in chunks "
+            f"{[c.chunk_number for c in report.bulk.failed_chunks]}"
+        )
+
+
+def _sync(
+    file_paths: list[str],
+    delete_missing: bool = True,
+    chunk_size: int = ES_BULK_CHUNK_SIZE,
+    max_chunk_bytes: int = ES_BULK_MAX_CHUNK_BYTES,
+    thread_count: int = ES_BULK_THREAD_COUNT,
+    max_retries: int = ES_BULK_MAX_RETRIES,
+    initial_backoff: float = ES_BULK_INITIAL_BACKOFF,
+    read_batch_size: int = MOVIES_READER_BATCH_SIZE,
+) -> None:
+    # Updates the index behind the alias in place, no new version.
+    reader = MovieParquetReader(batch_size=read_batch_size)
+    em = ESManager()
+    report = em.sync_documents(
+        _get_all_movies(file_paths, reader),
+        delete_missing=delete_missing,
+        chunk_size=chunk_size,
+        max_chunk_bytes=max_chunk_bytes,
+        thread_count=thread_count,
+        max_retries=max_retries,
+        initial_backoff=initial_backoff,
+        on_chunk=_print_chunk_report,
+    )
+    _print_sync_report(report, em.index_name)
+    print(f"Read {reader.stats}")
+
+
+def _main(
+    file_paths: list[str],
+    chunk_size: int = ES_BULK_CHUNK_SIZE,
+    max_chunk_bytes: int = ES_BULK_MAX_CHUNK_BYTES,
+    thread_count: int = ES_BULK_THREAD_COUNT,
+    max_retries: int = ES_BULK_MAX_RETRIES,
+    initial_backoff: float = ES_BULK_INITIAL_BACKOFF,
+    read_batch_size: int = MOVIES_READER_BATCH_SIZE,
+    max_num_segments: int = ES_FORCEMERGE_MAX_NUM_SEGMENTS,
+    keep_versions: int = ES_INDEX_VERSIONS_TO_KEEP,
+    swap: bool = True,
+    allow_failures: bool = False,
+) -> None:
+    reader = MovieParquetReader(batch_size=read_batch_size)
+    em = ESManager()
+    # The alias keeps serving the current version until the new one is loaded
+    # and merged.
+    version = em.create_index_version()
+    print(f"Loading into {version.index_name}")
+    with version.bulk_load_settings():
+        report = version.bulk_save_documents(
+            _get_all_movies(file_paths, reader),
+            chunk_size=chunk_size,
+            max_chunk_bytes=max_chunk_bytes,
+            thread_count=thread_count,
+            max_retries=max_retries,
+            initial_backoff=initial_backoff,
+            on_chunk=_print_chunk_report,
+        )
+    print(
+        f"Uploaded {report.indexed}/{report.documents} movies into ES in "
+        f"{report.chunks} chunks ({report.elapsed:.2f}s, "
+        f"{report.documents / max(report.elapsed, 1e-9):.0f} docs/s)"
+    )
+    print(f"Read {reader.stats}")
+    if report.failed:
+        print(
+            f"{report.failed} movies failed in chunks "
+            f"{[c.chunk_number for c in report.failed_chunks]}"
+        )
+        if not allow_failures:
+            # A partly loaded version must not go live.
+            raise SystemExit(
+                f"Not merging or swapping {version.index_name}, {em.index_name} still "
+                f"points to {em.get_alias_indices()}"
+            )
+
+    start = time.perf_counter()
+    version.optimize_segments(max_num_segments)
+    print(
+        f"Merged {version.index_name} to {max_num_segments} segments "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+    if not swap:
+        print(f"Not swapping, {em.index_name} still points to {em.get_alias_indices()}")
+        return
+    em.swap_alias(version.index_name)
+    print(f"{em.index_name} now points to {version.index_name}")
+    for deleted in em.delete_old_versions(keep_versions):
+        print(f"Deleted {deleted}")
 
 
 if __name__ == "__main__":
-    batches = [(0, 1), (1, 2), (2, 3), (3, 4), (4, 5), (5, 6), (6, 7)]
-    batch_size = 1000
-    file_paths = [
-        f"movies_with_embeddings_{b[0]*batch_size}-{b[1]*batch_size if b[1] else None}.parquet"
-        for b in batches
-    ]
-    _main(file_paths)
+    parser = argparse.ArgumentParser(description="Loads the movies into Elasticsearch")
+    parser.add_argument(
+        "file_paths",
+        nargs="*",
+        help="parquet or Arrow IPC files inside /data, defaults to the "
+        "movies_with_embeddings file gen_movie_embeddings.py writes",
+    )
+    parser.add_argument(
+        "--per_row_slices",
+        action="store_true",
+        help="load the movies_with_embeddings_<start>-<end>.parquet files of the "
+        "per_row generation mode instead",
+    )
+    parser.add_argument("--chunk_size", type=int, default=ES_BULK_CHUNK_SIZE)
+    parser.add_argument("--max_chunk_bytes", type=int, default=ES_BULK_MAX_CHUNK_BYTES)
+    parser.add_argument("--threads", type=int, default=ES_BULK_THREAD_COUNT)
+    parser.add_argument("--max_retries", type=int, default=ES_BULK_MAX_RETRIES)
+    parser.add_argument("--initial_backoff", type=float, default=ES_BULK_INITIAL_BACKOFF)
+    parser.add_argument("--read_batch_size", type=int, default=MOVIES_READER_BATCH_SIZE)
+    parser.add_argument(
+        "--max_num_segments", type=int, default=ES_FORCEMERGE_MAX_NUM_SEGMENTS
+    )
+    parser.add_argument(
+        "--keep_versions",
+        type=int,
+        default=ES_INDEX_VERSIONS_TO_KEEP,
+        help="index versions kept for rollback, including the new one",
+    )
+    parser.add_argument(
+        "--no_swap", action="store_true", help="load and merge without swapping the alias"
+    )
+    parser.add_argument(
+        "--allow_failures",
+        action="store_true",
+        help="merge and swap the new version even if some movies failed to load",
+    )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="only upsert changed movies and delete removed ones in the current index",
+    )
+    parser.add_argument(
+        "--no_delete",
+        action="store_true",
+        help="with --sync, keep movies missing from the files (documents without a "
+        "content fingerprint, loaded before syncing existed, are still replaced)",
+    )
+    args = parser.parse_args()
+    if args.per_row_slices:
+        file_paths = _per_row_file_paths()
+    else:
+        file_paths = args.file_paths or _default_file_paths()
+
+    if args.sync:
+        _sync(
+            file_paths,
+            delete_missing=not args.no_delete,
+            chunk_size=args.chunk_size,
+            max_chunk_bytes=args.max_chunk_bytes,
+            thread_count=args.threads,
+            max_retries=args.max_retries,
+            initial_backoff=args.initial_backoff,
+            read_batch_size=args.read_batch_size,
+        )
+    else:
+        _main(
+            file_paths,
+            chunk_size=args.chunk_size,
+            max_chunk_bytes=args.max_chunk_bytes,
+            thread_count=args.threads,
+            max_retries=args.max_retries,
+            initial_backoff=args.initial_backoff,
+            read_batch_size=args.read_batch_size,
+            max_num_segments=args.max_num_segments,
+            keep_versions=args.keep_versions,
+            swap=not args.no_swap,
+            allow_failures=args.allow_failures,
+        )
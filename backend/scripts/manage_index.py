@@ -0,0 +1,54 @@
+import argparse
+
+from services.search import ESManager
+from services.search.es_manager import ES_INDEX_VERSIONS_TO_KEEP
+
+
+def _list(em: ESManager) -> None:
+    current = em.get_alias_indices()
+    for version in em.list_index_versions():
+        print(f"{'*' if version in current else ' '} {version}")
+
+
+def _rollback(em: ESManager, index_name: str | None) -> None:
+    previous = em.get_alias_indices()
+    current = em.rollback(index_name)
+    print(f"{em.index_name}: {previous} -> {current}")
+
+
+def _swap(em: ESManager, index_name: str) -> None:
+    previous = em.get_alias_indices()
+    em.swap_alias(index_name)
+    print(f"{em.index_name}: {previous} -> {index_name}")
+
+
+def _cleanup(em: ESManager, keep: int) -> None:
+    for deleted in em.delete_old_versions(keep):
+        print(f"Deleted {deleted}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Manages the versioned indices behind the movies alias"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="list versions, * marks the live one")
+    rollback_parser = subparsers.add_parser(
+        "rollback", help="point the alias back to the previous version"
+    )
+    rollback_parser.add_argument("index_name", nargs="?", help="a specific version")
+    swap_parser = subparsers.add_parser("swap", help="point the alias to a version")
+    swap_parser.add_argument("index_name")
+    cleanup_parser = subparsers.add_parser("cleanup", help="delete old versions")
+    cleanup_parser.add_argument("--keep", type=int, default=ES_INDEX_VERSIONS_TO_KEEP)
+    args = parser.parse_args()
+
+    em = ESManager()
+    if args.command == "list":
+        _list(em)
+    elif args.command == "rollback":
+        _rollback(em, args.index_name)
+    elif args.command == "swap":
+        _swap(em, args.index_name)
+    else:
+        _cleanup(em, args.keep)
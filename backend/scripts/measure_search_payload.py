@@ -0,0 +1,115 @@
+import argparse
+import json
+import statistics
+import time
+from typing import Any, Callable, Mapping
+
+from fastapi.responses import JSONResponse
+
+from api.schemas import Movie, MovieSearchParams, MoviesResponse
+from services.search import ESManager, SearchManager
+from services.search.search_manager import MOVIE_SOURCE_FIELDS
+
+
+DEFAULT_QUERIES = ["star wars", "love", "the lord of the rings", "space adventure"]
+
+
+def _timed(func: Callable[[], Any], repeat: int) -> tuple[Any, list[float]]:
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return result, timings
+
+
+def _validated_response(sm: SearchManager, response: Any, params: MovieSearchParams) -> bytes:
+    # What the router used to do: build MoviesResponse, then let FastAPI
+    # validate it again against response_model before rendering it.
+    movies, total, _, _, _ = sm._parse_search_response(response)
+    movies_response = MoviesResponse(
+        total=total,
+        size=params.size,
+        offset=params.offset,
+        movies=[Movie(**movie) for movie in movies],
+    )
+    return JSONResponse(MoviesResponse(**movies_response.dict()).dict()).body
+
+
+def _fast_response(sm: SearchManager, response: Any, params: MovieSearchParams) -> bytes:
+    movies, total, _, _, _ = sm._parse_search_response(response)
+    return JSONResponse(
+        {"total": total, "size": params.size, "offset": params.offset, "movies": movies}
+    ).body
+
+
+def _measure(
+    sm: SearchManager,
+    em: ESManager,
+    index_name: str,
+    params: MovieSearchParams,
+    source: Mapping[str, Any] | None,
+    render: Callable[[SearchManager, Any, MovieSearchParams], bytes],
+    repeat: int,
+) -> dict:
+    query = sm._get_lexical_query(params)
+    response, search_timings = _timed(
+        lambda: em.es_client.search(
+            index=index_name, query=query, source=source, size=params.size
+        ),
+        repeat,
+    )
+    _, render_timings = _timed(lambda: render(sm, response, params), repeat)
+    return {
+        "payload_bytes": len(json.dumps(response.body)),
+        "search_ms": statistics.median(search_timings),
+        "render_ms": statistics.median(render_timings),
+    }
+
+
+def _vectors_in_source(em: ESManager, index_name: str) -> bool:
+    mappings = em.es_client.indices.get_mapping(index=index_name)
+    # index_name may be the alias, keyed by the index behind it.
+    mapping = next(iter(mappings.values()))["mappings"]
+    return not set(mapping.get("_source", {}).get("excludes", [])) >= set(em.vector_fields)
+
+
+def _main(queries: list[str], size: int, repeat: int, before_index: str | None) -> None:
+    sm = SearchManager()
+    em = ESManager()
+    before_index = before_index or em.index_name
+    if not _vectors_in_source(em, before_index):
+        print(
+            f"Note: {before_index} excludes the vectors from _source, so 'before' doesn't "
+            "include their payload; pass --before_index with a version loaded with "
+            "ES_EXCLUDE_VECTORS_FROM_SOURCE=false to measure it"
+        )
+    print(f"{'query':<25}{'variant':<8}{'payload KB':>12}{'search ms':>12}{'render ms':>12}")
+    for query in queries:
+        params = MovieSearchParams(search=query, size=size, genres_in=[], genres_out=[])
+        for variant, index_name, source, render in [
+            ("before", before_index, None, _validated_response),
+            ("after", em.index_name, {"includes": MOVIE_SOURCE_FIELDS}, _fast_response),
+        ]:
+            result = _measure(sm, em, index_name, params, source, render, repeat)
+            print(
+                f"{query!r:<25}{variant:<8}{result['payload_bytes'] / 1024:>12.1f}"
+                f"{result['search_ms']:>12.2f}{result['render_ms']:>12.2f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compares search payload size and latency with and without _source filtering"
+    )
+    parser.add_argument("queries", nargs="*", default=DEFAULT_QUERIES)
+    parser.add_argument("--size", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument(
+        "--before_index",
+        help="index or alias searched without _source filtering, defaults to the alias",
+    )
+    args = parser.parse_args()
+
+    _main(args.queries, args.size, args.repeat, args.before_index)
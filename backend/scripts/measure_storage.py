@@ -0,0 +1,105 @@
+import argparse
+import os
+import tempfile
+import time
+from typing import Callable
+
+from services.movies_reader import (
+    MovieParquetReader,
+    read_embedding_matrix,
+    read_schema,
+    read_table,
+    to_fixed_size_vectors,
+    write_movies_table,
+)
+from services.search import ESManager
+from services.search.vector_engine import VECTOR_ENGINE_FIELDS
+
+
+def _timed(func: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def _convert(file_path: str, output_path: str, dtype: str) -> None:
+    table = read_table(file_path)
+    for field in VECTOR_ENGINE_FIELDS:
+        if field in table.column_names:
+            vectors = to_fixed_size_vectors(table.column(field), dtype)
+            table = table.set_column(table.column_names.index(field), field, vectors)
+    write_movies_table(table, output_path)
+
+
+def _measure_file(file_path: str) -> dict:
+    fields = [f for f in VECTOR_ENGINE_FIELDS if f in read_schema(file_path).names]
+    reader = MovieParquetReader()
+    return {
+        "size_mb": os.path.getsize(file_path) / 2**20,
+        # What LocalVectorEngine and eval_knn do with the files.
+        "matrix_s": _timed(lambda: [read_embedding_matrix([file_path], f) for f in fields]),
+        # What load_es does before sending the documents.
+        "documents_s": _timed(lambda: sum(1 for _ in reader.iter_documents(file_path))),
+    }
+
+
+def _report_files(file_paths: list[str]) -> None:
+    print(f"{'file':<45}{'variant':<16}{'MB':>10}{'matrix s':>12}{'docs s':>10}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for file_path in file_paths:
+            name = os.path.splitext(os.path.basename(file_path))[0]
+            variants = {"original": file_path}
+            for dtype, extension in [("float32", ".parquet"), ("float16", ".arrow")]:
+                variants[f"fixed {dtype}"] = os.path.join(tmp_dir, f"{name}-{dtype}{extension}")
+                _convert(file_path, variants[f"fixed {dtype}"], dtype)
+            for variant, variant_path in variants.items():
+                result = _measure_file(variant_path)
+                print(
+                    f"{os.path.basename(file_path):<45}{variant:<16}{result['size_mb']:>10.1f}"
+                    f"{result['matrix_s']:>12.3f}{result['documents_s']:>10.3f}"
+                )
+
+
+def _report_indices(index_names: list[str] | None) -> None:
+    em = ESManager()
+    # Versions loaded before and after a mapping change sit side by side until
+    # the old one is cleaned up, which makes them directly comparable.
+    index_names = index_names or em.list_index_versions() or [em.index_name]
+    serving = set(em.get_alias_indices())
+    print(f"{'index':<45}{'docs':>10}{'store MB':>12}{'vectors in _source':>20}")
+    for index_name in index_names:
+        stats = em.get_storage_stats(index_name)
+        mapping = em.es_client.indices.get_mapping(index=index_name)[index_name]["mappings"]
+        excluded = set(mapping.get("_source", {}).get("excludes", []))
+        in_source = "no" if excluded >= set(em.vector_fields) else "yes"
+        marker = " *" if index_name in serving else ""
+        print(
+            f"{index_name + marker:<45}{stats['docs']:>10}"
+            f"{stats['store_bytes'] / 2**20:>12.1f}{in_source:>20}"
+        )
+
+
+def _main(file_paths: list[str], index_names: list[str] | None, indices: bool) -> None:
+    if file_paths:
+        _report_files(file_paths)
+    if indices:
+        _report_indices(index_names)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compares the on-disk size and read time of the movie files and indices "
+        "with list<float> vs fixed size float32/float16 vectors and with/without vectors in "
+        "_source"
+    )
+    parser.add_argument("file_paths", nargs="*", help="parquet or Arrow IPC movie files")
+    parser.add_argument(
+        "--index",
+        action="append",
+        dest="index_names",
+        help="indices to report, defaults to every version behind the alias",
+    )
+    parser.add_argument("--no_indices", action="store_true")
+    args = parser.parse_args()
+
+    _main(args.file_paths, args.index_names, indices=not args.no_indices)
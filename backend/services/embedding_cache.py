@@ -0,0 +1,165 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+
+import numpy as np
+
+
+EMBEDDINGS_CACHE_MAX_BYTES = int(
+    os.environ.get("EMBEDDINGS_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+)
+EMBEDDINGS_CACHE_TTL = float(os.environ.get("EMBEDDINGS_CACHE_TTL", 0)) or None
+EMBEDDINGS_CACHE_PATH = os.environ.get("EMBEDDINGS_CACHE_PATH")
+
+# Rough per-entry bookkeeping cost (key string, tuple, OrderedDict node) on top
+# of the vector itself, so the memory bound holds for short vectors too.
+_ENTRY_OVERHEAD_BYTES = 200
+
+
+# The SBERT tokenizers lowercase their input, so case only changes the
+# embedding of these types.
+CASE_SENSITIVE_EMBEDDING_TYPES = {"openai"}
+# Bumped when the key of an existing entry changes; version 1 stopped
+# lowercasing the keys of CASE_SENSITIVE_EMBEDDING_TYPES.
+_STORE_KEY_VERSION = 1
+
+
+def normalize_text(text: str, embedding_type: str | None = None) -> str:
+    text = " ".join(text.split())
+    return text if embedding_type in CASE_SENSITIVE_EMBEDDING_TYPES else text.lower()
+
+
+@dataclass
+class EmbeddingCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    shared_hits: int = 0
+    entries: int = 0
+    bytes: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def to_dict(self) -> dict:
+        return {**asdict(self), "hit_rate": self.hit_rate}
+
+
+class SQLiteEmbeddingStore:
+    def __init__(self, path: str, ttl: float | None = None) -> None:
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=1)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT NOT NULL, type TEXT NOT NULL, vector BLOB NOT NULL, "
+            "created_at REAL NOT NULL, PRIMARY KEY (key, type))"
+        )
+        (key_version,) = self._connection.execute("PRAGMA user_version").fetchone()
+        if key_version < _STORE_KEY_VERSION:
+            # Their lowercased keys could serve one casing's vector for another.
+            self._connection.executemany(
+                "DELETE FROM embeddings WHERE type = ?",
+                [(t,) for t in CASE_SENSITIVE_EMBEDDING_TYPES],
+            )
+            self._connection.execute(f"PRAGMA user_version = {_STORE_KEY_VERSION}")
+        self._connection.commit()
+
+    def get(self, key: str, embedding_type: str) -> np.ndarray | None:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT vector, created_at FROM embeddings WHERE key = ? AND type = ?",
+                (key, embedding_type),
+            ).fetchone()
+        if row is None or (self.ttl and time.time() - row[1] > self.ttl):
+            return None
+        return np.frombuffer(row[0], dtype="<f4")
+
+    def put(self, key: str, embedding_type: str, vector: np.ndarray) -> None:
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)",
+                (key, embedding_type, vector.astype("<f4").tobytes(), time.time()),
+            )
+            self._connection.commit()
+
+
+class EmbeddingCache:
+    def __init__(
+        self,
+        max_bytes: int = EMBEDDINGS_CACHE_MAX_BYTES,
+        ttl: float | None = EMBEDDINGS_CACHE_TTL,
+        shared_store: SQLiteEmbeddingStore | None = None,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.shared_store = shared_store
+        self.stats = EmbeddingCacheStats()
+        self._entries: OrderedDict[tuple[str, str], tuple[np.ndarray, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry_size(self, vector: np.ndarray) -> int:
+        return vector.nbytes + _ENTRY_OVERHEAD_BYTES
+
+    def _put_in_memory(self, key: tuple[str, str], vector: np.ndarray) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl else float("inf")
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.stats.bytes -= self._entry_size(previous[0])
+            self._entries[key] = (vector, expires_at)
+            self.stats.bytes += self._entry_size(vector)
+            while self.stats.bytes > self.max_bytes and self._entries:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.stats.bytes -= self._entry_size(evicted)
+                self.stats.evictions += 1
+            self.stats.entries = len(self._entries)
+
+    def get(self, text: str, embedding_type: str) -> np.ndarray | None:
+        key = (normalize_text(text, embedding_type), embedding_type)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.stats.hits += 1
+                return entry[0]
+            if entry is not None:
+                # Expired, free its share of max_bytes now rather than at eviction.
+                del self._entries[key]
+                self.stats.bytes -= self._entry_size(entry[0])
+                self.stats.entries = len(self._entries)
+        if self.shared_store is not None:
+            vector = self.shared_store.get(*key)
+            if vector is not None:
+                self._put_in_memory(key, vector)
+                with self._lock:
+                    self.stats.hits += 1
+                    self.stats.shared_hits += 1
+                return vector
+        with self._lock:
+            self.stats.misses += 1
+        return None
+
+    def put(
+        self, text: str, embedding_type: str, vector: np.ndarray | list[float]
+    ) -> np.ndarray:
+        key = (normalize_text(text, embedding_type), embedding_type)
+        vector = np.asarray(vector, dtype=np.float32)
+        self._put_in_memory(key, vector)
+        if self.shared_store is not None:
+            self.shared_store.put(*key, vector)
+        return vector
+
+
+def build_embedding_cache() -> EmbeddingCache:
+    shared_store = None
+    if EMBEDDINGS_CACHE_PATH:
+        shared_store = SQLiteEmbeddingStore(EMBEDDINGS_CACHE_PATH, ttl=EMBEDDINGS_CACHE_TTL)
+    return EmbeddingCache(shared_store=shared_store)
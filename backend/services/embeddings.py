@@ -1,13 +1,35 @@
-from functools import lru_cache
+import asyncio
+import json
+import os
+import time
 from enum import Enum
 
+import aiohttp
+import numpy as np
 import openai
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from services.embedding_cache import build_embedding_cache
+from services.metrics import EMBEDDING_REQUEST_ERRORS, EMBEDDING_REQUEST_SECONDS
 
-EMBEDDINGS_GENERATOR_URL = "http://embeddings-generator:3000/embedding"
+
+EMBEDDINGS_GENERATOR_URL = os.environ.get(
+    "EMBEDDINGS_GENERATOR_URL", "http://embeddings-generator:8080/embedding"
+)
 OPENAI_EMBEDDING_MODEL = "text-embedding-ada-002"
 
+EMBEDDINGS_GENERATOR_POOL_SIZE = 20
+EMBEDDINGS_GENERATOR_CONNECT_TIMEOUT = 1.0
+EMBEDDINGS_GENERATOR_READ_TIMEOUT = 5.0
+EMBEDDINGS_GENERATOR_RETRIES = 2
+EMBEDDINGS_GENERATOR_RETRY_BACKOFF = 0.1
+EMBEDDINGS_GENERATOR_RETRY_STATUSES = (502, 503, 504)
+# Negotiated with the generator through the Accept header, see
+# embeddings_generator/main.py. JSON is still understood as a fallback.
+FLOAT32_MEDIA_TYPE = "application/x-float32"
+
 
 class EmbeddingType(str, Enum):
     OPENAI = "openai"
@@ -15,17 +37,139 @@ class EmbeddingType(str, Enum):
     ASYMMETRIC = "asymmetric"
 
 
-@lru_cache()
+embeddings_cache = build_embedding_cache()
+_aiohttp_session: aiohttp.ClientSession | None = None
+
+
+def _decode_embedding(content_type: str, body: bytes) -> np.ndarray:
+    if content_type.startswith(FLOAT32_MEDIA_TYPE):
+        return np.frombuffer(body, dtype="<f4")
+    return np.asarray(json.loads(body)["embedding"], dtype=np.float32)
+
+
+def _build_session() -> requests.Session:
+    retries = Retry(
+        total=EMBEDDINGS_GENERATOR_RETRIES,
+        backoff_factor=EMBEDDINGS_GENERATOR_RETRY_BACKOFF,
+        status_forcelist=EMBEDDINGS_GENERATOR_RETRY_STATUSES,
+        allowed_methods=["POST"],
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=EMBEDDINGS_GENERATOR_POOL_SIZE,
+        max_retries=retries,
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Accept": f"{FLOAT32_MEDIA_TYPE}, application/json"})
+    return session
+
+
+_session = _build_session()
+
+
+def _get_sbert_embedding(text: str, embedding_type: EmbeddingType) -> np.ndarray:
+    response = _session.post(
+        EMBEDDINGS_GENERATOR_URL,
+        json={"text": text, "type": embedding_type},
+        timeout=(EMBEDDINGS_GENERATOR_CONNECT_TIMEOUT, EMBEDDINGS_GENERATOR_READ_TIMEOUT),
+    )
+    response.raise_for_status()
+    return _decode_embedding(response.headers.get("content-type", ""), response.content)
+
+
 def get_embedding_for_text(text: str, embedding_type: EmbeddingType) -> list[float]:
-    if embedding_type in [EmbeddingType.SYMMETRIC, EmbeddingType.ASYMMETRIC]:
-        sbert_response = requests.post(
-            EMBEDDINGS_GENERATOR_URL, json={"text": text, "type": embedding_type}
-        )
-        return sbert_response.json()["embedding"]
-    elif embedding_type == EmbeddingType.OPENAI:
-        openai_response = openai.Embedding.create(
-            input=text, model=OPENAI_EMBEDDING_MODEL
+    cached_embedding = embeddings_cache.get(text, embedding_type.value)
+    if cached_embedding is not None:
+        return cached_embedding.tolist()
+    embedding: np.ndarray | list[float]
+    start = time.perf_counter()
+    try:
+        if embedding_type in [EmbeddingType.SYMMETRIC, EmbeddingType.ASYMMETRIC]:
+            embedding = _get_sbert_embedding(text, embedding_type)
+        elif embedding_type == EmbeddingType.OPENAI:
+            openai_response = openai.Embedding.create(
+                input=text, model=OPENAI_EMBEDDING_MODEL
+            )
+            embedding = openai_response["data"][0]["embedding"]
+        else:
+            raise NotImplementedError
+    except Exception:
+        EMBEDDING_REQUEST_ERRORS.inc(emb_type=embedding_type.value)
+        raise
+    EMBEDDING_REQUEST_SECONDS.observe(
+        time.perf_counter() - start, emb_type=embedding_type.value
+    )
+    return embeddings_cache.put(text, embedding_type.value, embedding).tolist()
+
+
+def _get_aiohttp_session() -> aiohttp.ClientSession:
+    global _aiohttp_session
+    if _aiohttp_session is None or _aiohttp_session.closed:
+        _aiohttp_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=EMBEDDINGS_GENERATOR_POOL_SIZE),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=EMBEDDINGS_GENERATOR_CONNECT_TIMEOUT,
+                sock_read=EMBEDDINGS_GENERATOR_READ_TIMEOUT,
+            ),
+            headers={"Accept": f"{FLOAT32_MEDIA_TYPE}, application/json"},
         )
-        return openai_response["data"][0]["embedding"]
-    else:
-        raise NotImplementedError
+    return _aiohttp_session
+
+
+async def _aget_sbert_embedding(text: str, embedding_type: EmbeddingType) -> np.ndarray:
+    for attempt in range(EMBEDDINGS_GENERATOR_RETRIES + 1):
+        if attempt:
+            await asyncio.sleep(EMBEDDINGS_GENERATOR_RETRY_BACKOFF * 2 ** (attempt - 1))
+        last_attempt = attempt == EMBEDDINGS_GENERATOR_RETRIES
+        try:
+            async with _get_aiohttp_session().post(
+                EMBEDDINGS_GENERATOR_URL, json={"text": text, "type": embedding_type}
+            ) as sbert_response:
+                if (
+                    sbert_response.status in EMBEDDINGS_GENERATOR_RETRY_STATUSES
+                    and not last_attempt
+                ):
+                    continue
+                sbert_response.raise_for_status()
+                return _decode_embedding(
+                    sbert_response.headers.get("content-type", ""),
+                    await sbert_response.read(),
+                )
+        except aiohttp.ClientConnectionError:
+            if last_attempt:
+                raise
+    raise aiohttp.ClientError("Embeddings generator retries exhausted")
+
+
+async def aget_embedding_for_text(
+    text: str, embedding_type: EmbeddingType
+) -> list[float]:
+    cached_embedding = embeddings_cache.get(text, embedding_type.value)
+    if cached_embedding is not None:
+        return cached_embedding.tolist()
+    embedding: np.ndarray | list[float]
+    start = time.perf_counter()
+    try:
+        if embedding_type in [EmbeddingType.SYMMETRIC, EmbeddingType.ASYMMETRIC]:
+            embedding = await _aget_sbert_embedding(text, embedding_type)
+        elif embedding_type == EmbeddingType.OPENAI:
+            openai_response = await openai.Embedding.acreate(
+                input=text, model=OPENAI_EMBEDDING_MODEL
+            )
+            embedding = openai_response["data"][0]["embedding"]
+        else:
+            raise NotImplementedError
+    except Exception:
+        EMBEDDING_REQUEST_ERRORS.inc(emb_type=embedding_type.value)
+        raise
+    EMBEDDING_REQUEST_SECONDS.observe(
+        time.perf_counter() - start, emb_type=embedding_type.value
+    )
+    return embeddings_cache.put(text, embedding_type.value, embedding).tolist()
+
+
+async def close_async_clients() -> None:
+    if _aiohttp_session is not None and not _aiohttp_session.closed:
+        await _aiohttp_session.close()
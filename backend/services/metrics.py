@@ -0,0 +1,182 @@
+import threading
+from bisect import bisect_left
+from typing import Callable, Iterable
+
+
+# Recording is a bisect and a couple of additions under a lock; the
+# Prometheus text is only rendered when /metrics is scraped.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+def _format_labels(
+    labelnames: tuple[str, ...], values: tuple[str, ...], extra: str = ""
+) -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple([labels[name] for name in self.labelnames])
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = buckets
+        # label values -> (per-bucket counts with a trailing +Inf bucket, sum)
+        self._series: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple([labels[name] for name in self.labelnames])
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][index] += 1
+            series[1][0] += value
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [
+                (key, list(counts), total[0]) for key, (counts, total) in self._series.items()
+            ]
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.labelnames, key, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: list[Counter | Histogram] = []
+        # Called at scrape time for values that already live elsewhere (e.g.
+        # cache stats), so the hot path doesn't record them twice.
+        self._collectors: list[Callable[[], list[str]]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        counter = Counter(name, documentation, labelnames)
+        self._metrics.append(counter)
+        return counter
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        histogram = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(histogram)
+        return histogram
+
+    def add_collector(self, collector: Callable[[], list[str]]) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        for collector in self._collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+def stats_collector(
+    prefix: str, get_stats: Callable[[], dict], gauges: Iterable[str] = ()
+) -> Callable[[], list[str]]:
+    # Exposes a stats dict (e.g. EmbeddingCacheStats.to_dict()) as counters,
+    # except the keys listed in gauges.
+    gauges = set(gauges)
+
+    def collect() -> list[str]:
+        lines = []
+        for key, value in get_stats().items():
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                continue
+            kind = "gauge" if key in gauges else "counter"
+            name = f"{prefix}_{key}" if kind == "gauge" else f"{prefix}_{key}_total"
+            lines.extend([f"# TYPE {name} {kind}", f"{name} {value}"])
+        return lines
+
+    return collect
+
+
+REGISTRY = MetricsRegistry()
+
+SEARCH_REQUEST_SECONDS = REGISTRY.histogram(
+    "charla_search_request_seconds",
+    "/movies latency, including the search result cache",
+    ["mode", "emb_type", "suggestions"],
+)
+SEARCH_STAGE_SECONDS = REGISTRY.histogram(
+    "charla_search_stage_seconds",
+    "Time spent per search stage",
+    ["mode", "stage"],
+)
+ES_REQUEST_SECONDS = REGISTRY.histogram(
+    "charla_es_request_seconds",
+    "Elasticsearch request wall time as seen by the client",
+    ["operation"],
+)
+ES_TOOK_SECONDS = REGISTRY.histogram(
+    "charla_es_took_seconds",
+    "Elasticsearch reported took",
+    ["operation"],
+)
+EMBEDDING_REQUEST_SECONDS = REGISTRY.histogram(
+    "charla_embedding_request_seconds",
+    "Embedding requests that missed the cache",
+    ["emb_type"],
+)
+EMBEDDING_REQUEST_ERRORS = REGISTRY.counter(
+    "charla_embedding_request_errors_total",
+    "Embedding requests that failed",
+    ["emb_type"],
+)
+SEARCH_DEGRADED = REGISTRY.counter(
+    "charla_search_degraded_total",
+    "Hybrid searches answered with lexical results only",
+    ["mode", "reason"],
+)
+COMPLETION_REFRESH_ERRORS = REGISTRY.counter(
+    "charla_completion_refresh_errors_total",
+    "Failed builds of the local completion index",
+)
@@ -0,0 +1,201 @@
+import time
+from dataclasses import dataclass
+from typing import Any, Iterator
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+
+MOVIES_READER_BATCH_SIZE = 256
+# float16 vectors can't be written to parquet by this pyarrow, they are kept in
+# Arrow IPC files instead, which are memory-mapped rather than decoded.
+ARROW_IPC_SUFFIXES = (".arrow", ".feather")
+
+# Parquet column name -> document field name.
+MOVIE_COLUMNS = {
+    "tmdbId": "tmdbId",
+    "item_id": "item_id",
+    "title": "title",
+    "year": "year",
+    "overview": "overview",
+    "runtime": "runtime",
+    "genres": "genres",
+    "vote_average": "vote_average",
+    "director": "director",
+    "protagonist": "protagonists",
+    "backdrop_path": "backdrop_path",
+    "poster_path": "poster_path",
+    "popularity": "popularity",
+    "openai_embedding": "openai_embedding",
+    "sbert_symmetric_embedding": "sbert_symmetric_embedding",
+    "sbert_asymmetric_embedding": "sbert_asymmetric_embedding",
+}
+
+
+@dataclass
+class ReaderStats:
+    files: int = 0
+    batches: int = 0
+    rows: int = 0
+    bytes: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.bytes / 1024 / 1024 / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.rows} rows in {self.batches} batches from {self.files} files, "
+            f"{self.bytes / 1024 / 1024:.1f} MB in {self.elapsed:.2f}s "
+            f"({self.rows_per_second:.0f} rows/s, {self.mb_per_second:.1f} MB/s)"
+        )
+
+
+def _column_to_pylist(column: pa.Array) -> list[Any]:
+    # Fixed length numeric lists (the embeddings) are converted with a single
+    # numpy reshape + tolist instead of boxing every list through pyarrow scalars.
+    if pa.types.is_fixed_size_list(column.type) and column.null_count == 0:
+        values = column.flatten().to_numpy(zero_copy_only=False)
+        return values.reshape(len(column), column.type.list_size).tolist()
+    if (
+        pa.types.is_list(column.type)
+        and pa.types.is_floating(column.type.value_type)
+        and column.null_count == 0
+        and len(column) > 0
+    ):
+        offsets = column.offsets.to_numpy()
+        lengths = np.diff(offsets)
+        if (lengths == lengths[0]).all():
+            values = column.values[offsets[0] : offsets[-1]].to_numpy(
+                zero_copy_only=False
+            )
+            return values.reshape(len(column), lengths[0]).tolist()
+    return column.to_pylist()
+
+
+def is_arrow_ipc(file_path: str) -> bool:
+    return file_path.endswith(ARROW_IPC_SUFFIXES)
+
+
+def read_schema(file_path: str) -> pa.Schema:
+    if is_arrow_ipc(file_path):
+        return pa.ipc.open_file(pa.memory_map(file_path)).schema
+    return pq.read_schema(file_path)
+
+
+def read_table(file_path: str, columns: list[str] | None = None) -> pa.Table:
+    if is_arrow_ipc(file_path):
+        table = pa.ipc.open_file(pa.memory_map(file_path)).read_all()
+        return table.select(columns) if columns else table
+    return pq.read_table(file_path, columns=columns)
+
+
+def to_fixed_size_vectors(column: pa.ChunkedArray | pa.Array, dtype: str = "float32") -> pa.Array:
+    # list<float> -> fixed_size_list<dtype>, which converts to a (rows, dims)
+    # numpy array without copying per row.
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    if pa.types.is_fixed_size_list(column.type):
+        dims = column.type.list_size
+        values = column.flatten()
+    else:
+        offsets = column.offsets.to_numpy()
+        dims = int(offsets[1] - offsets[0]) if len(column) else 0
+        values = column.values[offsets[0] : offsets[-1]]
+    values = values.to_numpy(zero_copy_only=False).astype(dtype, copy=False)
+    return pa.FixedSizeListArray.from_arrays(pa.array(values), dims)
+
+
+def write_movies_table(table: pa.Table, file_path: str, row_group_size: int = 1000) -> None:
+    if is_arrow_ipc(file_path):
+        with pa.OSFile(file_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=row_group_size)
+    else:
+        pq.write_table(table, file_path, row_group_size=row_group_size)
+
+
+class MovieParquetReader:
+    def __init__(
+        self,
+        batch_size: int = MOVIES_READER_BATCH_SIZE,
+        columns: dict[str, str] | None = None,
+    ) -> None:
+        self.batch_size = batch_size
+        self.columns = columns or MOVIE_COLUMNS
+        self.stats = ReaderStats()
+
+    def iter_batches(self, file_path: str) -> Iterator[pa.RecordBatch]:
+        columns = [c for c in self.columns if c in read_schema(file_path).names]
+        self.stats.files += 1
+        if is_arrow_ipc(file_path):
+            batches = iter(read_table(file_path, columns).to_batches(self.batch_size))
+        else:
+            batches = pq.ParquetFile(file_path).iter_batches(
+                batch_size=self.batch_size, columns=columns
+            )
+        while True:
+            start = time.perf_counter()
+            batch = next(batches, None)
+            self.stats.elapsed += time.perf_counter() - start
+            if batch is None:
+                return
+            self.stats.batches += 1
+            self.stats.rows += batch.num_rows
+            self.stats.bytes += batch.nbytes
+            yield batch
+
+    def _batch_to_documents(self, batch: pa.RecordBatch) -> list[dict]:
+        names = [self.columns[name] for name in batch.schema.names]
+        values = [_column_to_pylist(column) for column in batch.columns]
+        if "title" in batch.schema.names and "popularity" in batch.schema.names:
+            weights = pc.cast(
+                pc.fill_null(batch.column("popularity"), 0), pa.int64(), safe=False
+            ).to_pylist()
+            names.append("title_completion")
+            values.append(
+                [
+                    {"input": title, "weight": weight}
+                    for title, weight in zip(batch.column("title").to_pylist(), weights)
+                ]
+            )
+        return [dict(zip(names, row)) for row in zip(*values)]
+
+    def iter_documents(self, file_path: str) -> Iterator[dict]:
+        for batch in self.iter_batches(file_path):
+            start = time.perf_counter()
+            documents = self._batch_to_documents(batch)
+            self.stats.elapsed += time.perf_counter() - start
+            yield from documents
+
+
+def _vector_column_to_numpy(column: pa.Array) -> np.ndarray:
+    if pa.types.is_fixed_size_list(column.type):
+        dims = column.type.list_size
+        values = column.flatten()
+    else:
+        offsets = column.offsets.to_numpy()
+        dims = int(offsets[1] - offsets[0]) if len(column) else 0
+        values = column.values[offsets[0] : offsets[-1]]
+    return values.to_numpy(zero_copy_only=False).astype(np.float32, copy=False).reshape(
+        len(column), dims
+    )
+
+
+def read_embedding_matrix(
+    file_paths: list[str], column: str, id_column: str = "item_id"
+) -> tuple[np.ndarray, np.ndarray]:
+    ids = []
+    vectors = []
+    for file_path in file_paths:
+        table = read_table(file_path, columns=[id_column, column])
+        for batch in table.to_batches():
+            ids.append(batch.column(id_column).to_numpy(zero_copy_only=False))
+            vectors.append(_vector_column_to_numpy(batch.column(column)))
+    return np.concatenate(ids), np.concatenate(vectors)
@@ -0,0 +1,90 @@
+import os
+import threading
+import time
+
+
+# Latency budget of a /movies request. Every stage gets at most its share of
+# the whole budget and never more than what is left, so a slow embedding
+# still leaves time for the kNN leg or the lexical fallback.
+SEARCH_DEADLINE_MS = float(os.environ.get("SEARCH_DEADLINE_MS", 1000))
+SEARCH_STAGE_BUDGETS = {"embedding": 0.3, "knn": 0.6, "lexical": 1.0}
+# The lexical fallback runs even when the budget is already spent.
+SEARCH_MIN_STAGE_TIMEOUT_MS = 100
+
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_BREAKER_FAILURE_THRESHOLD", 5))
+CIRCUIT_BREAKER_COOL_DOWN = float(os.environ.get("CIRCUIT_BREAKER_COOL_DOWN", 30))
+
+
+class Deadline:
+    def __init__(self, budget_ms: float = SEARCH_DEADLINE_MS) -> None:
+        self.budget = budget_ms / 1000
+        self.expires_at = time.monotonic() + self.budget
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def timeout(self, stage: str) -> float:
+        timeout = min(self.remaining(), self.budget * SEARCH_STAGE_BUDGETS[stage])
+        return max(timeout, SEARCH_MIN_STAGE_TIMEOUT_MS / 1000)
+
+
+class CircuitBreaker:
+    # Opens after failure_threshold consecutive failures and rejects calls for
+    # cool_down seconds, then lets one trial call through per cool down: a
+    # success closes it again, a failure keeps it open.
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+        cool_down: float = CIRCUIT_BREAKER_COOL_DOWN,
+    ) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cool_down = cool_down
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._open_until: float | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._open_until is not None
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._open_until is None:
+                return True
+            now = time.monotonic()
+            if now >= self._open_until:
+                # The trial call; a trial that never reports back (e.g. it
+                # was cancelled) just lets the next one through a cool down later.
+                self._open_until = now + self.cool_down
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._open_until = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                if self._open_until is None:
+                    self.opened += 1
+                self._open_until = time.monotonic() + self.cool_down
+
+    def stats_dict(self) -> dict:
+        return {
+            "open": int(self.is_open),
+            "failures": self.failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+embeddings_breaker = CircuitBreaker("embeddings")
+knn_breaker = CircuitBreaker("knn")
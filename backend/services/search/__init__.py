@@ -1,2 +1,5 @@
-from .es_manager import ESManager
-from .search_manager import SearchManager
+from .completion import CompletionTrie, LocalCompletionEngine
+from .es_manager import AsyncESManager, ESManager
+from .search_manager import AsyncSearchManager, SearchManager
+from .result_cache import SearchResultCache
+from .vector_engine import LocalVectorEngine
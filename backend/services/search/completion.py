@@ -0,0 +1,262 @@
+import asyncio
+import heapq
+import logging
+from typing import Any, AsyncIterator, Iterable
+
+from elasticsearch.helpers import async_scan
+
+from services.metrics import COMPLETION_REFRESH_ERRORS
+from services.movies_reader import MovieParquetReader
+from services.search.es_manager import AsyncESManager
+
+
+COMPLETION_SIZE = 10
+# Same defaults as the Elasticsearch fuzzy completion query: the first
+# character must match and inputs shorter than 3 characters are not fuzzed.
+COMPLETION_FUZZINESS = 2
+COMPLETION_FUZZY_PREFIX_LENGTH = 1
+COMPLETION_FUZZY_MIN_LENGTH = 3
+COMPLETION_REFRESH_INTERVAL = 30.0
+COMPLETION_CACHE_SIZE = 4096
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_title(title: str) -> str:
+    return " ".join(title.split()).casefold()
+
+
+class CompletionTrie:
+    def __init__(self, entries: Iterable[tuple[str, int]], size: int = COMPLETION_SIZE) -> None:
+        self.size = size
+        titles: dict[str, int] = {}
+        for title, weight in entries:
+            if title and weight >= titles.get(title, -1):
+                titles[title] = weight
+        ranked = sorted(titles.items(), key=lambda item: -item[1])
+        self.titles = [title for title, _ in ranked]
+        self.weights = [weight for _, weight in ranked]
+        # The trie never changes after construction, so keystroke prefixes
+        # that repeat across users are answered from this cache.
+        self._cache: dict[tuple[str, int, int], list[str]] = {}
+
+        # Nodes are stored in flat lists indexed by node id. Title ids are
+        # ordered by weight, so each node's top-k is just its k smallest ids.
+        self._labels: list[str] = [""]
+        self._children: list[list[int]] = [[]]
+        self._top: list[list[int]] = [[]]
+        for title_id, title in enumerate(self.titles):
+            node = 0
+            self._add_top(node, title_id)
+            for char in normalize_title(title):
+                node = self._get_or_create_child(node, char)
+                self._add_top(node, title_id)
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    def _add_top(self, node: int, title_id: int) -> None:
+        if len(self._top[node]) < self.size:
+            self._top[node].append(title_id)
+
+    def _get_or_create_child(self, node: int, char: str) -> int:
+        for child in self._children[node]:
+            if self._labels[child] == char:
+                return child
+        child = len(self._labels)
+        self._labels.append(char)
+        self._children.append([])
+        self._top.append([])
+        self._children[node].append(child)
+        return child
+
+    def _exact_node(self, prefix: str) -> int | None:
+        node = 0
+        for char in prefix:
+            for child in self._children[node]:
+                if self._labels[child] == char:
+                    node = child
+                    break
+            else:
+                return None
+        return node
+
+    def _fuzzy_nodes(self, query: str, max_edits: int) -> dict[int, int]:
+        # Walks the trie carrying a Damerau-Levenshtein (optimal string
+        # alignment) row per node; a node matches when the whole query is
+        # within max_edits of the node's prefix. Only the diagonal band of
+        # width 2 * max_edits + 1 is computed, cells outside it are capped.
+        matches: dict[int, int] = {}
+        limit = max_edits + 1
+        query_length = len(query)
+        first_row = [i if i <= max_edits else limit for i in range(query_length + 1)]
+        stack: list[tuple[int, int, list[int], list[int] | None, str]] = [
+            (0, 0, first_row, None, "")
+        ]
+        while stack:
+            node, depth, row, previous_row, previous_char = stack.pop()
+            distance = row[-1]
+            if distance <= max_edits:
+                matches[node] = distance
+                # Distances never drop below the row minimum further down, so
+                # the whole subtree is already covered by this match.
+                if distance == min(row):
+                    continue
+            depth += 1
+            low = max(1, depth - max_edits)
+            high = min(query_length, depth + max_edits)
+            for child in self._children[node]:
+                char = self._labels[child]
+                if depth <= COMPLETION_FUZZY_PREFIX_LENGTH and (
+                    depth > query_length or query[depth - 1] != char
+                ):
+                    continue
+                new_row = [limit] * (query_length + 1)
+                new_row[0] = depth if depth <= max_edits else limit
+                row_min = new_row[0]
+                for i in range(low, high + 1):
+                    value = min(
+                        new_row[i - 1] + 1,
+                        row[i] + 1,
+                        row[i - 1] + (query[i - 1] != char),
+                    )
+                    if (
+                        previous_row is not None
+                        and i > 1
+                        and query[i - 1] == previous_char
+                        and query[i - 2] == char
+                    ):
+                        value = min(value, previous_row[i - 2] + 1)
+                    if value > limit:
+                        value = limit
+                    new_row[i] = value
+                    if value < row_min:
+                        row_min = value
+                if row_min <= max_edits:
+                    stack.append((child, depth, new_row, row, char))
+        return matches
+
+    def suggest(
+        self,
+        query: str,
+        size: int | None = None,
+        fuzziness: int = COMPLETION_FUZZINESS,
+    ) -> list[str]:
+        size = min(size or self.size, self.size)
+        query = normalize_title(query)
+        if len(query) < COMPLETION_FUZZY_MIN_LENGTH:
+            fuzziness = 0
+        key = (query, size, fuzziness)
+        if key not in self._cache:
+            if len(self._cache) >= COMPLETION_CACHE_SIZE:
+                self._cache.clear()
+            self._cache[key] = self._suggest(query, size, fuzziness)
+        return self._cache[key]
+
+    def _suggest(self, query: str, size: int, fuzziness: int) -> list[str]:
+        node = self._exact_node(query)
+        exact = [] if node is None else self._top[node][:size]
+        if len(exact) == size or not fuzziness:
+            return [self.titles[i] for i in exact]
+
+        # Results are ranked by edit distance first, so widen the search one
+        # edit at a time and stop as soon as the page is full; the cheap
+        # 1-edit walk answers most queries.
+        distances: dict[int, int] = {}
+        for max_edits in range(1, fuzziness + 1):
+            distances = {}
+            for node, distance in self._fuzzy_nodes(query, max_edits).items():
+                for title_id in self._top[node]:
+                    if distance < distances.get(title_id, max_edits + 1):
+                        distances[title_id] = distance
+            if len(distances) >= size:
+                break
+        best = heapq.nsmallest(size, distances.items(), key=lambda item: (item[1], item[0]))
+        return [self.titles[title_id] for title_id, _ in best]
+
+
+def _popularity_weight(popularity: Any) -> int:
+    try:
+        return int(popularity or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def build_completion_trie_from_parquet(file_paths: list[str]) -> CompletionTrie:
+    reader = MovieParquetReader(columns={"title": "title", "popularity": "popularity"})
+    return CompletionTrie(
+        (movie["title"], movie["title_completion"]["weight"])
+        for file_path in file_paths
+        for movie in reader.iter_documents(file_path)
+    )
+
+
+async def _scan_titles(es_client: Any, index_name: str) -> AsyncIterator[tuple[str, int]]:
+    async for hit in async_scan(
+        es_client,
+        index=index_name,
+        query={"query": {"match_all": {}}, "_source": ["title", "popularity"]},
+        size=1000,
+    ):
+        source = hit["_source"]
+        yield source.get("title"), _popularity_weight(source.get("popularity"))
+
+
+async def fetch_completion_entries(es_client: Any, index_name: str) -> list[tuple[str, int]]:
+    return [entry async for entry in _scan_titles(es_client, index_name)]
+
+
+class LocalCompletionEngine:
+    def __init__(
+        self,
+        em: AsyncESManager,
+        parquet_files: list[str] | None = None,
+        refresh_interval: float = COMPLETION_REFRESH_INTERVAL,
+    ) -> None:
+        self.em = em
+        self.parquet_files = parquet_files
+        self.refresh_interval = refresh_interval
+        self.trie: CompletionTrie | None = None
+        self.generation: str | None = None
+        self._refresh_task: asyncio.Task | None = None
+
+    async def rebuild(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self.parquet_files:
+            trie = await loop.run_in_executor(
+                None, build_completion_trie_from_parquet, self.parquet_files
+            )
+        else:
+            entries = await fetch_completion_entries(self.em.es_client, self.em.index_name)
+            trie = await loop.run_in_executor(None, CompletionTrie, entries)
+        self.trie = trie
+
+    async def _refresh(self) -> None:
+        generation = await self.em.get_index_generation()
+        if self.trie is None or generation != self.generation:
+            await self.rebuild()
+            self.generation = generation
+
+    async def _refresh_loop(self) -> None:
+        # Rebuilds whenever the index generation marker changes, i.e. after
+        # load_es.py reindexes. Until the first build succeeds, suggest()
+        # returns None and the caller falls back to Elasticsearch.
+        while True:
+            try:
+                await self._refresh()
+            except Exception:
+                COMPLETION_REFRESH_ERRORS.inc()
+                logger.exception("Could not build the completion index")
+            await asyncio.sleep(self.refresh_interval)
+
+    async def start(self) -> None:
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+
+    def suggest(self, query: str) -> list[str] | None:
+        if self.trie is None:
+            return None
+        return self.trie.suggest(query)
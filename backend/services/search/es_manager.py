@@ -1,4 +1,17 @@
-from elasticsearch import Elasticsearch
+import hashlib
+import json
+import os
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from copy import copy
+from dataclasses import dataclass, field, replace
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator, Mapping
+
+from elasticsearch import AsyncElasticsearch, Elasticsearch
+from elasticsearch.helpers import scan, streaming_bulk
 from elasticsearch_dsl import (
     Completion,
     DenseVector,
@@ -18,16 +31,164 @@ ELASTICSEARCH_URL = "http://elasticsearch:9200"
 
 ES_DENSE_VECTOR_M_VALUE = 16
 ES_DENSE_VECTOE_EF_CONSTRUCTION_VALUE = 50
+ES_KNN_NUM_CANDIDATES = 120
+# JSON object of per-field overrides, e.g.
+# {"openai_embedding": {"index_type": "int8_hnsw", "m": 32}}
+ES_VECTOR_INDEX_OPTIONS = os.environ.get("ES_VECTOR_INDEX_OPTIONS")
+
+ES_BULK_CHUNK_SIZE = 500
+ES_BULK_MAX_CHUNK_BYTES = 20 * 1024 * 1024
+ES_BULK_THREAD_COUNT = 4
+ES_BULK_MAX_RETRIES = 5
+ES_BULK_INITIAL_BACKOFF = 2.0
+ES_BULK_MAX_BACKOFF = 60.0
+
+# ES_INDEX_NAME is a read alias over versioned physical indices named
+# "<ES_INDEX_NAME>-<timestamp>"; load_es.py fills a new version and swaps it in.
+ES_INDEX_VERSION_FORMAT = "%Y%m%d%H%M%S"
+ES_INDEX_VERSIONS_TO_KEEP = 2
+ES_FORCEMERGE_MAX_NUM_SEGMENTS = 1
+ES_FORCEMERGE_TIMEOUT = 3600
+
+# Documents are keyed by item_id and carry a hash of their content, so a sync
+# only sends the movies that changed.
+ES_CONTENT_FINGERPRINT_FIELD = "content_fingerprint"
+ES_SYNC_SCAN_SIZE = 5000
+
+# The vectors live in the HNSW graphs (and doc values) already; keeping them
+# out of _source roughly halves the index and makes _source fetches cheap.
+# They can't be read back or reindexed from Elasticsearch then, the parquet
+# files are the source of truth.
+ES_EXCLUDE_VECTORS_FROM_SOURCE = (
+    os.environ.get("ES_EXCLUDE_VECTORS_FROM_SOURCE", "true").lower() == "true"
+)
+# e.g. "best_compression" (DEFLATE instead of LZ4 for stored fields).
+ES_INDEX_CODEC = os.environ.get("ES_INDEX_CODEC")
+
+ES_NUMBER_OF_SHARDS = int(os.environ.get("ES_NUMBER_OF_SHARDS", 1))
+ES_NUMBER_OF_REPLICAS = int(os.environ.get("ES_NUMBER_OF_REPLICAS", 0))
+# Segments are written in this order, so a query sorted the same way (see
+# BROWSE_SORT) stops collecting once it has its page and the total is capped.
+ES_INDEX_SORT = {"popularity": "desc", "vote_average": "desc"}
+
+
+@dataclass(frozen=True)
+class VectorFieldConfig:
+    dims: int
+    similarity: str
+    # "int8_hnsw" quantizes the stored vectors to one byte per dimension
+    # (Elasticsearch >= 8.12).
+    index_type: str = "hnsw"
+    m: int = ES_DENSE_VECTOR_M_VALUE
+    ef_construction: int = ES_DENSE_VECTOE_EF_CONSTRUCTION_VALUE
+    num_candidates: int = ES_KNN_NUM_CANDIDATES
+
+    def to_dense_vector(self) -> DenseVector:
+        return DenseVector(
+            dims=self.dims,
+            index=True,
+            similarity=self.similarity,
+            index_options={
+                "type": self.index_type,
+                "m": self.m,
+                "ef_construction": self.ef_construction,
+            },
+        )
+
+
+DEFAULT_VECTOR_FIELDS = {
+    "openai_embedding": VectorFieldConfig(dims=1536, similarity="cosine"),
+    "sbert_symmetric_embedding": VectorFieldConfig(dims=768, similarity="cosine"),
+    "sbert_asymmetric_embedding": VectorFieldConfig(dims=768, similarity="dot_product"),
+}
+
+
+def get_vector_fields(
+    overrides: dict[str, dict] | None = None,
+) -> dict[str, VectorFieldConfig]:
+    if overrides is None and ES_VECTOR_INDEX_OPTIONS:
+        overrides = json.loads(ES_VECTOR_INDEX_OPTIONS)
+    return {
+        field_name: replace(config, **(overrides or {}).get(field_name, {}))
+        for field_name, config in DEFAULT_VECTOR_FIELDS.items()
+    }
+
+
+@dataclass
+class BulkChunkReport:
+    chunk_number: int
+    documents: int
+    failed: int
+    elapsed: float
+    errors: list[dict] = field(default_factory=list)
+
+
+@dataclass
+class BulkLoadReport:
+    documents: int = 0
+    failed: int = 0
+    chunks: int = 0
+    elapsed: float = 0.0
+    failed_chunks: list[BulkChunkReport] = field(default_factory=list)
+
+    @property
+    def indexed(self) -> int:
+        return self.documents - self.failed
+
+
+@dataclass
+class SyncReport:
+    # Documents in the index before the sync.
+    existing: int = 0
+    unchanged: int = 0
+    upserts: int = 0
+    deletes: int = 0
+    scan_elapsed: float = 0.0
+    elapsed: float = 0.0
+    bulk: BulkLoadReport = field(default_factory=BulkLoadReport)
+
+
+def document_id(document: dict) -> str:
+    return str(document["item_id"])
+
+
+def document_fingerprint(document: dict) -> str:
+    content = json.dumps(document, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(content.encode()).hexdigest()
 
 
 class ESManager:
-    def __init__(self) -> None:
-        self.index_name = ES_INDEX_NAME
+    def __init__(
+        self,
+        index_name: str = ES_INDEX_NAME,
+        vector_fields: dict[str, VectorFieldConfig] | None = None,
+        exclude_vectors_from_source: bool = ES_EXCLUDE_VECTORS_FROM_SOURCE,
+        codec: str | None = ES_INDEX_CODEC,
+        number_of_shards: int = ES_NUMBER_OF_SHARDS,
+        number_of_replicas: int = ES_NUMBER_OF_REPLICAS,
+        index_sort: dict[str, str] | None = ES_INDEX_SORT,
+    ) -> None:
+        self.index_name = index_name
+        self.vector_fields = vector_fields or get_vector_fields()
+        self.exclude_vectors_from_source = exclude_vectors_from_source
+        self.codec = codec
+        self.number_of_shards = number_of_shards
+        self.number_of_replicas = number_of_replicas
+        self.index_sort = index_sort
         self.es_client = Elasticsearch(ELASTICSEARCH_URL)
+        self._document_definition: type[Document] | None = None
 
     def _get_index_definition(self) -> Index:
         index = Index(self.index_name)
-        index.settings(number_of_shards=1, number_of_replicas=0)
+        index.settings(
+            number_of_shards=self.number_of_shards, number_of_replicas=self.number_of_replicas
+        )
+        if self.codec:
+            index.settings(codec=self.codec)
+        if self.index_sort:
+            index.settings(
+                sort={"field": list(self.index_sort), "order": list(self.index_sort.values())}
+            )
         return index
 
     def _get_default_analyzer(self) -> analyzer:
@@ -63,7 +224,11 @@ class ESManager:
     def get_document_definition(
         self,
         text_analyzer: type[analyzer] | None = None,
-    ) -> Document:
+    ) -> type[Document]:
+        # Built once per manager, save_document asks for it on every document.
+        if text_analyzer is None and self._document_definition is not None:
+            return self._document_definition
+        cache = text_analyzer is None
         if not text_analyzer:
             text_analyzer = self._get_default_analyzer()
         trigram_analyzer = self._get_trigram_analyzer()
@@ -89,41 +254,18 @@ class ESManager:
             backdrop_path = Keyword()
             poster_path = Keyword()
             popularity = Short()
-
-            openai_embedding = DenseVector(
-                dims=1536,
-                index=True,
-                similarity="cosine",
-                index_options={
-                    "type": "hnsw",
-                    "m": ES_DENSE_VECTOR_M_VALUE,
-                    "ef_construction": ES_DENSE_VECTOE_EF_CONSTRUCTION_VALUE,
-                },
-            )
-            sbert_symmetric_embedding = DenseVector(
-                dims=768,
-                index=True,
-                similarity="cosine",
-                index_options={
-                    "type": "hnsw",
-                    "m": ES_DENSE_VECTOR_M_VALUE,
-                    "ef_construction": ES_DENSE_VECTOE_EF_CONSTRUCTION_VALUE,
-                },
-            )
-            sbert_asymmetric_embedding = DenseVector(
-                dims=768,
-                index=True,
-                similarity="dot_product",
-                index_options={
-                    "type": "hnsw",
-                    "m": ES_DENSE_VECTOR_M_VALUE,
-                    "ef_construction": ES_DENSE_VECTOE_EF_CONSTRUCTION_VALUE,
-                },
-            )
+            # Only read back through doc values by sync_documents.
+            content_fingerprint = Keyword(index=False)
 
             class Meta:
                 dynamic = MetaField("false")
 
+        for field_name, vector_field in self.vector_fields.items():
+            MovieDoc._doc_type.mapping.field(field_name, vector_field.to_dense_vector())
+        if self.exclude_vectors_from_source:
+            MovieDoc._doc_type.mapping.meta("_source", excludes=list(self.vector_fields))
+        if cache:
+            self._document_definition = MovieDoc
         return MovieDoc
 
     def _create_index(self) -> Index:
@@ -139,12 +281,322 @@ class ESManager:
             else:
                 return
         self._create_index()
+        self.update_index_generation()
+
+    def for_index(self, index_name: str) -> "ESManager":
+        manager = copy(self)
+        manager.index_name = index_name
+        return manager
+
+    def create_index_version(self) -> "ESManager":
+        # Returns a manager for a new, empty physical index; self.index_name
+        # keeps pointing at the alias until swap_alias.
+        version = time.strftime(ES_INDEX_VERSION_FORMAT, time.gmtime())
+        manager = self.for_index(f"{self.index_name}-{version}")
+        manager.create_index()
+        return manager
+
+    def list_index_versions(self) -> list[str]:
+        indices = self.es_client.indices.get(
+            index=f"{self.index_name}-*", expand_wildcards="open"
+        )
+        prefix = f"{self.index_name}-"
+        return sorted(name for name in indices if name[len(prefix) :].isdigit())
+
+    def get_alias_indices(self) -> list[str]:
+        if not self.es_client.indices.exists_alias(name=self.index_name):
+            return []
+        return sorted(self.es_client.indices.get_alias(name=self.index_name))
+
+    def optimize_segments(
+        self, max_num_segments: int = ES_FORCEMERGE_MAX_NUM_SEGMENTS
+    ) -> None:
+        # Fewer segments means fewer HNSW graphs to search per kNN query.
+        self.es_client.options(request_timeout=ES_FORCEMERGE_TIMEOUT).indices.forcemerge(
+            index=self.index_name, max_num_segments=max_num_segments
+        )
+
+    def swap_alias(self, index_name: str) -> None:
+        actions: list[Mapping[str, Any]] = [
+            {"remove": {"index": current, "alias": self.index_name}}
+            for current in self.get_alias_indices()
+        ]
+        if not actions and self.es_client.indices.exists(index=self.index_name):
+            # A concrete index from before versioning holds the alias name.
+            actions.append({"remove_index": {"index": self.index_name}})
+        actions.append({"add": {"index": index_name, "alias": self.index_name}})
+        self.es_client.indices.update_aliases(actions=actions)
+
+    def rollback(self, index_name: str | None = None) -> str:
+        current = self.get_alias_indices()
+        versions = self.list_index_versions()
+        if index_name is None:
+            older = [v for v in versions if current and v < min(current)]
+            if not older:
+                raise ValueError(f"No version of {self.index_name} older than {current}")
+            index_name = older[-1]
+        elif index_name not in versions:
+            raise ValueError(f"{index_name} is not a version of {self.index_name}")
+        self.swap_alias(index_name)
+        return index_name
+
+    def delete_old_versions(self, keep: int = ES_INDEX_VERSIONS_TO_KEEP) -> list[str]:
+        # Keeps the newest `keep` versions (previous ones are rollback targets)
+        # and never deletes what the alias points at.
+        current = set(self.get_alias_indices())
+        versions = self.list_index_versions()
+        deleted = [
+            v for v in versions[: max(len(versions) - keep, 0)] if v not in current
+        ]
+        for version in deleted:
+            self.es_client.indices.delete(index=version)
+        return deleted
+
+    def get_storage_stats(self, index_name: str | None = None) -> dict[str, int]:
+        stats = self.es_client.indices.stats(
+            index=index_name or self.index_name, metric=["docs", "store"]
+        )["_all"]["primaries"]
+        return {
+            "docs": stats["docs"]["count"],
+            "store_bytes": stats["store"]["size_in_bytes"],
+        }
+
+    def update_index_generation(self) -> str:
+        # Readers (e.g. the search result cache) compare this marker to know
+        # when the index contents were rebuilt.
+        generation = uuid.uuid4().hex
+        self.es_client.indices.put_mapping(
+            index=self.index_name, meta={"generation": generation}
+        )
+        return generation
+
+    @contextmanager
+    def bulk_load_settings(self) -> Iterator[None]:
+        settings = self.es_client.indices.get_settings(
+            index=self.index_name, flat_settings=True
+        )[self.index_name]["settings"]
+        previous_settings = {
+            "index.refresh_interval": settings.get("index.refresh_interval"),
+            "index.number_of_replicas": settings.get("index.number_of_replicas"),
+        }
+        self.es_client.indices.put_settings(
+            index=self.index_name,
+            settings={"index.refresh_interval": "-1", "index.number_of_replicas": 0},
+        )
+        try:
+            yield
+        finally:
+            self.es_client.indices.put_settings(
+                index=self.index_name, settings=previous_settings
+            )
+            self.es_client.indices.refresh(index=self.index_name)
+            self.update_index_generation()
+
+    def _bulk_save_chunk(
+        self,
+        chunk_number: int,
+        actions: list[dict],
+        max_chunk_bytes: int,
+        max_retries: int,
+        initial_backoff: float,
+    ) -> BulkChunkReport:
+        start = time.perf_counter()
+        errors = [
+            info
+            for _, info in streaming_bulk(
+                self.es_client,
+                actions,
+                chunk_size=len(actions),
+                max_chunk_bytes=max_chunk_bytes,
+                max_retries=max_retries,
+                initial_backoff=initial_backoff,
+                max_backoff=ES_BULK_MAX_BACKOFF,
+                raise_on_error=False,
+                raise_on_exception=False,
+                yield_ok=False,
+            )
+        ]
+        return BulkChunkReport(
+            chunk_number=chunk_number,
+            documents=len(actions),
+            failed=len(errors),
+            elapsed=time.perf_counter() - start,
+            errors=errors,
+        )
+
+    def _get_index_action(self, document: dict) -> dict:
+        source = {**document, ES_CONTENT_FINGERPRINT_FIELD: document_fingerprint(document)}
+        return {"_index": self.index_name, "_id": document_id(document), "_source": source}
+
+    def _bulk_actions(
+        self,
+        actions: Iterator[dict],
+        chunk_size: int = ES_BULK_CHUNK_SIZE,
+        max_chunk_bytes: int = ES_BULK_MAX_CHUNK_BYTES,
+        thread_count: int = ES_BULK_THREAD_COUNT,
+        max_retries: int = ES_BULK_MAX_RETRIES,
+        initial_backoff: float = ES_BULK_INITIAL_BACKOFF,
+        on_chunk: Callable[[BulkChunkReport], None] | None = None,
+    ) -> BulkLoadReport:
+        report = BulkLoadReport()
+        start = time.perf_counter()
+
+        def _collect(future: Future) -> None:
+            chunk_report = future.result()
+            report.documents += chunk_report.documents
+            report.failed += chunk_report.failed
+            report.chunks += 1
+            if chunk_report.failed:
+                report.failed_chunks.append(chunk_report)
+            if on_chunk:
+                on_chunk(chunk_report)
+
+        # Keep a bounded number of chunks in flight so memory stays proportional
+        # to thread_count * chunk_size instead of the whole input.
+        pending: list[Future] = []
+        with ThreadPoolExecutor(max_workers=thread_count) as executor:
+            chunk_number = 0
+            while chunk := list(islice(actions, chunk_size)):
+                chunk_number += 1
+                pending.append(
+                    executor.submit(
+                        self._bulk_save_chunk,
+                        chunk_number,
+                        chunk,
+                        max_chunk_bytes,
+                        max_retries,
+                        initial_backoff,
+                    )
+                )
+                if len(pending) >= thread_count * 2:
+                    _collect(pending.pop(0))
+            for future in pending:
+                _collect(future)
+
+        report.elapsed = time.perf_counter() - start
+        return report
+
+    def bulk_save_documents(
+        self,
+        documents: Iterable[dict],
+        chunk_size: int = ES_BULK_CHUNK_SIZE,
+        max_chunk_bytes: int = ES_BULK_MAX_CHUNK_BYTES,
+        thread_count: int = ES_BULK_THREAD_COUNT,
+        max_retries: int = ES_BULK_MAX_RETRIES,
+        initial_backoff: float = ES_BULK_INITIAL_BACKOFF,
+        on_chunk: Callable[[BulkChunkReport], None] | None = None,
+    ) -> BulkLoadReport:
+        return self._bulk_actions(
+            (self._get_index_action(document) for document in documents),
+            chunk_size=chunk_size,
+            max_chunk_bytes=max_chunk_bytes,
+            thread_count=thread_count,
+            max_retries=max_retries,
+            initial_backoff=initial_backoff,
+            on_chunk=on_chunk,
+        )
+
+    def get_indexed_fingerprints(self) -> dict[str, str | None]:
+        # _id -> content fingerprint of every indexed document, None for
+        # documents indexed before fingerprints existed.
+        fingerprints: dict[str, str | None] = {}
+        for hit in scan(
+            self.es_client,
+            index=self.index_name,
+            query={
+                "query": {"match_all": {}},
+                "_source": False,
+                "docvalue_fields": [ES_CONTENT_FINGERPRINT_FIELD],
+            },
+            size=ES_SYNC_SCAN_SIZE,
+        ):
+            values = hit.get("fields", {}).get(ES_CONTENT_FINGERPRINT_FIELD)
+            fingerprints[hit["_id"]] = values[0] if values else None
+        return fingerprints
+
+    def sync_documents(
+        self,
+        documents: Iterable[dict],
+        delete_missing: bool = True,
+        chunk_size: int = ES_BULK_CHUNK_SIZE,
+        max_chunk_bytes: int = ES_BULK_MAX_CHUNK_BYTES,
+        thread_count: int = ES_BULK_THREAD_COUNT,
+        max_retries: int = ES_BULK_MAX_RETRIES,
+        initial_backoff: float = ES_BULK_INITIAL_BACKOFF,
+        on_chunk: Callable[[BulkChunkReport], None] | None = None,
+    ) -> SyncReport:
+        # Upserts the documents whose fingerprint differs from the indexed one
+        # and, with delete_missing, deletes the indexed documents that are no
+        # longer in the input. Unchanged documents aren't sent at all.
+        # Documents without a fingerprint predate item_id keyed _ids: their
+        # movies are upserted under item_id, so the old copies are always
+        # deleted, delete_missing or not.
+        report = SyncReport()
+        start = time.perf_counter()
+        # Indices created before fingerprints existed get the field mapped.
+        self.es_client.indices.put_mapping(
+            index=self.index_name,
+            properties={ES_CONTENT_FINGERPRINT_FIELD: Keyword(index=False).to_dict()},
+        )
+        indexed = self.get_indexed_fingerprints()
+        report.existing = len(indexed)
+        report.scan_elapsed = time.perf_counter() - start
+        seen: set[str] = set()
+
+        def _actions() -> Iterator[dict]:
+            for document in documents:
+                action = self._get_index_action(document)
+                seen.add(action["_id"])
+                fingerprint = action["_source"][ES_CONTENT_FINGERPRINT_FIELD]
+                if indexed.get(action["_id"]) == fingerprint:
+                    report.unchanged += 1
+                    continue
+                report.upserts += 1
+                yield action
+            for doc_id in indexed.keys() - seen:
+                if delete_missing or indexed[doc_id] is None:
+                    report.deletes += 1
+                    yield {"_op_type": "delete", "_index": self.index_name, "_id": doc_id}
+
+        report.bulk = self._bulk_actions(
+            _actions(),
+            chunk_size=chunk_size,
+            max_chunk_bytes=max_chunk_bytes,
+            thread_count=thread_count,
+            max_retries=max_retries,
+            initial_backoff=initial_backoff,
+            on_chunk=on_chunk,
+        )
+        if report.upserts or report.deletes:
+            self.es_client.indices.refresh(index=self.index_name)
+            self.update_index_generation()
+        report.elapsed = time.perf_counter() - start
+        return report
 
     def save_document(self, document_dict: dict) -> None:
         document = self.get_document_definition()()
-        try:
-            for key in document_dict:
-                document[key] = document_dict[key]
-            document.save(index=self.index_name, using=self.es_client)
-        except:
-            breakpoint()
+        for key in document_dict:
+            document[key] = document_dict[key]
+        document.meta.id = document_id(document_dict)
+        document[ES_CONTENT_FINGERPRINT_FIELD] = document_fingerprint(document_dict)
+        document.save(index=self.index_name, using=self.es_client)
+
+
+class AsyncESManager:
+    def __init__(
+        self,
+        index_name: str = ES_INDEX_NAME,
+        vector_fields: dict[str, VectorFieldConfig] | None = None,
+    ) -> None:
+        self.index_name = index_name
+        self.vector_fields = vector_fields or get_vector_fields()
+        self.es_client = AsyncElasticsearch(ELASTICSEARCH_URL)
+
+    async def get_index_generation(self) -> str | None:
+        mappings = await self.es_client.indices.get_mapping(index=self.index_name)
+        for index_mapping in mappings.values():
+            return index_mapping["mappings"].get("_meta", {}).get("generation")
+        return None
+
+    async def close(self) -> None:
+        await self.es_client.close()
@@ -0,0 +1,120 @@
+import base64
+import binascii
+import copy
+import hashlib
+import json
+import os
+from dataclasses import asdict, dataclass
+from typing import Any
+
+from api.schemas import MovieSearchParams
+from services.search.result_cache import canonical_query_key
+
+
+# Cursor pagination: lexical pages run against a point in time with
+# search_after, so a deep page costs the same as the first one. Hybrid pages
+# slice a fused candidate list of HYBRID_CURSOR_WINDOW movies, computed once
+# and kept in the search result cache.
+CURSOR_PIT_KEEP_ALIVE = os.environ.get("CURSOR_PIT_KEEP_ALIVE", "5m")
+HYBRID_CURSOR_WINDOW = int(os.environ.get("HYBRID_CURSOR_WINDOW", 200))
+# item_id breaks score ties, search_after needs a total order.
+LEXICAL_CURSOR_SORT = [{"_score": "desc"}, {"item_id": "asc"}]
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+@dataclass
+class Cursor:
+    # Ties the cursor to the query it was issued for.
+    query: str
+    position: int = 0
+    pit_id: str | None = None
+    search_after: list[Any] | None = None
+    # Why a hybrid pagination is serving lexical candidates; it keeps doing so
+    # until the end, so pages don't switch rankings halfway.
+    degraded: str | None = None
+
+
+def query_fingerprint(params: MovieSearchParams) -> str:
+    return hashlib.sha1(repr(canonical_query_key(params)).encode()).hexdigest()[:16]
+
+
+def encode_cursor(cursor: Cursor) -> str:
+    data = {key: value for key, value in asdict(cursor).items() if value is not None}
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(",", ":")).encode()).decode()
+
+
+_SORT_VALUE_TYPES = (str, int, float, type(None))
+
+
+def _is_well_formed(cursor: Cursor) -> bool:
+    # Tokens come from clients, the dataclass doesn't check the types.
+    return (
+        isinstance(cursor.query, str)
+        and type(cursor.position) is int
+        and cursor.position >= 0
+        and isinstance(cursor.pit_id, (str, type(None)))
+        and isinstance(cursor.search_after, (list, type(None)))
+        # Sort values: scores, item ids and the index sort fields.
+        and all(isinstance(value, _SORT_VALUE_TYPES) for value in cursor.search_after or [])
+        and isinstance(cursor.degraded, (str, type(None)))
+    )
+
+
+def decode_cursor(token: str, params: MovieSearchParams) -> Cursor:
+    # An empty cursor starts a cursor pagination at the first page.
+    query = query_fingerprint(params)
+    if not token:
+        return Cursor(query=query)
+    try:
+        cursor = Cursor(**json.loads(base64.urlsafe_b64decode(token.encode())))
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise InvalidCursorError("Malformed cursor") from e
+    if not _is_well_formed(cursor):
+        raise InvalidCursorError("Malformed cursor")
+    if cursor.query != query:
+        raise InvalidCursorError("The cursor belongs to a different search")
+    return cursor
+
+
+def next_lexical_cursor(
+    params: MovieSearchParams, cursor: Cursor, response: Any
+) -> Cursor | None:
+    hits = response["hits"]["hits"]
+    position = cursor.position + len(hits)
+    total = response["hits"]["total"]
+    if len(hits) < params.size or (total["relation"] == "eq" and position >= total["value"]):
+        return None
+    return Cursor(
+        query=cursor.query,
+        position=position,
+        # Elasticsearch may hand back a new id for the same point in time.
+        pit_id=response.get("pit_id", cursor.pit_id),
+        search_after=hits[-1]["sort"],
+    )
+
+
+def candidate_window_params(params: MovieSearchParams) -> MovieSearchParams:
+    window_params = copy.copy(params)
+    window_params.offset = 0
+    window_params.size = HYBRID_CURSOR_WINDOW
+    return window_params
+
+
+def slice_candidates(
+    candidates: tuple[list[dict], int, bool, str | None, str | None],
+    params: MovieSearchParams,
+    cursor: Cursor,
+    degraded: str | None = None,
+) -> tuple[tuple[list[dict], int, bool, str | None, str | None], Cursor | None]:
+    movies, total, total_is_exact, did_you_mean, did_you_mean_html = candidates
+    end = cursor.position + params.size
+    next_cursor = (
+        Cursor(query=cursor.query, position=end, degraded=degraded)
+        if end < len(movies)
+        else None
+    )
+    page = movies[cursor.position : end]
+    return (page, total, total_is_exact, did_you_mean, did_you_mean_html), next_cursor
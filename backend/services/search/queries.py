@@ -0,0 +1,105 @@
+from typing import Any
+
+from api.schemas import MovieSearchParams
+
+
+# Query skeletons built as plain dicts. The constant parts are shared between
+# requests (they are only ever serialized, never mutated) and clauses without
+# a value (null range bounds, empty genre lists) are left out instead of being
+# sent as no-op clauses.
+LEXICAL_FIELDS = ["title^2", "overview"]
+
+DID_YOU_MEAN_PHRASE = {
+    "field": "title.trigram",
+    "collate": {
+        "query": {
+            "source": {
+                "match": {
+                    "title": {
+                        "query": "{{suggestion}}",
+                        "operator": "and",
+                    }
+                }
+            }
+        }
+    },
+    "highlight": {
+        "pre_tag": "<strong>",
+        "post_tag": "</strong>",
+    },
+}
+
+COMPLETION_SUGGESTER = {
+    "field": "title_completion",
+    "fuzzy": {"fuzziness": 2},
+    "size": 10,
+}
+
+
+def range_clause(field: str, **bounds: Any) -> dict | None:
+    bounds = {op: value for op, value in bounds.items() if value is not None}
+    if not bounds:
+        return None
+    return {"range": {field: bounds}}
+
+
+def genre_terms(genres: list[str]) -> list[dict]:
+    return [{"term": {"genres": genre}} for genre in genres]
+
+
+def lexical_query(params: MovieSearchParams) -> dict:
+    must: list[dict] = [
+        {
+            "multi_match": {
+                "query": params.search,
+                "fields": LEXICAL_FIELDS,
+                "operator": "and",
+            }
+        }
+    ]
+    rating = range_clause("vote_average", gt=params.min_rating)
+    if rating:
+        must.append(rating)
+    must.extend(genre_terms(params.genres_in))
+    query: dict[str, Any] = {"must": must}
+    if params.genres_out:
+        query["must_not"] = genre_terms(params.genres_out)
+    year = range_clause("year", gte=params.min_year, lte=params.max_year)
+    if year:
+        query["filter"] = [year]
+    return {"bool": query}
+
+
+def knn_filters(params: MovieSearchParams) -> list[dict]:
+    filters = [
+        clause
+        for clause in [
+            range_clause("year", gte=params.min_year, lte=params.max_year),
+            range_clause("vote_average", gt=params.min_rating),
+        ]
+        if clause
+    ]
+    filters.extend(genre_terms(params.genres_in))
+    if params.genres_out:
+        filters.append({"bool": {"must_not": genre_terms(params.genres_out)}})
+    return filters
+
+
+def is_browse(params: MovieSearchParams) -> bool:
+    # No text to score: the filters alone, in popularity order.
+    return not params.search.strip()
+
+
+def browse_query(params: MovieSearchParams) -> dict:
+    filters = knn_filters(params)
+    if not filters:
+        return {"match_all": {}}
+    return {"bool": {"filter": filters}}
+
+
+def did_you_mean_suggestion(query: str) -> dict:
+    return {"did_you_mean": {"text": query, "phrase": DID_YOU_MEAN_PHRASE}}
+
+
+def completion_suggestion(query: str) -> dict:
+    return {"complete": {"text": query, "completion": COMPLETION_SUGGESTER}}
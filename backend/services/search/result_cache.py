@@ -0,0 +1,153 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Any, Awaitable, Callable, Hashable
+
+from api.schemas import MovieSearchParams
+from services.embedding_cache import normalize_text
+
+
+SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get("SEARCH_CACHE_MAX_ENTRIES", 1000))
+SEARCH_CACHE_TTL = float(os.environ.get("SEARCH_CACHE_TTL", 300))
+SEARCH_CACHE_GENERATION_CHECK_INTERVAL = 5.0
+
+
+def canonical_query_key(params: MovieSearchParams) -> tuple:
+    # Everything that decides the ranking, i.e. not the page.
+    return (
+        normalize_text(params.search, params.emb_type.value if params.semantic_search else None),
+        tuple(sorted(set(params.genres_in))),
+        tuple(sorted(set(params.genres_out))),
+        params.min_year,
+        params.max_year,
+        params.min_rating,
+        params.include_suggestions,
+        params.semantic_search,
+        params.emb_type.value if params.semantic_search else None,
+    )
+
+
+def canonical_search_key(params: MovieSearchParams) -> Hashable:
+    return canonical_query_key(params) + (params.offset, params.size)
+
+
+@dataclass
+class SearchCacheStats:
+    hits: int = 0
+    misses: int = 0
+    coalesced: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+    entries: int = 0
+
+
+class SearchResultCache:
+    def __init__(
+        self,
+        get_generation: Callable[[], Awaitable[str | None]],
+        max_entries: int = SEARCH_CACHE_MAX_ENTRIES,
+        ttl: float = SEARCH_CACHE_TTL,
+        generation_check_interval: float = SEARCH_CACHE_GENERATION_CHECK_INTERVAL,
+    ) -> None:
+        self.get_generation = get_generation
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generation_check_interval = generation_check_interval
+        self.stats = SearchCacheStats()
+        self._entries: OrderedDict[Hashable, tuple[Any, float]] = OrderedDict()
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+        self._generation: str | None = None
+        self._generation_checked_at = float("-inf")
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.stats.entries = 0
+
+    async def _check_generation(self) -> None:
+        now = time.monotonic()
+        if now - self._generation_checked_at < self.generation_check_interval:
+            return
+        self._generation_checked_at = now
+        try:
+            generation = await self.get_generation()
+        except Exception:
+            # Keep serving the current entries, TTL still bounds staleness.
+            return
+        if generation != self._generation:
+            if self._generation is not None:
+                self.stats.invalidations += 1
+            self._generation = generation
+            self.clear()
+
+    def _get(self, key: Hashable) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            del self._entries[key]
+            self.stats.entries = len(self._entries)
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _put(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+        self.stats.entries = len(self._entries)
+
+    async def get_or_search(
+        self,
+        params: MovieSearchParams,
+        search: Callable[[], Awaitable[Any]],
+        cacheable: Callable[[Any], bool] | None = None,
+    ) -> Any:
+        # cacheable, when given, decides whether a fresh result is stored (it
+        # is still handed to the requests coalesced on it).
+        await self._check_generation()
+        key = canonical_search_key(params)
+        value = self._get(key)
+        if value is not None:
+            self.stats.hits += 1
+            return value
+
+        # Identical concurrent misses wait on the first request instead of all
+        # hitting Elasticsearch.
+        while (inflight := self._inflight.get(key)) is not None:
+            self.stats.coalesced += 1
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                # The first request was cancelled (e.g. its client went away),
+                # not this one: search again, led by the first waiter to get here.
+
+        self.stats.misses += 1
+        generation = self._generation
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await search()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # Mark the exception as retrieved when nobody else was waiting.
+                future.exception()
+            raise
+        else:
+            future.set_result(value)
+            if generation == self._generation and (cacheable is None or cacheable(value)):
+                self._put(key, value)
+            return value
+        finally:
+            del self._inflight[key]
+
+    def stats_dict(self) -> dict:
+        return {**asdict(self.stats), "generation": self._generation}
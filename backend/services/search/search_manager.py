@@ -1,56 +1,166 @@
-from typing import Any
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Iterator, Mapping, TypeVar
 
-from elasticsearch_dsl import Q, Search
+from elasticsearch import (
+    ApiError,
+    BadRequestError,
+    ConnectionTimeout,
+    NotFoundError,
+    TransportError,
+)
 
 from api.schemas import MovieSearchParams
-from services.embeddings import EmbeddingType, get_embedding_for_text
-from services.search import ESManager
+from services.embeddings import (
+    EmbeddingType,
+    aget_embedding_for_text,
+    embeddings_cache,
+    get_embedding_for_text,
+)
+from services.metrics import (
+    ES_REQUEST_SECONDS,
+    ES_TOOK_SECONDS,
+    SEARCH_DEGRADED,
+    SEARCH_STAGE_SECONDS,
+)
+from services.resilience import Deadline, embeddings_breaker, knn_breaker
+from services.search.es_manager import ES_INDEX_SORT, AsyncESManager, ESManager
+from services.search.pagination import (
+    CURSOR_PIT_KEEP_ALIVE,
+    LEXICAL_CURSOR_SORT,
+    Cursor,
+    InvalidCursorError,
+    next_lexical_cursor,
+)
+from services.search.queries import (
+    browse_query,
+    completion_suggestion,
+    did_you_mean_suggestion,
+    is_browse,
+    knn_filters,
+    lexical_query,
+)
+from services.search.vector_engine import LocalVectorEngine
+
+
+# movies, total, whether total is exact (not a lower or upper bound),
+# did_you_mean, did_you_mean_html
+SearchResults = tuple[list[dict], int, bool, str | None, str | None]
+T = TypeVar("T")
+
+HYBRID_FUSION_METHODS = ["rrf", "weighted"]
+HYBRID_RRF_RANK_CONSTANT = 60
+# Hits fetched from every leg before fusing, at least offset + size.
+HYBRID_RANK_WINDOW_SIZE = 100
+
+# Matches counted before hits.total turns into a lower bound.
+TRACK_TOTAL_HITS = int(os.environ.get("SEARCH_TRACK_TOTAL_HITS", 10000))
+# Browsing without a text search follows the index sort, which lets
+# Elasticsearch stop after the page as long as the total doesn't need more.
+BROWSE_TRACK_TOTAL_HITS = int(os.environ.get("BROWSE_TRACK_TOTAL_HITS", 1000))
+BROWSE_SORT = [{field: order} for field, order in ES_INDEX_SORT.items()]
+
+
+# Everything Movie needs; the dense vectors stay on the Elasticsearch side.
+MOVIE_SOURCE_FIELDS = [
+    "tmdbId",
+    "item_id",
+    "title",
+    "year",
+    "overview",
+    "runtime",
+    "genres",
+    "vote_average",
+    "popularity",
+    "director",
+    "protagonists",
+    "backdrop_path",
+    "poster_path",
+]
+
+
+EMBEDDING_FIELDS = {
+    EmbeddingType.SYMMETRIC: "sbert_symmetric_embedding",
+    EmbeddingType.ASYMMETRIC: "sbert_asymmetric_embedding",
+    EmbeddingType.OPENAI: "openai_embedding",
+}
 
 
 class SearchManager:
+    @contextmanager
+    def _stage(self, mode: str, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            SEARCH_STAGE_SECONDS.observe(time.perf_counter() - start, mode=mode, stage=stage)
+
+    def _observe_es(
+        self, mode: str, operation: str, start: float, response: Any, stage: str = "es"
+    ) -> None:
+        # Wall time minus took is the network, queueing and (de)serialization.
+        elapsed = time.perf_counter() - start
+        SEARCH_STAGE_SECONDS.observe(elapsed, mode=mode, stage=stage)
+        ES_REQUEST_SECONDS.observe(elapsed, operation=operation)
+        ES_TOOK_SECONDS.observe(response["took"] / 1000, operation=operation)
+
     def _serialize_es_results(self, es_result: dict) -> dict:
+        # Builds the Movie payload with its final JSON types (e.g. runtime as
+        # str) so the router can send it without another pydantic pass.
+        source = es_result["_source"]
         return {
             "score": es_result["_score"],
-            "tmbdId": es_result["_source"].get("tmbdId"),
-            "item_id": es_result["_source"]["item_id"],
-            "title": es_result["_source"]["title"],
-            "year": es_result["_source"]["year"],
-            "overview": es_result["_source"]["overview"],
-            "runtime": es_result["_source"]["runtime"],
-            "genres_names": es_result["_source"]["genres"],
-            "vote_average": es_result["_source"].get("vote_average"),
-            "popularity": es_result["_source"].get("popularity"),
-            "director": es_result["_source"].get("director"),
-            "protagonists": es_result["_source"].get("protagonists", []),
-            "backdrop_path": es_result["_source"].get("backdrop_path"),
-            "poster_path": es_result["_source"].get("poster_path"),
+            "title": source["title"],
+            "tmbdId": source.get("tmdbId"),
+            "item_id": source["item_id"],
+            "year": source["year"],
+            "overview": source["overview"],
+            "runtime": str(source["runtime"]),
+            "genres": source.get("genres"),
+            "vote_average": source.get("vote_average"),
+            "popularity": source.get("popularity"),
+            "director": source.get("director"),
+            "protagonists": source.get("protagonists", []),
+            "backdrop_path": source.get("backdrop_path"),
+            "poster_path": source.get("poster_path"),
         }
 
-    def _get_traditional_search(
-        self, params: MovieSearchParams, em: ESManager
-    ) -> Search:
-        search = Search(using=em.es_client, index=em.index_name)
-        multi_match_query = Q(
-            "multi_match",
-            query=params.search,
-            fields=["title^2", "overview"],
-            operator="and",
-        )
+    def _get_lexical_query(self, params: MovieSearchParams) -> dict:
+        return lexical_query(params)
 
-        include_genre_filters = [Q("term", genres=genre) for genre in params.genres_in]
-        exclude_genre_filter = [Q("term", genres=genre) for genre in params.genres_out]
-        rating_filter = Q("range", vote_average={"gt": params.min_rating})
-        year_range_filter = Q(
-            "range", year={"gte": params.min_year, "lte": params.max_year}
-        )
+    def _get_embedding_field(self, emb_type: EmbeddingType) -> str:
+        return EMBEDDING_FIELDS[emb_type]
 
-        search = search.query(
-            "bool",
-            must=[multi_match_query, rating_filter] + include_genre_filters,
-            must_not=exclude_genre_filter,
-            filter=year_range_filter,
-        )
-        return search
+    def _get_knn_query(
+        self,
+        params: MovieSearchParams,
+        query_vector: list[float],
+        k: int,
+        num_candidates: int,
+        emb_type: EmbeddingType | None = None,
+    ) -> dict:
+        knn: dict[str, Any] = {
+            "field": self._get_embedding_field(emb_type or params.emb_type),
+            "query_vector": query_vector,
+            "k": k,
+            "num_candidates": num_candidates,
+            # "similarity": 0.78,
+        }
+        filters = knn_filters(params)
+        if filters:
+            knn["filter"] = filters
+        return {"knn": knn}
+
+    def _get_num_candidates(
+        self,
+        params: MovieSearchParams,
+        em: ESManager | AsyncESManager,
+        emb_type: EmbeddingType | None = None,
+    ) -> int:
+        field = self._get_embedding_field(emb_type or params.emb_type)
+        return em.vector_fields[field].num_candidates
 
     def _get_knn_search(
         self,
@@ -58,137 +168,728 @@ class SearchManager:
         k: int,
         num_candidates: int,
     ) -> dict:
-        emb_type = params.emb_type
-        query_vector = get_embedding_for_text(params.search, emb_type)
-        embedding_field = ""
-        if emb_type == EmbeddingType.ASYMMETRIC:
-            embedding_field = "sbert_symmetric_embedding"
-        elif emb_type == EmbeddingType.SYMMETRIC:
-            embedding_field = "sbert_asymmetric_embedding"
-        elif emb_type == EmbeddingType.OPENAI:
-            embedding_field = "openai_embedding"
-
-        es_filters: list[dict[str, Any]] = [
-            {
-                "range": {
-                    "year": {"gte": params.min_year, "lte": params.max_year},
+        query_vector = get_embedding_for_text(params.search, params.emb_type)
+        return self._get_knn_query(params, query_vector, k, num_candidates)
+
+    def _get_did_you_mean_suggestion(self, query: str) -> dict:
+        return did_you_mean_suggestion(query)
+
+    def _get_completion_suggestion(self, query: str) -> dict:
+        return completion_suggestion(query)
+
+    def _parse_did_you_mean(self, response: Any) -> tuple[str | None, str | None]:
+        try:
+            option = response["suggest"]["did_you_mean"][0]["options"][0]
+            return option["text"], option["highlighted"]
+        except (KeyError, IndexError, TypeError):
+            return None, None
+
+    def _parse_search_response(self, response: Any) -> SearchResults:
+        total = response["hits"]["total"]
+        results = [self._serialize_es_results(r) for r in response["hits"]["hits"]]
+        did_you_mean, did_you_mean_html = self._parse_did_you_mean(response)
+        return results, total["value"], total["relation"] == "eq", did_you_mean, did_you_mean_html
+
+    def _get_traditional_search(
+        self, params: MovieSearchParams, em: ESManager | AsyncESManager
+    ) -> dict:
+        search: dict[str, Any] = {
+            "index": em.index_name,
+            "source": MOVIE_SOURCE_FIELDS,
+            "size": params.size,
+            "from_": params.offset,
+        }
+        if is_browse(params):
+            search["query"] = browse_query(params)
+            search["sort"] = BROWSE_SORT
+            search["track_total_hits"] = BROWSE_TRACK_TOTAL_HITS
+            return search
+        search["query"] = self._get_lexical_query(params)
+        search["track_total_hits"] = TRACK_TOTAL_HITS
+        if params.include_suggestions:
+            search["suggest"] = self._get_did_you_mean_suggestion(params.search)
+        return search
+
+    def _get_cursor_search(
+        self, params: MovieSearchParams, cursor: Cursor, pit_id: str
+    ) -> dict:
+        search: dict[str, Any] = {
+            "pit": {"id": pit_id, "keep_alive": CURSOR_PIT_KEEP_ALIVE},
+            "source": MOVIE_SOURCE_FIELDS,
+            "size": params.size,
+        }
+        if is_browse(params):
+            search["query"] = browse_query(params)
+            search["sort"] = BROWSE_SORT + [{"item_id": "asc"}]
+            search["track_total_hits"] = BROWSE_TRACK_TOTAL_HITS
+        else:
+            search["query"] = self._get_lexical_query(params)
+            search["sort"] = LEXICAL_CURSOR_SORT
+            search["track_total_hits"] = TRACK_TOTAL_HITS
+        if cursor.search_after:
+            search["search_after"] = cursor.search_after
+        elif params.include_suggestions and not is_browse(params):
+            search["suggest"] = self._get_did_you_mean_suggestion(params.search)
+        return search
+
+    def _get_local_knn_scores(
+        self,
+        params: MovieSearchParams,
+        vector_engine: LocalVectorEngine,
+        query_vector: list[float],
+        k: int,
+    ) -> dict[str, float]:
+        ids, similarities = vector_engine.search(
+            self._get_embedding_field(params.emb_type),
+            query_vector,
+            k,
+            vector_engine.filter_mask(params),
+        )
+        # The score Elasticsearch gives a kNN hit for cosine and for dot_product
+        # on unit vectors, so the fusion below matches its hybrid ranking.
+        return dict(zip(map(str, ids.tolist()), ((1 + similarities) / 2).tolist()))
+
+    def _get_local_hybrid_searches(
+        self,
+        params: MovieSearchParams,
+        em: ESManager | AsyncESManager,
+        knn_scores: dict[str, float],
+    ) -> list[Mapping[str, Any]]:
+        # The lexical top of the page plus the kNN hits, which also get their
+        # lexical score through the should clause (0 when they don't match).
+        lexical_query = self._get_lexical_query(params)
+        lexical_search: dict[str, Any] = {
+            "query": lexical_query,
+            "_source": MOVIE_SOURCE_FIELDS,
+            "size": params.offset + params.size,
+        }
+        if params.include_suggestions:
+            lexical_search["suggest"] = self._get_did_you_mean_suggestion(params.search)
+        knn_search = {
+            "query": {
+                "bool": {
+                    "filter": [{"terms": {"item_id": list(knn_scores)}}],
+                    "should": [lexical_query],
                 }
             },
-            {"range": {"vote_average": {"gt": params.min_rating}}},
-        ]
-        exclude_genre_filter = [
-            {"term": {"genres": genre}} for genre in params.genres_out
-        ]
-        es_filters.append({"bool": {"must_not": exclude_genre_filter}})
+            "_source": MOVIE_SOURCE_FIELDS,
+            "size": len(knn_scores),
+        }
+        return [{"index": em.index_name}, lexical_search, {"index": em.index_name}, knn_search]
 
-        include_genre_filters = [
-            {"term": {"genres": genre}} for genre in params.genres_in
+    def _fuse_local_hybrid_responses(
+        self, params: MovieSearchParams, response: Any, knn_scores: dict[str, float]
+    ) -> SearchResults:
+        lexical_response, knn_response = response["responses"]
+        hits = {
+            str(hit["_source"]["item_id"]): hit
+            for hit in knn_response["hits"]["hits"] + lexical_response["hits"]["hits"]
+        }
+        scores = {
+            item_id: (hit["_score"] or 0.0) + knn_scores.get(item_id, 0.0)
+            for item_id, hit in hits.items()
+        }
+        ranked = sorted(scores, key=scores.__getitem__, reverse=True)
+        page = ranked[params.offset : params.offset + params.size]
+        results = [
+            self._serialize_es_results({**hits[item_id], "_score": scores[item_id]})
+            for item_id in page
         ]
-        es_filters.append({"bool": {"must": include_genre_filters}})
+        knn_only = sum(1 for hit in knn_response["hits"]["hits"] if not hit["_score"])
+        lexical_total = lexical_response["hits"]["total"]
+        total = lexical_total["value"] + knn_only
+        did_you_mean, did_you_mean_html = self._parse_did_you_mean(lexical_response)
+        return (
+            results,
+            total,
+            lexical_total["relation"] == "eq",
+            did_you_mean,
+            did_you_mean_html,
+        )
 
-        return {
-            "knn": {
-                "field": embedding_field,
-                "query_vector": query_vector,
-                "k": k,
-                "num_candidates": num_candidates,
-                # "similarity": 0.78,
-                "filter": es_filters,
+    def _get_fused_hybrid_searches(
+        self,
+        params: MovieSearchParams,
+        em: ESManager | AsyncESManager,
+        query_vectors: dict[EmbeddingType, list[float]],
+        lexical_size: int | None,
+        knn_k: int | None,
+        knn_num_candidates: int | None,
+    ) -> dict[str, dict]:
+        window = max(params.offset + params.size, HYBRID_RANK_WINDOW_SIZE)
+        searches = {
+            "lexical": {
+                "query": self._get_lexical_query(params),
+                "_source": MOVIE_SOURCE_FIELDS,
+                "size": lexical_size or window,
             }
         }
-
-    def _get_did_you_mean_suggestion(self, query) -> dict:
-        return {
-            "did_you_mean": {
-                "text": query,
-                "phrase": {
-                    "field": "title.trigram",
-                    "collate": {
-                        "query": {
-                            "source": {
-                                "match": {
-                                    "title": {
-                                        "query": "{{suggestion}}",
-                                        "operator": "and",
-                                    }
-                                }
-                            }
-                        }
-                    },
-                    "highlight": {
-                        "pre_tag": "<strong>",
-                        "post_tag": "</strong>",
-                    },
-                },
+        for emb_type, query_vector in query_vectors.items():
+            num_candidates = knn_num_candidates or self._get_num_candidates(
+                params, em, emb_type
+            )
+            # A cursor's candidate window can be larger than the configured
+            # num_candidates, which Elasticsearch rejects.
+            knn_query = self._get_knn_query(
+                params,
+                query_vector,
+                knn_k or window,
+                max(num_candidates, knn_k or window),
+                emb_type,
+            )
+            searches[f"knn_{emb_type.value}"] = {
+                "knn": knn_query["knn"],
+                "_source": MOVIE_SOURCE_FIELDS,
+                "size": knn_k or window,
+            }
+        if params.include_suggestions:
+            searches["suggest"] = {
+                "suggest": self._get_did_you_mean_suggestion(params.search),
+                "size": 0,
             }
+        return searches
+
+    def _get_msearch_body(
+        self, em: ESManager | AsyncESManager, searches: dict[str, dict]
+    ) -> list[Mapping[str, Any]]:
+        body: list[Mapping[str, Any]] = []
+        for search in searches.values():
+            body.extend([{"index": em.index_name}, search])
+        return body
+
+    def _fuse_ranked_hits(
+        self,
+        leg_hits: dict[str, list[dict]],
+        fusion: str,
+        weights: dict[str, float] | None,
+    ) -> dict[str, float]:
+        if fusion not in HYBRID_FUSION_METHODS:
+            raise ValueError(f"Unknown fusion {fusion!r}, expected one of {HYBRID_FUSION_METHODS}")
+        weights = weights or {}
+        scores: dict[str, float] = {}
+        for leg, hits in leg_hits.items():
+            weight = weights.get(leg, 1.0)
+            if fusion == "rrf":
+                leg_scores = [
+                    1 / (HYBRID_RRF_RANK_CONSTANT + rank) for rank in range(1, len(hits) + 1)
+                ]
+            else:
+                # Min-max normalised, so BM25 and similarity scores are comparable.
+                raw = [hit["_score"] or 0.0 for hit in hits]
+                low, high = min(raw, default=0.0), max(raw, default=0.0)
+                leg_scores = [
+                    (score - low) / (high - low) if high > low else 1.0 for score in raw
+                ]
+            for hit, score in zip(hits, leg_scores):
+                item_id = str(hit["_source"]["item_id"])
+                scores[item_id] = scores.get(item_id, 0.0) + weight * score
+        return scores
+
+    def _parse_fused_hybrid_response(
+        self,
+        params: MovieSearchParams,
+        searches: dict[str, dict],
+        response: Any,
+        fusion: str,
+        weights: dict[str, float] | None,
+        took: dict[str, int] | None,
+    ) -> SearchResults:
+        leg_responses = dict(zip(searches, response["responses"]))
+        for leg, leg_response in leg_responses.items():
+            if "error" in leg_response:
+                raise RuntimeError(
+                    f"Hybrid search leg {leg} failed: {leg_response['error']}"
+                )
+            if took is not None:
+                took[leg] = leg_response["took"]
+        if took is not None:
+            took["msearch"] = response["took"]
+
+        leg_hits = {
+            leg: leg_response["hits"]["hits"]
+            for leg, leg_response in leg_responses.items()
+            if leg != "suggest"
         }
+        scores = self._fuse_ranked_hits(leg_hits, fusion, weights)
+        hits = {
+            str(hit["_source"]["item_id"]): hit for hits in leg_hits.values() for hit in hits
+        }
+        ranked = sorted(scores, key=scores.__getitem__, reverse=True)
+        results = [
+            self._serialize_es_results({**hits[item_id], "_score": scores[item_id]})
+            for item_id in ranked[params.offset : params.offset + params.size]
+        ]
+        # Exact when the lexical leg returned all of its matches, an upper
+        # bound otherwise.
+        lexical = leg_responses["lexical"]["hits"]
+        lexical_total = lexical["total"]["value"]
+        total = lexical_total + len(scores) - len(lexical["hits"])
+        exact = lexical["total"]["relation"] == "eq" and len(lexical["hits"]) == lexical_total
+        did_you_mean, did_you_mean_html = self._parse_did_you_mean(
+            leg_responses.get("suggest")
+        )
+        return results, total, exact, did_you_mean, did_you_mean_html
 
     def execute_traditional_search(
         self,
         params: MovieSearchParams,
         em: ESManager,
-    ) -> tuple[list[dict], int]:
-        traditional_query = self._get_traditional_search(params, em).to_dict()
-        response = em.es_client.search(
-            index=em.index_name,
-            query=traditional_query["query"],
-            size=params.size,
-            from_=params.offset,
-            suggest=self._get_did_you_mean_suggestion(params.search)
-            if params.include_suggestions
-            else None,
-        )
-        total = response["hits"]["total"]["value"]
-        results = [self._serialize_es_results(r) for r in response["hits"]["hits"]]
+    ) -> SearchResults:
+        mode = "browse" if is_browse(params) else "traditional"
+        start = time.perf_counter()
+        response = em.es_client.search(**self._get_traditional_search(params, em))
+        self._observe_es(mode, "search", start, response)
+        with self._stage(mode, "parse"):
+            return self._parse_search_response(response)
+
+    def execute_traditional_cursor_search(
+        self,
+        params: MovieSearchParams,
+        em: ESManager,
+        cursor: Cursor,
+    ) -> tuple[SearchResults, Cursor | None]:
+        pit_id = cursor.pit_id
+        if pit_id is None:
+            pit_id = em.es_client.open_point_in_time(
+                index=em.index_name, keep_alive=CURSOR_PIT_KEEP_ALIVE
+            )["id"]
+        start = time.perf_counter()
         try:
-            did_you_mean = response["suggest"]["did_you_mean"][0]["options"][0]["text"]
-            did_you_mean_html = response["suggest"]["did_you_mean"][0]["options"][0]["highlighted"]
-        except:
-            did_you_mean = None
-            did_you_mean_html = None
-        return results, total, did_you_mean, did_you_mean_html
+            response = em.es_client.search(**self._get_cursor_search(params, cursor, pit_id))
+        except NotFoundError as e:
+            raise InvalidCursorError("The cursor expired") from e
+        except BadRequestError as e:
+            if cursor.pit_id is None and cursor.search_after is None:
+                raise
+            # The pit id and search_after came with the token.
+            raise InvalidCursorError("Malformed cursor") from e
+        self._observe_es("traditional_cursor", "search", start, response)
+        with self._stage("traditional_cursor", "parse"):
+            results = self._parse_search_response(response)
+            next_cursor = next_lexical_cursor(params, cursor, response)
+        if next_cursor is None:
+            em.es_client.close_point_in_time(id=response.get("pit_id", pit_id))
+        return results, next_cursor
 
     def execute_hybrid_search(
         self,
         params: MovieSearchParams,
         em: ESManager,
         knn_k: int = 80,
-        knn_num_candidates: int = 120,
-    ) -> tuple[list[dict], int]:
-        knn_query = self._get_knn_search(params, knn_k, knn_num_candidates)
-        traditional_query = self._get_traditional_search(params, em).to_dict()
+        knn_num_candidates: int | None = None,
+        vector_engine: LocalVectorEngine | None = None,
+    ) -> SearchResults:
+        if vector_engine is not None:
+            with self._stage("hybrid_local", "embedding"):
+                query_vector = get_embedding_for_text(params.search, params.emb_type)
+            with self._stage("hybrid_local", "knn"):
+                knn_scores = self._get_local_knn_scores(
+                    params, vector_engine, query_vector, knn_k
+                )
+            start = time.perf_counter()
+            response = em.es_client.msearch(
+                searches=self._get_local_hybrid_searches(params, em, knn_scores)
+            )
+            self._observe_es("hybrid_local", "msearch", start, response)
+            with self._stage("hybrid_local", "parse"):
+                return self._fuse_local_hybrid_responses(params, response, knn_scores)
+        knn_num_candidates = knn_num_candidates or self._get_num_candidates(params, em)
+        with self._stage("hybrid", "embedding"):
+            knn_query = self._get_knn_search(params, knn_k, knn_num_candidates)
+        start = time.perf_counter()
         response = em.es_client.search(
             index=em.index_name,
-            query=traditional_query["query"],
+            query=self._get_lexical_query(params),
             knn=knn_query["knn"],
+            source={"includes": MOVIE_SOURCE_FIELDS},
             size=params.size,
             from_=params.offset,
             suggest=self._get_did_you_mean_suggestion(params.search)
             if params.include_suggestions
             else None,
         )
-        total = response["hits"]["total"]["value"]
-        results = [self._serialize_es_results(r) for r in response["hits"]["hits"]]
-        try:
-            did_you_mean = response["suggest"]["did_you_mean"][0]["options"][0]["text"]
-            did_you_mean_html = response["suggest"]["did_you_mean"][0]["options"][0]["highlighted"]
-        except:
-            did_you_mean = None
-            did_you_mean_html = None
-        return results, total, did_you_mean, did_you_mean_html
+        self._observe_es("hybrid", "search", start, response)
+        with self._stage("hybrid", "parse"):
+            return self._parse_search_response(response)
+
+    def execute_fused_hybrid_search(
+        self,
+        params: MovieSearchParams,
+        em: ESManager,
+        fusion: str = "rrf",
+        emb_types: list[EmbeddingType] | None = None,
+        lexical_size: int | None = None,
+        knn_k: int | None = None,
+        knn_num_candidates: int | None = None,
+        weights: dict[str, float] | None = None,
+        took: dict[str, int] | None = None,
+    ) -> SearchResults:
+        # The lexical leg, one kNN leg per embedding type and the suggest leg
+        # go out as one _msearch and are fused here. took, when given, is
+        # filled with each leg's took in ms (keyed lexical, knn_<type>, suggest).
+        mode = f"hybrid_{fusion}"
+        with self._stage(mode, "embedding"):
+            query_vectors = {
+                emb_type: get_embedding_for_text(params.search, emb_type)
+                for emb_type in emb_types or [params.emb_type]
+            }
+        searches = self._get_fused_hybrid_searches(
+            params, em, query_vectors, lexical_size, knn_k, knn_num_candidates
+        )
+        start = time.perf_counter()
+        response = em.es_client.msearch(searches=self._get_msearch_body(em, searches))
+        self._observe_es(mode, "msearch", start, response)
+        with self._stage(mode, "parse"):
+            return self._parse_fused_hybrid_response(
+                params, searches, response, fusion, weights, took
+            )
 
     def get_completion_suggestions(self, query: str, em: ESManager) -> list[str]:
+        start = time.perf_counter()
         response = em.es_client.search(
-            suggest={
-                "complete": {
-                    "text": query,
-                    "completion": {
-                        "field": "title_completion",
-                        "fuzzy": {"fuzziness": 2},
-                        "size": 10,
-                    },
-                }
-            },
+            index=em.index_name,
+            suggest=self._get_completion_suggestion(query),
+            source=False,
+        )
+        self._observe_es("completion", "completion", start, response)
+        return [r["text"] for r in response["suggest"]["complete"][0]["options"]]
+
+
+def _is_unavailable(status: int) -> bool:
+    return status >= 500 or status == 429
+
+
+class SearchDegraded(Exception):
+    def __init__(self, reason: str) -> None:
+        super().__init__(reason)
+        self.reason = reason
+
+
+class AsyncSearchManager(SearchManager):
+    # The served path: every Elasticsearch request is bounded by the request's
+    # Deadline, and a hybrid search whose embedding or kNN stage fails, runs
+    # out of its budget or has its circuit open is answered lexically instead.
+    async def _timed(self, mode: str, stage: str, awaitable: Awaitable[T]) -> T:
+        with self._stage(mode, stage):
+            return await awaitable
+
+    async def _get_embeddings(
+        self, text: str, emb_types: list[EmbeddingType], mode: str, deadline: Deadline
+    ) -> list[list[float]]:
+        if not embeddings_breaker.allow():
+            # Cached vectors don't need the generator.
+            cached = []
+            for emb_type in emb_types:
+                vector = embeddings_cache.get(text, emb_type.value)
+                if vector is None:
+                    raise SearchDegraded("embedding_circuit_open")
+                cached.append(vector.tolist())
+            return cached
+        try:
+            vectors = await self._timed(
+                mode,
+                "embedding",
+                asyncio.wait_for(
+                    asyncio.gather(
+                        *(aget_embedding_for_text(text, emb_type) for emb_type in emb_types)
+                    ),
+                    deadline.timeout("embedding"),
+                ),
+            )
+        except asyncio.TimeoutError as e:
+            embeddings_breaker.record_failure()
+            raise SearchDegraded("embedding_timeout") from e
+        except Exception as e:
+            embeddings_breaker.record_failure()
+            raise SearchDegraded("embedding_error") from e
+        embeddings_breaker.record_success()
+        return vectors
+
+    async def _knn_request(
+        self, request: Callable[[float], Awaitable[T]], deadline: Deadline
+    ) -> T:
+        # knn_breaker.allow() is checked before the embedding is fetched, see
+        # _with_lexical_fallback.
+        try:
+            response = await request(deadline.timeout("knn"))
+        except ConnectionTimeout as e:
+            knn_breaker.record_failure()
+            raise SearchDegraded("knn_timeout") from e
+        except ApiError as e:
+            # A rejected query is a bug, not an unhealthy cluster.
+            if not _is_unavailable(e.status_code):
+                raise
+            knn_breaker.record_failure()
+            raise SearchDegraded("knn_error") from e
+        except TransportError as e:
+            knn_breaker.record_failure()
+            raise SearchDegraded("knn_error") from e
+        failure = self._get_partial_failure(response)
+        if failure:
+            knn_breaker.record_failure()
+            raise SearchDegraded(failure)
+        knn_breaker.record_success()
+        return response
+
+    def _get_partial_failure(self, response: Any) -> str | None:
+        # _msearch answers 200 with the failed legs inside, and a search that
+        # timed out or lost shards only holds part of the hits.
+        legs = response["responses"] if "responses" in response else [response.body]
+        for leg in legs:
+            # Rejected queries are left to the parser to raise.
+            if "error" in leg and _is_unavailable(leg.get("status", 500)):
+                return "knn_error"
+            if leg.get("timed_out"):
+                return "knn_timeout"
+            if leg.get("_shards", {}).get("failed"):
+                return "knn_error"
+        return None
+
+    async def _with_lexical_fallback(
+        self,
+        params: MovieSearchParams,
+        em: AsyncESManager,
+        mode: str,
+        search: Callable[[Deadline], Awaitable[SearchResults]],
+        deadline: Deadline | None,
+        degraded: list[str] | None,
+    ) -> SearchResults:
+        # degraded, when given, gets the reason the lexical results were
+        # returned instead of the hybrid ones.
+        deadline = deadline or Deadline()
+        try:
+            if not knn_breaker.allow():
+                raise SearchDegraded("knn_circuit_open")
+            return await search(deadline)
+        except SearchDegraded as e:
+            SEARCH_DEGRADED.inc(mode=mode, reason=e.reason)
+            if degraded is not None:
+                degraded.append(e.reason)
+        return await self.execute_traditional_search(params, em, deadline=deadline)
+
+    async def _get_did_you_mean(
+        self, params: MovieSearchParams, em: AsyncESManager, mode: str, deadline: Deadline
+    ) -> tuple[str | None, str | None]:
+        if not params.include_suggestions:
+            return None, None
+        start = time.perf_counter()
+        try:
+            response = await em.es_client.options(
+                request_timeout=deadline.timeout("knn")
+            ).search(
+                index=em.index_name,
+                suggest=self._get_did_you_mean_suggestion(params.search),
+                size=0,
+            )
+        except (ApiError, TransportError):
+            # Only a suggestion, the results don't wait for it.
+            return None, None
+        self._observe_es(mode, "suggest", start, response, stage="suggest")
+        return self._parse_did_you_mean(response)
+
+    async def execute_traditional_search(  # type: ignore[override]
+        self,
+        params: MovieSearchParams,
+        em: AsyncESManager,
+        deadline: Deadline | None = None,
+    ) -> SearchResults:
+        deadline = deadline or Deadline()
+        mode = "browse" if is_browse(params) else "traditional"
+        start = time.perf_counter()
+        response = await em.es_client.options(
+            request_timeout=deadline.timeout("lexical")
+        ).search(**self._get_traditional_search(params, em))
+        self._observe_es(mode, "search", start, response)
+        with self._stage(mode, "parse"):
+            return self._parse_search_response(response)
+
+    async def execute_traditional_cursor_search(  # type: ignore[override]
+        self,
+        params: MovieSearchParams,
+        em: AsyncESManager,
+        cursor: Cursor,
+        deadline: Deadline | None = None,
+    ) -> tuple[SearchResults, Cursor | None]:
+        deadline = deadline or Deadline()
+        es_client = em.es_client.options(request_timeout=deadline.timeout("lexical"))
+        pit_id = cursor.pit_id
+        if pit_id is None:
+            pit_id = (
+                await es_client.open_point_in_time(
+                    index=em.index_name, keep_alive=CURSOR_PIT_KEEP_ALIVE
+                )
+            )["id"]
+        start = time.perf_counter()
+        try:
+            response = await es_client.search(**self._get_cursor_search(params, cursor, pit_id))
+        except NotFoundError as e:
+            raise InvalidCursorError("The cursor expired") from e
+        except BadRequestError as e:
+            if cursor.pit_id is None and cursor.search_after is None:
+                raise
+            # The pit id and search_after came with the token.
+            raise InvalidCursorError("Malformed cursor") from e
+        self._observe_es("traditional_cursor", "search", start, response)
+        with self._stage("traditional_cursor", "parse"):
+            results = self._parse_search_response(response)
+            next_cursor = next_lexical_cursor(params, cursor, response)
+        if next_cursor is None:
+            await em.es_client.close_point_in_time(id=response.get("pit_id", pit_id))
+        return results, next_cursor
+
+    async def execute_hybrid_search(  # type: ignore[override]
+        self,
+        params: MovieSearchParams,
+        em: AsyncESManager,
+        knn_k: int = 80,
+        knn_num_candidates: int | None = None,
+        vector_engine: LocalVectorEngine | None = None,
+        deadline: Deadline | None = None,
+        degraded: list[str] | None = None,
+    ) -> SearchResults:
+        return await self._with_lexical_fallback(
+            params,
+            em,
+            "hybrid" if vector_engine is None else "hybrid_local",
+            lambda deadline: self._execute_hybrid_search(
+                params, em, knn_k, knn_num_candidates, vector_engine, deadline
+            ),
+            deadline,
+            degraded,
+        )
+
+    async def _execute_hybrid_search(
+        self,
+        params: MovieSearchParams,
+        em: AsyncESManager,
+        knn_k: int,
+        knn_num_candidates: int | None,
+        vector_engine: LocalVectorEngine | None,
+        deadline: Deadline,
+    ) -> SearchResults:
+        if vector_engine is not None:
+            (query_vector,) = await self._get_embeddings(
+                params.search, [params.emb_type], "hybrid_local", deadline
+            )
+            with self._stage("hybrid_local", "knn"):
+                knn_scores = self._get_local_knn_scores(
+                    params, vector_engine, query_vector, knn_k
+                )
+            start = time.perf_counter()
+            response = await self._knn_request(
+                lambda timeout: em.es_client.options(request_timeout=timeout).msearch(
+                    searches=self._get_local_hybrid_searches(params, em, knn_scores)
+                ),
+                deadline,
+            )
+            self._observe_es("hybrid_local", "msearch", start, response)
+            with self._stage("hybrid_local", "parse"):
+                return self._fuse_local_hybrid_responses(params, response, knn_scores)
+        knn_num_candidates = knn_num_candidates or self._get_num_candidates(params, em)
+        # The did-you-mean suggest doesn't depend on the query vector, so it
+        # runs while the embedding is being fetched instead of after it.
+        suggestion = asyncio.ensure_future(self._get_did_you_mean(params, em, "hybrid", deadline))
+        try:
+            (query_vector,) = await self._get_embeddings(
+                params.search, [params.emb_type], "hybrid", deadline
+            )
+        except SearchDegraded:
+            suggestion.cancel()
+            raise
+        did_you_mean, did_you_mean_html = await suggestion
+        knn_query = self._get_knn_query(
+            params, query_vector, knn_k, knn_num_candidates
+        )
+        start = time.perf_counter()
+        response = await self._knn_request(
+            lambda timeout: em.es_client.options(request_timeout=timeout).search(
+                index=em.index_name,
+                query=self._get_lexical_query(params),
+                knn=knn_query["knn"],
+                source={"includes": MOVIE_SOURCE_FIELDS},
+                size=params.size,
+                from_=params.offset,
+            ),
+            deadline,
+        )
+        self._observe_es("hybrid", "search", start, response)
+        with self._stage("hybrid", "parse"):
+            results, total, exact, _, _ = self._parse_search_response(response)
+        return results, total, exact, did_you_mean, did_you_mean_html
+
+    async def execute_fused_hybrid_search(  # type: ignore[override]
+        self,
+        params: MovieSearchParams,
+        em: AsyncESManager,
+        fusion: str = "rrf",
+        emb_types: list[EmbeddingType] | None = None,
+        lexical_size: int | None = None,
+        knn_k: int | None = None,
+        knn_num_candidates: int | None = None,
+        weights: dict[str, float] | None = None,
+        took: dict[str, int] | None = None,
+        deadline: Deadline | None = None,
+        degraded: list[str] | None = None,
+    ) -> SearchResults:
+        return await self._with_lexical_fallback(
+            params,
+            em,
+            f"hybrid_{fusion}",
+            lambda deadline: self._execute_fused_hybrid_search(
+                params,
+                em,
+                fusion,
+                emb_types or [params.emb_type],
+                lexical_size,
+                knn_k,
+                knn_num_candidates,
+                weights,
+                took,
+                deadline,
+            ),
+            deadline,
+            degraded,
+        )
+
+    async def _execute_fused_hybrid_search(
+        self,
+        params: MovieSearchParams,
+        em: AsyncESManager,
+        fusion: str,
+        emb_types: list[EmbeddingType],
+        lexical_size: int | None,
+        knn_k: int | None,
+        knn_num_candidates: int | None,
+        weights: dict[str, float] | None,
+        took: dict[str, int] | None,
+        deadline: Deadline,
+    ) -> SearchResults:
+        mode = f"hybrid_{fusion}"
+        vectors = await self._get_embeddings(params.search, emb_types, mode, deadline)
+        searches = self._get_fused_hybrid_searches(
+            params, em, dict(zip(emb_types, vectors)), lexical_size, knn_k, knn_num_candidates
+        )
+        start = time.perf_counter()
+        response = await self._knn_request(
+            lambda timeout: em.es_client.options(request_timeout=timeout).msearch(
+                searches=self._get_msearch_body(em, searches)
+            ),
+            deadline,
+        )
+        self._observe_es(mode, "msearch", start, response)
+        with self._stage(mode, "parse"):
+            return self._parse_fused_hybrid_response(
+                params, searches, response, fusion, weights, took
+            )
+
+    async def get_completion_suggestions(  # type: ignore[override]
+        self, query: str, em: AsyncESManager
+    ) -> list[str]:
+        start = time.perf_counter()
+        response = await em.es_client.search(
+            index=em.index_name,
+            suggest=self._get_completion_suggestion(query),
             source=False,
         )
+        self._observe_es("completion", "completion", start, response)
         return [r["text"] for r in response["suggest"]["complete"][0]["options"]]
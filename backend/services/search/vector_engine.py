@@ -0,0 +1,168 @@
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+import pyarrow as pa
+
+from api.schemas import MovieSearchParams
+from services.movies_reader import read_embedding_matrix, read_schema, read_table
+
+
+VECTOR_ENGINE_FIELDS = [
+    "sbert_symmetric_embedding",
+    "sbert_asymmetric_embedding",
+    "openai_embedding",
+]
+VECTOR_ENGINE_CACHE_DIR = os.environ.get(
+    "VECTOR_ENGINE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "charla-vectors")
+)
+# Rows of the query matrix scored at once by search_batch, bounds the
+# (queries x documents) score matrix.
+VECTOR_ENGINE_QUERY_BATCH_SIZE = 256
+
+
+def _files_fingerprint(file_paths: list[str]) -> str:
+    digest = hashlib.sha1()
+    for file_path in file_paths:
+        stat = os.stat(file_path)
+        digest.update(f"{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()[:16]
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _save_npy(path: str, array: np.ndarray) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def _top_k(scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    k = min(k, scores.shape[-1])
+    if k == 0:
+        empty = np.empty(scores.shape[:-1] + (0,))
+        return empty.astype(np.int64), empty.astype(np.float32)
+    top = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    top_scores = np.take_along_axis(scores, top, axis=-1)
+    order = np.argsort(-top_scores, axis=-1, kind="stable")
+    return np.take_along_axis(top, order, axis=-1), np.take_along_axis(top_scores, order, axis=-1)
+
+
+class LocalVectorEngine:
+    def __init__(
+        self,
+        item_ids: np.ndarray,
+        vectors: dict[str, np.ndarray],
+        years: np.ndarray,
+        ratings: np.ndarray,
+        genres: list[list[str] | None],
+    ) -> None:
+        self.item_ids = item_ids
+        self.vectors = vectors
+        self.years = years
+        self.ratings = ratings
+        self.genre_masks: dict[str, np.ndarray] = {}
+        for row, row_genres in enumerate(genres):
+            for genre in row_genres or []:
+                if genre not in self.genre_masks:
+                    self.genre_masks[genre] = np.zeros(len(item_ids), dtype=bool)
+                self.genre_masks[genre][row] = True
+
+    @classmethod
+    def from_parquet(
+        cls,
+        file_paths: list[str],
+        fields: list[str] | None = None,
+        cache_dir: str = VECTOR_ENGINE_CACHE_DIR,
+    ) -> "LocalVectorEngine":
+        # The normalised matrices are written once per set of input files and
+        # memory-mapped afterwards, so workers share the pages and restarts
+        # don't decode the parquet embeddings again.
+        cache_path = os.path.join(cache_dir, _files_fingerprint(file_paths))
+        os.makedirs(cache_path, exist_ok=True)
+        schema_names = set(read_schema(file_paths[0]).names)
+        ids_path = os.path.join(cache_path, "item_id.npy")
+        vectors = {}
+        for field in fields or VECTOR_ENGINE_FIELDS:
+            if field not in schema_names:
+                continue
+            field_path = os.path.join(cache_path, f"{field}.npy")
+            if not os.path.exists(field_path):
+                item_ids, matrix = read_embedding_matrix(file_paths, field)
+                _save_npy(field_path, _normalize(matrix).astype(np.float32))
+                _save_npy(ids_path, item_ids)
+            vectors[field] = np.load(field_path, mmap_mode="r")
+
+        table = pa.concat_tables(
+            read_table(file_path, columns=["item_id", "year", "vote_average", "genres"])
+            for file_path in file_paths
+        )
+        if not os.path.exists(ids_path):
+            _save_npy(ids_path, table.column("item_id").to_numpy())
+        return cls(
+            item_ids=np.load(ids_path),
+            vectors=vectors,
+            years=table.column("year").to_numpy(zero_copy_only=False).astype(np.float32),
+            ratings=table.column("vote_average").to_numpy(zero_copy_only=False).astype(np.float32),
+            genres=table.column("genres").to_pylist(),
+        )
+
+    def filter_mask(self, params: MovieSearchParams) -> np.ndarray:
+        # Same filters as queries.knn_filters; missing values are NaN
+        # and never pass a bound.
+        mask = np.ones(len(self.item_ids), dtype=bool)
+        if params.min_year is not None:
+            mask &= self.years >= params.min_year
+        if params.max_year is not None:
+            mask &= self.years <= params.max_year
+        if params.min_rating is not None:
+            mask &= self.ratings > params.min_rating
+        for genre in params.genres_in:
+            if genre not in self.genre_masks:
+                return np.zeros(len(self.item_ids), dtype=bool)
+            mask &= self.genre_masks[genre]
+        for genre in params.genres_out:
+            if genre in self.genre_masks:
+                mask &= ~self.genre_masks[genre]
+        return mask
+
+    def search(
+        self,
+        field: str,
+        query_vector: list[float] | np.ndarray,
+        k: int,
+        mask: np.ndarray | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        ids, scores = self.search_batch(field, np.asarray(query_vector)[None, :], k, mask)
+        return ids[0], scores[0]
+
+    def search_batch(
+        self,
+        field: str,
+        queries: np.ndarray,
+        k: int,
+        mask: np.ndarray | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        # Returns the item ids and cosine similarities of the top k rows for
+        # every query, best first.
+        matrix = self.vectors[field]
+        queries = _normalize(np.asarray(queries, dtype=np.float32))
+        k = min(k, len(matrix) if mask is None else int(mask.sum()))
+        ids = np.empty((len(queries), k), dtype=self.item_ids.dtype)
+        scores = np.empty((len(queries), k), dtype=np.float32)
+        for start in range(0, len(queries), VECTOR_ENGINE_QUERY_BATCH_SIZE):
+            end = start + VECTOR_ENGINE_QUERY_BATCH_SIZE
+            # Scoring every row and masking is cheaper than gathering the
+            # filtered rows out of the memory map.
+            batch_scores = queries[start:end] @ matrix.T
+            if mask is not None:
+                batch_scores[:, ~mask] = -np.inf
+            top, top_scores = _top_k(batch_scores, k)
+            ids[start:end] = self.item_ids[top]
+            scores[start:end] = top_scores
+        return ids, scores
@@ -0,0 +1,148 @@
+import asyncio
+import random
+from typing import Any
+
+import pytest
+
+from services.search import completion
+from services.search.completion import CompletionTrie, LocalCompletionEngine, normalize_title
+
+
+TITLES = [
+    ("Star Wars", 100),
+    ("Aliens", 95),
+    ("Alien", 90),
+    ("Star Trek", 80),
+    ("Scar", 60),
+    ("Stardust", 50),
+    ("Start Up", 10),
+    ("Sitar Hero", 5),
+]
+
+
+@pytest.fixture
+def trie() -> CompletionTrie:
+    return CompletionTrie(TITLES, size=5)
+
+
+def _osa_distance(a: str, b: str) -> int:
+    rows = [list(range(len(b) + 1))] + [[i] + [0] * len(b) for i in range(1, len(a) + 1)]
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            rows[i][j] = min(
+                rows[i - 1][j] + 1,
+                rows[i][j - 1] + 1,
+                rows[i - 1][j - 1] + (a[i - 1] != b[j - 1]),
+            )
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                rows[i][j] = min(rows[i][j], rows[i - 2][j - 2] + 1)
+    return rows[-1][-1]
+
+
+def test_exact_prefix_ranked_by_weight(trie: CompletionTrie) -> None:
+    assert trie.suggest("star t", fuzziness=0) == ["Star Trek"]
+    assert trie.suggest("  STAR   w", fuzziness=0) == ["Star Wars"]
+    assert trie.suggest("al") == ["Aliens", "Alien"]
+
+
+def test_exact_prefixes_come_before_fuzzy_matches(trie: CompletionTrie) -> None:
+    # Scar is 1 edit away and outweighs Start Up, which is an exact prefix.
+    assert trie.suggest("star") == ["Star Wars", "Star Trek", "Stardust", "Start Up", "Scar"]
+
+
+def test_one_edit(trie: CompletionTrie) -> None:
+    # Distance first, then weight.
+    assert trie.suggest("sxar", fuzziness=1) == [
+        "Star Wars",
+        "Star Trek",
+        "Scar",
+        "Stardust",
+        "Start Up",
+    ]
+    assert trie.suggest("aliem", fuzziness=1) == ["Aliens", "Alien"]
+
+
+def test_two_edits(trie: CompletionTrie) -> None:
+    assert trie.suggest("sxxr", fuzziness=1) == []
+    assert trie.suggest("sxxr", fuzziness=2)[:2] == ["Star Wars", "Star Trek"]
+
+
+def test_transposition_is_one_edit(trie: CompletionTrie) -> None:
+    assert trie.suggest("satr", fuzziness=1) == ["Star Wars", "Star Trek", "Stardust", "Start Up"]
+    assert trie.suggest("alein", fuzziness=1) == ["Aliens", "Alien"]
+
+
+def test_first_character_must_match(trie: CompletionTrie) -> None:
+    assert completion.COMPLETION_FUZZY_PREFIX_LENGTH == 1
+    assert trie.suggest("ttar") == []
+    assert trie.suggest("xlien") == []
+
+
+def test_short_queries_are_not_fuzzy(trie: CompletionTrie) -> None:
+    assert completion.COMPLETION_FUZZY_MIN_LENGTH == 3
+    assert trie.suggest("ax") == []
+    assert trie.suggest("alx") == ["Aliens", "Alien"]
+
+
+def test_size(trie: CompletionTrie) -> None:
+    assert trie.suggest("", size=2) == ["Star Wars", "Aliens"]
+    assert len(trie.suggest("s", size=50)) == 5
+
+
+def test_duplicate_titles_keep_the_highest_weight() -> None:
+    trie = CompletionTrie([("Alien", 1), ("Aliens", 5), ("Alien", 9), ("", 100)])
+    assert trie.suggest("ali") == ["Alien", "Aliens"]
+    assert len(trie) == 2
+
+
+def test_matches_a_brute_force_search() -> None:
+    # Every title whose normalised form has a prefix within the allowed edits
+    # (first character exact), by distance then weight.
+    rng = random.Random(0)
+    titles = list(
+        dict.fromkeys(
+            "".join(rng.choice("abc ") for _ in range(rng.randint(1, 8))).strip() or "a"
+            for _ in range(200)
+        )
+    )
+    trie = CompletionTrie(
+        [(title, len(titles) - i) for i, title in enumerate(titles)], size=len(titles)
+    )
+    for _ in range(200):
+        query = normalize_title("".join(rng.choice("abc ") for _ in range(rng.randint(3, 7))))
+        if len(query) < 3:
+            continue
+        distances = {
+            title: min(
+                _osa_distance(query, normalize_title(title)[:end])
+                for end in range(len(title) + 1)
+            )
+            for title in titles
+            if title[0] == query[0]
+        }
+        for fuzziness in [1, 2]:
+            expected = sorted(
+                (title for title, distance in distances.items() if distance <= fuzziness),
+                key=lambda title: (distances[title], titles.index(title)),
+            )
+            assert trie.suggest(query, fuzziness=fuzziness) == expected, (query, fuzziness)
+
+
+def test_refresh_errors_are_counted(monkeypatch: pytest.MonkeyPatch) -> None:
+    class FailingESManager:
+        async def get_index_generation(self) -> str:
+            raise ConnectionError("es is down")
+
+    counted = []
+    monkeypatch.setattr(completion.COMPLETION_REFRESH_ERRORS, "inc", lambda: counted.append(1))
+    em: Any = FailingESManager()
+    engine = LocalCompletionEngine(em, refresh_interval=0)
+
+    async def refresh_twice() -> None:
+        await engine.start()
+        while len(counted) < 2:
+            await asyncio.sleep(0)
+        await engine.stop()
+
+    asyncio.run(asyncio.wait_for(refresh_twice(), 5))
+    assert engine.suggest("alien") is None
@@ -0,0 +1,105 @@
+from typing import Any
+
+import pytest
+
+from api.schemas import MovieSearchParams
+from services.search.search_manager import HYBRID_RRF_RANK_CONSTANT, SearchManager
+
+
+def _hit(item_id: int, score: float | None = None) -> dict:
+    source = {"item_id": item_id, "title": "", "year": 2000, "overview": "", "runtime": 90}
+    return {"_score": score, "_source": source}
+
+
+def _leg(hits: list[dict], total: int | None = None, relation: str = "eq") -> dict:
+    total = len(hits) if total is None else total
+    return {"took": 3, "hits": {"total": {"value": total, "relation": relation}, "hits": hits}}
+
+
+def _parse(legs: dict[str, dict], size: int = 10, **kwargs: Any) -> Any:
+    params = MovieSearchParams(search="alien", size=size, genres_in=[], genres_out=[])
+    response = {"took": 5, "responses": list(legs.values())}
+    searches: dict[str, dict] = {leg: {} for leg in legs}
+    return SearchManager()._parse_fused_hybrid_response(
+        params, searches, response, kwargs.get("fusion", "rrf"), None, kwargs.get("took")
+    )
+
+
+def test_rrf_sums_the_reciprocal_ranks() -> None:
+    scores = SearchManager()._fuse_ranked_hits(
+        {"lexical": [_hit(1), _hit(2)], "knn_symmetric": [_hit(2), _hit(3)]}, "rrf", None
+    )
+    assert HYBRID_RRF_RANK_CONSTANT == 60
+    assert scores == pytest.approx({"1": 1 / 61, "2": 1 / 62 + 1 / 61, "3": 1 / 62})
+
+
+def test_rrf_weights() -> None:
+    scores = SearchManager()._fuse_ranked_hits(
+        {"lexical": [_hit(1)], "knn_symmetric": [_hit(2)]}, "rrf", {"lexical": 2.0}
+    )
+    assert scores == pytest.approx({"1": 2 / 61, "2": 1 / 61})
+
+
+def test_weighted_min_max_normalises_every_leg() -> None:
+    scores = SearchManager()._fuse_ranked_hits(
+        {
+            "lexical": [_hit(1, 12.0), _hit(2, 7.0), _hit(3, 2.0)],
+            "knn_symmetric": [_hit(3, 0.9), _hit(1, 0.7)],
+        },
+        "weighted",
+        {"knn_symmetric": 0.5},
+    )
+    assert scores == pytest.approx({"1": 1.0, "2": 0.5, "3": 0.5})
+
+
+def test_weighted_leg_with_equal_scores() -> None:
+    scores = SearchManager()._fuse_ranked_hits(
+        {"lexical": [_hit(1, 3.0), _hit(2, 3.0)], "knn_symmetric": [_hit(2, None)]},
+        "weighted",
+        None,
+    )
+    assert scores == pytest.approx({"1": 1.0, "2": 2.0})
+
+
+def test_unknown_fusion_is_rejected() -> None:
+    with pytest.raises(ValueError, match="Unknown fusion"):
+        SearchManager()._fuse_ranked_hits({}, "sum", None)
+
+
+def test_fused_response_pages_and_reports_took() -> None:
+    took: dict[str, int] = {}
+    movies, total, exact, _, _ = _parse(
+        {
+            "lexical": _leg([_hit(1, 5.0), _hit(2, 4.0)]),
+            "knn_symmetric": _leg([_hit(2, 0.9), _hit(3, 0.8)]),
+        },
+        size=2,
+        took=took,
+    )
+    assert [movie["item_id"] for movie in movies] == [2, 1]
+    assert movies[0]["score"] == pytest.approx(1 / 62 + 1 / 61)
+    assert (total, exact) == (3, True)
+    assert took == {"lexical": 3, "knn_symmetric": 3, "msearch": 5}
+
+
+def test_fused_total_is_an_upper_bound_when_the_lexical_leg_is_cut() -> None:
+    # 50 lexical matches, 2 of them returned, plus a kNN-only hit.
+    _, total, exact, _, _ = _parse(
+        {
+            "lexical": _leg([_hit(1, 5.0), _hit(2, 4.0)], total=50),
+            "knn_symmetric": _leg([_hit(2, 0.9), _hit(3, 0.8)]),
+        }
+    )
+    assert (total, exact) == (51, False)
+
+
+def test_fused_total_is_an_upper_bound_past_track_total_hits() -> None:
+    _, total, exact, _, _ = _parse(
+        {"lexical": _leg([_hit(1, 5.0)], total=1, relation="gte"), "knn_symmetric": _leg([])}
+    )
+    assert (total, exact) == (1, False)
+
+
+def test_failed_leg_raises() -> None:
+    with pytest.raises(RuntimeError, match="knn_symmetric failed"):
+        _parse({"lexical": _leg([]), "knn_symmetric": {"error": {"type": "timeout"}}})
@@ -0,0 +1,104 @@
+import base64
+import json
+
+from typing import Any
+
+import pytest
+
+from api.schemas import MovieSearchParams
+from services.search.pagination import (
+    Cursor,
+    InvalidCursorError,
+    decode_cursor,
+    encode_cursor,
+    query_fingerprint,
+    slice_candidates,
+)
+
+
+def _params(search: str = "alien", size: int = 10) -> MovieSearchParams:
+    return MovieSearchParams(search=search, size=size, genres_in=[], genres_out=[])
+
+
+def _token(data: Any) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+
+def test_empty_token_starts_at_the_first_page() -> None:
+    params = _params()
+    assert decode_cursor("", params) == Cursor(query=query_fingerprint(params))
+
+
+def test_round_trip() -> None:
+    params = _params()
+    cursor = Cursor(
+        query=query_fingerprint(params),
+        position=20,
+        pit_id="pit",
+        search_after=[1.5, "42"],
+        degraded="knn_timeout",
+    )
+    assert decode_cursor(encode_cursor(cursor), params) == cursor
+
+
+def test_fingerprint_ignores_the_page() -> None:
+    first, second = _params(), _params()
+    second.offset, second.size = 50, 25
+    assert query_fingerprint(first) == query_fingerprint(second)
+
+
+def test_cursor_of_another_search_is_rejected() -> None:
+    token = encode_cursor(Cursor(query=query_fingerprint(_params("alien")), position=10))
+    with pytest.raises(InvalidCursorError, match="different search"):
+        decode_cursor(token, _params("aliens"))
+
+
+@pytest.mark.parametrize(
+    "token",
+    [
+        "not base64!",
+        _token([1, 2]),
+        _token({"query": "q", "unknown": 1}),
+    ],
+)
+def test_garbage_is_rejected(token: str) -> None:
+    with pytest.raises(InvalidCursorError, match="Malformed"):
+        decode_cursor(token, _params())
+
+
+@pytest.mark.parametrize(
+    "fields",
+    [
+        {"position": -5},
+        {"position": "x"},
+        {"position": 1.5},
+        {"position": True},
+        {"search_after": "1"},
+        {"search_after": [1.5, {"id": 1}]},
+        {"search_after": [[1]]},
+        {"pit_id": 3},
+        {"degraded": ["x"]},
+    ],
+)
+def test_ill_typed_fields_are_rejected(fields: dict) -> None:
+    params = _params()
+    with pytest.raises(InvalidCursorError, match="Malformed"):
+        decode_cursor(_token({"query": query_fingerprint(params), **fields}), params)
+
+
+def test_slice_candidates_pages_through_the_window() -> None:
+    params = _params(size=10)
+    candidates = ([{"item_id": i} for i in range(25)], 40, True, "alien", "<b>alien</b>")
+    cursor: Cursor | None = Cursor(query="q")
+    pages = []
+    while cursor is not None:
+        results, cursor = slice_candidates(candidates, params, cursor)
+        assert results[1:] == candidates[1:]
+        pages.append([movie["item_id"] for movie in results[0]])
+    assert pages == [list(range(10)), list(range(10, 20)), list(range(20, 25))]
+
+
+def test_slice_candidates_keeps_the_degraded_reason() -> None:
+    candidates = ([{"item_id": i} for i in range(25)], 25, True, None, None)
+    _, cursor = slice_candidates(candidates, _params(size=10), Cursor(query="q"), "knn_error")
+    assert cursor == Cursor(query="q", position=10, degraded="knn_error")
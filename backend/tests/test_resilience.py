@@ -0,0 +1,151 @@
+import asyncio
+from typing import Any
+
+import pytest
+from elastic_transport import ApiResponseMeta, HttpHeaders, NodeConfig, ObjectApiResponse
+from elasticsearch import ApiError, BadRequestError, ConnectionTimeout
+
+from services import resilience
+from services.resilience import CircuitBreaker, Deadline
+from services.search import search_manager
+from services.search.search_manager import AsyncSearchManager, SearchDegraded
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(resilience.time, "monotonic", clock)
+    return clock
+
+
+def _meta(status: int = 200) -> ApiResponseMeta:
+    return ApiResponseMeta(status, "1.1", HttpHeaders(), 0.01, NodeConfig("http", "es", 9200))
+
+
+def test_deadline_stage_budgets(clock: FakeClock) -> None:
+    deadline = Deadline(budget_ms=1000)
+    assert deadline.timeout("embedding") == pytest.approx(0.3)
+    assert deadline.timeout("knn") == pytest.approx(0.6)
+    clock.now += 0.5
+    assert deadline.remaining() == pytest.approx(0.5)
+    # Never more than what is left of the whole budget.
+    assert deadline.timeout("knn") == pytest.approx(0.5)
+    assert deadline.timeout("embedding") == pytest.approx(0.3)
+
+
+def test_deadline_minimum_stage_timeout(clock: FakeClock) -> None:
+    deadline = Deadline(budget_ms=1000)
+    clock.now += 2
+    assert deadline.remaining() == 0
+    assert deadline.timeout("lexical") == resilience.SEARCH_MIN_STAGE_TIMEOUT_MS / 1000
+
+
+def test_breaker_opens_after_the_threshold(clock: FakeClock) -> None:
+    breaker = CircuitBreaker("test", failure_threshold=3, cool_down=10)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.allow() and not breaker.is_open
+    breaker.record_failure()
+    assert breaker.is_open
+    assert not breaker.allow()
+    assert breaker.stats_dict() == {"open": 1, "failures": 3, "opened": 1, "rejected": 1}
+
+
+def test_breaker_success_resets_the_failures(clock: FakeClock) -> None:
+    breaker = CircuitBreaker("test", failure_threshold=2, cool_down=10)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert not breaker.is_open
+
+
+def test_breaker_half_open_trial(clock: FakeClock) -> None:
+    breaker = CircuitBreaker("test", failure_threshold=1, cool_down=10)
+    breaker.record_failure()
+    clock.now += 10
+    # One trial call per cool down.
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    clock.now += 5
+    assert not breaker.allow()
+    clock.now += 5
+    assert breaker.allow()
+    breaker.record_success()
+    assert not breaker.is_open
+    assert breaker.allow() and breaker.allow()
+    assert breaker.opened == 1
+
+
+@pytest.mark.parametrize(
+    "response, failure",
+    [
+        ({"responses": [{"hits": {}}, {"hits": {}}]}, None),
+        ({"responses": [{"hits": {}}, {"error": {"type": "x"}, "status": 429}]}, "knn_error"),
+        ({"responses": [{"error": {"type": "x"}, "status": 503}]}, "knn_error"),
+        # Rejected queries are left to the response parsing.
+        ({"responses": [{"error": {"type": "x"}, "status": 400}]}, None),
+        ({"responses": [{"timed_out": True, "hits": {}}]}, "knn_timeout"),
+        ({"responses": [{"_shards": {"total": 2, "failed": 1}}]}, "knn_error"),
+        ({"_shards": {"total": 2, "failed": 0}, "timed_out": False}, None),
+        ({"_shards": {"total": 2, "failed": 2}}, "knn_error"),
+        ({"timed_out": True}, "knn_timeout"),
+    ],
+)
+def test_partial_failure(response: dict, failure: str | None) -> None:
+    api_response: ObjectApiResponse[Any] = ObjectApiResponse(body=response, meta=_meta())
+    assert AsyncSearchManager()._get_partial_failure(api_response) == failure
+
+
+def _knn_request(
+    monkeypatch: pytest.MonkeyPatch, result: Any
+) -> tuple[Any, CircuitBreaker]:
+    breaker = CircuitBreaker("knn", failure_threshold=1)
+    monkeypatch.setattr(search_manager, "knn_breaker", breaker)
+
+    async def request(timeout: float) -> Any:
+        if isinstance(result, Exception):
+            raise result
+        return ObjectApiResponse(body=result, meta=_meta())
+
+    try:
+        outcome = asyncio.run(AsyncSearchManager()._knn_request(request, Deadline()))
+    except (SearchDegraded, ApiError) as e:
+        outcome = e
+    return outcome, breaker
+
+
+def test_knn_request_success(monkeypatch: pytest.MonkeyPatch) -> None:
+    response, breaker = _knn_request(monkeypatch, {"responses": [{"hits": {}}]})
+    assert response.body == {"responses": [{"hits": {}}]}
+    assert breaker.failures == 0
+
+
+@pytest.mark.parametrize(
+    "result, reason",
+    [
+        (ConnectionTimeout("timed out"), "knn_timeout"),
+        (ApiError("unavailable", _meta(503), {}), "knn_error"),
+        ({"responses": [{"error": {}, "status": 429}]}, "knn_error"),
+    ],
+)
+def test_knn_request_degrades(
+    monkeypatch: pytest.MonkeyPatch, result: Any, reason: str
+) -> None:
+    error, breaker = _knn_request(monkeypatch, result)
+    assert isinstance(error, SearchDegraded) and error.reason == reason
+    assert breaker.is_open
+
+
+def test_knn_request_rejected_query_is_raised(monkeypatch: pytest.MonkeyPatch) -> None:
+    error, breaker = _knn_request(monkeypatch, BadRequestError("bad", _meta(400), {}))
+    assert isinstance(error, BadRequestError)
+    assert breaker.failures == 0
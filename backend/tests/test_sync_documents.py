@@ -0,0 +1,96 @@
+from typing import Any, Iterator
+
+import pytest
+
+from services.search import es_manager
+from services.search.es_manager import (
+    ES_CONTENT_FINGERPRINT_FIELD,
+    ESManager,
+    document_fingerprint,
+)
+
+
+MOVIES = {item_id: {"item_id": item_id, "title": f"Movie {item_id}"} for item_id in [1, 2, 3]}
+
+
+class FakeIndices:
+    def __init__(self) -> None:
+        self.calls: list[str] = []
+
+    def put_mapping(self, index: str, **kwargs: Any) -> None:
+        self.calls.append("generation" if "meta" in kwargs else "mapping")
+
+    def refresh(self, index: str) -> None:
+        self.calls.append("refresh")
+
+
+class FakeClient:
+    def __init__(self) -> None:
+        self.indices = FakeIndices()
+
+
+@pytest.fixture
+def bulk_actions(monkeypatch: pytest.MonkeyPatch) -> list[dict]:
+    # Indexed: 1 unchanged, 2 stale, 4 gone from the input and a document
+    # loaded before fingerprints (and item_id keyed _ids) existed.
+    indexed = [
+        {"_id": "1", "fields": {ES_CONTENT_FINGERPRINT_FIELD: [document_fingerprint(MOVIES[1])]}},
+        {"_id": "2", "fields": {ES_CONTENT_FINGERPRINT_FIELD: ["stale"]}},
+        {"_id": "4", "fields": {ES_CONTENT_FINGERPRINT_FIELD: ["gone"]}},
+        {"_id": "Xh3kP0IBz"},
+    ]
+    actions: list[dict] = []
+
+    def streaming_bulk(client: Any, chunk: list[dict], **kwargs: Any) -> Iterator[Any]:
+        actions.extend(chunk)
+        yield from []
+
+    monkeypatch.setattr(es_manager, "scan", lambda *args, **kwargs: iter(indexed))
+    monkeypatch.setattr(es_manager, "streaming_bulk", streaming_bulk)
+    return actions
+
+
+def _sync(movies: list[dict], **kwargs: Any) -> tuple[FakeClient, es_manager.SyncReport]:
+    client = FakeClient()
+    em = ESManager(index_name="movies")
+    em.es_client = client  # type: ignore[assignment]
+    return client, em.sync_documents(movies, **kwargs)
+
+
+def _summary(actions: list[dict]) -> list[tuple[str, str]]:
+    return sorted((action.get("_op_type", "index"), action["_id"]) for action in actions)
+
+
+def test_sync_upserts_changed_and_deletes_missing(bulk_actions: list[dict]) -> None:
+    client, report = _sync(list(MOVIES.values()))
+    assert _summary(bulk_actions) == [
+        ("delete", "4"),
+        ("delete", "Xh3kP0IBz"),
+        ("index", "2"),
+        ("index", "3"),
+    ]
+    upsert = next(action for action in bulk_actions if action["_id"] == "3")
+    assert upsert["_source"] == {
+        **MOVIES[3],
+        ES_CONTENT_FINGERPRINT_FIELD: document_fingerprint(MOVIES[3]),
+    }
+    assert (report.existing, report.unchanged, report.upserts, report.deletes) == (4, 1, 2, 2)
+    assert client.indices.calls == ["mapping", "refresh", "generation"]
+
+
+def test_sync_without_delete_still_replaces_legacy_documents(bulk_actions: list[dict]) -> None:
+    _, report = _sync(list(MOVIES.values()), delete_missing=False)
+    assert _summary(bulk_actions) == [("delete", "Xh3kP0IBz"), ("index", "2"), ("index", "3")]
+    assert report.deletes == 1
+
+
+def test_sync_without_changes_sends_nothing(
+    bulk_actions: list[dict], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    fingerprint = document_fingerprint(MOVIES[1])
+    indexed = [{"_id": "1", "fields": {ES_CONTENT_FINGERPRINT_FIELD: [fingerprint]}}]
+    monkeypatch.setattr(es_manager, "scan", lambda *args, **kwargs: iter(indexed))
+    client, report = _sync([MOVIES[1]])
+    assert bulk_actions == []
+    assert (report.unchanged, report.upserts, report.deletes) == (1, 0, 0)
+    assert client.indices.calls == ["mapping"]
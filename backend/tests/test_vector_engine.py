@@ -0,0 +1,92 @@
+from typing import Any
+
+import numpy as np
+import pytest
+
+from api.schemas import MovieSearchParams
+from services.search import vector_engine
+from services.search.vector_engine import LocalVectorEngine, _top_k
+
+
+def _params(**filters: Any) -> MovieSearchParams:
+    return MovieSearchParams(**{"genres_in": [], "genres_out": [], **filters})
+
+
+@pytest.fixture
+def engine() -> LocalVectorEngine:
+    vectors = np.array([[1, 0], [0.9, 0.1], [0, 1], [-1, 0], [0.5, 0.5]], dtype=np.float32)
+    return LocalVectorEngine(
+        item_ids=np.array([10, 11, 12, 13, 14]),
+        vectors={"v": vectors / np.linalg.norm(vectors, axis=1, keepdims=True)},
+        years=np.array([1990, 2000, np.nan, 2010, 2020], dtype=np.float32),
+        ratings=np.array([5, np.nan, 7, 8, 9], dtype=np.float32),
+        genres=[["Drama"], ["Drama", "Comedy"], None, ["Horror"], []],
+    )
+
+
+def _mask(engine: LocalVectorEngine, **filters: Any) -> list[int]:
+    return engine.filter_mask(_params(**filters)).astype(int).tolist()
+
+
+def test_filter_mask_without_filters_keeps_everything(engine: LocalVectorEngine) -> None:
+    assert _mask(engine) == [1, 1, 1, 1, 1]
+
+
+def test_filter_mask_missing_values_never_pass_a_bound(engine: LocalVectorEngine) -> None:
+    assert _mask(engine, min_year=1900) == [1, 1, 0, 1, 1]
+    assert _mask(engine, max_year=2000) == [1, 1, 0, 0, 0]
+    assert _mask(engine, min_rating=5) == [0, 0, 1, 1, 1]
+
+
+def test_filter_mask_genres(engine: LocalVectorEngine) -> None:
+    assert _mask(engine, genres_in=["Drama"]) == [1, 1, 0, 0, 0]
+    assert _mask(engine, genres_in=["Drama", "Comedy"]) == [0, 1, 0, 0, 0]
+    assert _mask(engine, genres_out=["Drama"]) == [0, 0, 1, 1, 1]
+
+
+def test_filter_mask_unknown_genres(engine: LocalVectorEngine) -> None:
+    assert _mask(engine, genres_in=["Western"]) == [0, 0, 0, 0, 0]
+    assert _mask(engine, genres_out=["Western"]) == [1, 1, 1, 1, 1]
+
+
+def test_top_k_is_sorted_best_first() -> None:
+    top, scores = _top_k(np.array([[0.1, 0.9, 0.5, 0.7]]), 3)
+    assert top.tolist() == [[1, 3, 2]]
+    assert scores.tolist() == [[0.9, 0.7, 0.5]]
+
+
+def test_top_k_larger_than_the_row() -> None:
+    top, _ = _top_k(np.array([[0.1, 0.9]]), 5)
+    assert top.tolist() == [[1, 0]]
+    top, scores = _top_k(np.empty((2, 0)), 3)
+    assert top.shape == scores.shape == (2, 0)
+
+
+def test_search_returns_cosine_similarities(engine: LocalVectorEngine) -> None:
+    ids, scores = engine.search("v", [2.0, 0.0], 3)
+    assert ids.tolist() == [10, 11, 14]
+    np.testing.assert_allclose(scores, [1.0, 0.9 / np.hypot(0.9, 0.1), np.sqrt(0.5)], rtol=1e-6)
+
+
+def test_search_batch_k_larger_than_the_filtered_count(engine: LocalVectorEngine) -> None:
+    mask = engine.filter_mask(_params(genres_in=["Drama"]))
+    ids, scores = engine.search_batch("v", np.array([[1, 0], [0, 1]]), 10, mask)
+    assert ids.tolist() == [[10, 11], [11, 10]]
+    assert scores.shape == (2, 2)
+
+
+def test_search_batch_with_nothing_left(engine: LocalVectorEngine) -> None:
+    mask = engine.filter_mask(_params(genres_in=["Western"]))
+    ids, scores = engine.search_batch("v", np.array([[1, 0]]), 10, mask)
+    assert ids.shape == scores.shape == (1, 0)
+
+
+def test_search_batch_across_query_batches(
+    engine: LocalVectorEngine, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    queries = np.array([[1, 0], [0, 1], [-1, 0], [1, 1], [0.9, 0.1]])
+    expected, _ = engine.search_batch("v", queries, 2)
+    monkeypatch.setattr(vector_engine, "VECTOR_ENGINE_QUERY_BATCH_SIZE", 2)
+    ids, _ = engine.search_batch("v", queries, 2)
+    assert ids.tolist() == expected.tolist()
+    assert ids[:, 0].tolist() == [10, 12, 13, 14, 11]
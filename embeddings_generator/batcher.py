@@ -0,0 +1,145 @@
+import asyncio
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable
+
+import numpy as np
+
+from embedding_generator import EmbeddingTypes
+
+
+QUEUE_TIME_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+
+@dataclass
+class _PendingText:
+    text: str
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+@dataclass
+class BatcherStats:
+    requests: int = 0
+    batches: int = 0
+    batch_sizes: dict[int, int] = field(default_factory=dict)
+    queue_time_buckets: list[int] = field(
+        default_factory=lambda: [0] * (len(QUEUE_TIME_BUCKETS_MS) + 1)
+    )
+    queue_time_sum_ms: float = 0.0
+    queue_time_max_ms: float = 0.0
+
+    def observe_batch(self, size: int, queue_times_ms: list[float]) -> None:
+        self.batches += 1
+        self.requests += size
+        self.batch_sizes[size] = self.batch_sizes.get(size, 0) + 1
+        for queue_time_ms in queue_times_ms:
+            self.queue_time_buckets[bisect_left(QUEUE_TIME_BUCKETS_MS, queue_time_ms)] += 1
+            self.queue_time_sum_ms += queue_time_ms
+            self.queue_time_max_ms = max(self.queue_time_max_ms, queue_time_ms)
+
+    def to_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "avg_batch_size": self.requests / self.batches if self.batches else 0.0,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "queue_time_ms": {
+                "avg": self.queue_time_sum_ms / self.requests if self.requests else 0.0,
+                "max": self.queue_time_max_ms,
+                "buckets": {
+                    f"le_{bound}": count
+                    for bound, count in zip(
+                        QUEUE_TIME_BUCKETS_MS + ["inf"], self.queue_time_buckets
+                    )
+                },
+            },
+        }
+
+
+class DynamicBatcher:
+    def __init__(
+        self,
+        encode: Callable[[list[str], EmbeddingTypes], np.ndarray],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+    ) -> None:
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queues: dict[EmbeddingTypes, asyncio.Queue] = {}
+        self.stats: dict[EmbeddingTypes, BatcherStats] = {}
+        self._workers: list[asyncio.Task] = []
+        # One forward pass at a time: concurrent encodes only fight over the
+        # same cores, the batching is where the throughput comes from.
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    async def start(self) -> None:
+        for embedding_type in EmbeddingTypes:
+            self.queues[embedding_type] = asyncio.Queue()
+            self.stats[embedding_type] = BatcherStats()
+            self._workers.append(asyncio.create_task(self._run(embedding_type)))
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._executor.shutdown(wait=False)
+
+    async def submit(self, text: str, embedding_type: EmbeddingTypes) -> np.ndarray:
+        future = asyncio.get_running_loop().create_future()
+        await self.queues[embedding_type].put(_PendingText(text, future))
+        return await future
+
+    async def run_exclusive(self, encode: Callable[[], np.ndarray]) -> np.ndarray:
+        # Bypasses the queues for requests that are already batches, but runs
+        # on the same executor so they don't encode concurrently with it.
+        return await asyncio.get_running_loop().run_in_executor(self._executor, encode)
+
+    def queue_depth(self) -> dict[str, int]:
+        return {t.value: queue.qsize() for t, queue in self.queues.items()}
+
+    async def _collect_batch(self, queue: asyncio.Queue) -> list[_PendingText]:
+        batch = [await queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not queue.empty():
+                batch.append(queue.get_nowait())
+                continue
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self, embedding_type: EmbeddingTypes) -> None:
+        loop = asyncio.get_running_loop()
+        queue = self.queues[embedding_type]
+        while True:
+            batch = await self._collect_batch(queue)
+            started_at = time.perf_counter()
+            self.stats[embedding_type].observe_batch(
+                len(batch),
+                [(started_at - pending.enqueued_at) * 1000 for pending in batch],
+            )
+            try:
+                embeddings = await loop.run_in_executor(
+                    self._executor,
+                    self.encode,
+                    [pending.text for pending in batch],
+                    embedding_type,
+                )
+            except Exception as e:
+                for pending in batch:
+                    if not pending.future.done():
+                        pending.future.set_exception(e)
+                continue
+            for pending, embedding in zip(batch, embeddings):
+                if not pending.future.done():
+                    pending.future.set_result(embedding)
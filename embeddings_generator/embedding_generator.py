@@ -1,20 +1,25 @@
+import json
 import os
+import threading
 import numpy as np
 from enum import Enum
-
-from sentence_transformers import SentenceTransformer
+from typing import Protocol
 
 
 embeddings_generator_path = os.environ.get("EMBEDDINGS_GENERATOR_PATH")
 
-symmetric_model = SentenceTransformer(
-    "sentence-transformers/all-mpnet-base-v2",
-    cache_folder=embeddings_generator_path
-)
-asymmetric_model = SentenceTransformer(
-    "sentence-transformers/msmarco-bert-base-dot-v5",
-    cache_folder=embeddings_generator_path
+# "torch" runs the SentenceTransformers models, "onnx" and "onnx-int8" run the
+# models exported by export_onnx.py (the latter dynamically quantized) on
+# ONNX Runtime.
+EMBEDDINGS_BACKEND = os.environ.get("EMBEDDINGS_BACKEND", "torch")
+EMBEDDINGS_ONNX_PATH = os.environ.get(
+    "EMBEDDINGS_ONNX_PATH", os.path.join(embeddings_generator_path or ".", "onnx")
 )
+ONNX_MODEL_FILES = {"onnx": "model.onnx", "onnx-int8": "model-int8.onnx"}
+ONNX_MAX_SEQ_LENGTH = 384
+# Intra-op threads per process for torch and ONNX Runtime, 0 keeps the library
+# default (one per core). serve.py sets it so forked workers don't oversubscribe.
+EMBEDDINGS_NUM_THREADS = int(os.environ.get("EMBEDDINGS_NUM_THREADS", 0))
 
 
 class EmbeddingTypes(Enum):
@@ -22,14 +27,144 @@ class EmbeddingTypes(Enum):
     ASYMMETRIC = "asymmetric"
 
 
+MODEL_NAMES = {
+    EmbeddingTypes.SYMMETRIC: "sentence-transformers/all-mpnet-base-v2",
+    EmbeddingTypes.ASYMMETRIC: "sentence-transformers/msmarco-bert-base-dot-v5",
+}
+
+
+class Encoder(Protocol):
+    def encode(self, sentences: list[str], batch_size: int = 32) -> np.ndarray:
+        ...
+
+
+class OnnxSentenceEncoder:
+    # Runs the transformer exported by export_onnx.py and applies the pooling
+    # and normalisation described by the saved SentenceTransformers modules, so
+    # the output matches SentenceTransformer.encode.
+    def __init__(self, model_dir: str, model_file: str = "model.onnx") -> None:
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = EMBEDDINGS_NUM_THREADS
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, model_file),
+            options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        # last_hidden_state is (batch, sequence, dimension).
+        self.dimension = self.session.get_outputs()[0].shape[-1]
+        with open(os.path.join(model_dir, "modules.json")) as f:
+            modules = json.load(f)
+        self.normalize = any(m["type"].endswith("Normalize") for m in modules)
+        pooling_path = next(
+            m["path"] for m in modules if m["type"].endswith("Pooling")
+        )
+        with open(os.path.join(model_dir, pooling_path, "config.json")) as f:
+            pooling = json.load(f)
+        self.pooling = "cls" if pooling.get("pooling_mode_cls_token") else "mean"
+        max_seq_length = ONNX_MAX_SEQ_LENGTH
+        config_path = os.path.join(model_dir, "sentence_bert_config.json")
+        if os.path.exists(config_path):
+            with open(config_path) as f:
+                max_seq_length = json.load(f).get("max_seq_length", max_seq_length)
+        self.max_seq_length = max_seq_length
+
+    def _encode_batch(self, sentences: list[str]) -> np.ndarray:
+        tokens = self.tokenizer(
+            sentences,
+            padding=True,
+            truncation=True,
+            max_length=self.max_seq_length,
+            return_tensors="np",
+        )
+        inputs = {k: v.astype(np.int64) for k, v in tokens.items() if k in self.input_names}
+        hidden = self.session.run(None, inputs)[0]
+        if self.pooling == "cls":
+            embeddings = hidden[:, 0]
+        else:
+            mask = tokens["attention_mask"][..., None].astype(hidden.dtype)
+            embeddings = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings.astype(np.float32)
+
+    def encode(self, sentences: list[str], batch_size: int = 32) -> np.ndarray:
+        if not sentences:
+            return np.empty((0, self.dimension), dtype=np.float32)
+        return np.concatenate(
+            [
+                self._encode_batch(sentences[start : start + batch_size])
+                for start in range(0, len(sentences), batch_size)
+            ]
+        )
+
+
+def set_num_threads(num_threads: int = EMBEDDINGS_NUM_THREADS) -> None:
+    if num_threads and EMBEDDINGS_BACKEND == "torch":
+        import torch
+
+        torch.set_num_threads(num_threads)
+
+
+def load_model(embedding_type: EmbeddingTypes, backend: str = EMBEDDINGS_BACKEND) -> Encoder:
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+
+        set_num_threads()
+
+        return SentenceTransformer(
+            MODEL_NAMES[embedding_type], cache_folder=embeddings_generator_path
+        )
+    if backend in ONNX_MODEL_FILES:
+        return OnnxSentenceEncoder(
+            os.path.join(EMBEDDINGS_ONNX_PATH, embedding_type.value),
+            ONNX_MODEL_FILES[backend],
+        )
+    raise ValueError(f"Unknown embeddings backend {backend!r}")
+
+
+_models: dict[EmbeddingTypes, Encoder] = {}
+_models_lock = threading.Lock()
+
+
+def get_model(embedding_type: EmbeddingTypes) -> Encoder:
+    # Loaded on the first request for each type, so a deployment that only
+    # serves one type never loads the other model.
+    model = _models.get(embedding_type)
+    if model is None:
+        with _models_lock:
+            model = _models.get(embedding_type)
+            if model is None:
+                model = _models[embedding_type] = load_model(embedding_type)
+    return model
+
+
+def preload_models(embedding_types: list[EmbeddingTypes] | None = None) -> None:
+    for embedding_type in embedding_types or list(EmbeddingTypes):
+        get_model(embedding_type)
+
+
 def get_embedding_sbert(
     text: str, embedding_type: EmbeddingTypes = EmbeddingTypes.SYMMETRIC
 ) -> list[float]:
+    return get_embeddings_sbert([text], embedding_type)[0].tolist()
+
+
+def get_embeddings_sbert(
+    texts: list[str],
+    embedding_type: EmbeddingTypes = EmbeddingTypes.SYMMETRIC,
+    batch_size: int = 32,
+) -> np.ndarray:
     if embedding_type == EmbeddingTypes.SYMMETRIC:
-        return symmetric_model.encode(text).tolist()
+        return get_model(embedding_type).encode(texts, batch_size=batch_size)
     elif embedding_type == EmbeddingTypes.ASYMMETRIC:
-        v = asymmetric_model.encode(text)
-        normalized_v = v/np.linalg.norm(v)
-        return normalized_v.tolist()
+        v = get_model(embedding_type).encode(texts, batch_size=batch_size)
+        return v / np.linalg.norm(v, axis=1, keepdims=True)
     else:
         raise NotImplementedError
@@ -0,0 +1,192 @@
+import os
+import time
+import inspect
+import argparse
+import numpy as np
+import pandas as pd
+
+from embedding_generator import (
+    EMBEDDINGS_ONNX_PATH,
+    MODEL_NAMES,
+    ONNX_MODEL_FILES,
+    EmbeddingTypes,
+    Encoder,
+    OnnxSentenceEncoder,
+    load_model,
+)
+
+
+ONNX_OPSET_VERSION = 14
+BENCHMARK_BATCH_SIZE = 32
+BENCHMARK_TEXTS = 256
+# Below this cosine to the torch embeddings for any text the export is broken.
+BENCHMARK_MIN_COSINE = 0.99
+SAMPLE_TEXTS = [
+    "Movie: The Matrix. Overview: A hacker learns the true nature of his reality.",
+    "Movie: Toy Story. Overview: Toys come to life when nobody is watching.",
+    "a heist movie with a twist ending",
+    "Movie: Alien. Overview: The crew of a commercial spaceship meets a deadly lifeform.",
+    "romantic comedy set in paris",
+    "Movie: Up. Overview: An old man ties thousands of balloons to his house and flies away.",
+]
+
+
+def _export(embedding_type: EmbeddingTypes, output_dir: str, quantize: bool) -> str:
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    model_dir = os.path.join(output_dir, embedding_type.value)
+    model = load_model(embedding_type, backend="torch")
+    assert isinstance(model, SentenceTransformer)
+    # Saves the tokenizer, pooling and normalisation config next to the ONNX
+    # graph, OnnxSentenceEncoder reads them from there.
+    model.save(model_dir)
+
+    transformer = model[0].auto_model.eval()
+    tokens = model.tokenizer(SAMPLE_TEXTS[:2], padding=True, return_tensors="pt")
+    # The graph inputs follow forward's parameter order, not the tokenizer's
+    # (input_ids, token_type_ids, attention_mask for BERT).
+    input_names = [
+        name for name in inspect.signature(transformer.forward).parameters if name in tokens
+    ]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    model_path = os.path.join(model_dir, ONNX_MODEL_FILES["onnx"])
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            # A trailing dict is passed as keyword arguments.
+            ({name: tokens[name] for name in input_names},),
+            model_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=ONNX_OPSET_VERSION,
+            do_constant_folding=True,
+        )
+    print(f"{embedding_type.value}: exported {MODEL_NAMES[embedding_type]} to {model_path}")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantized_path = os.path.join(model_dir, ONNX_MODEL_FILES["onnx-int8"])
+        quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8)
+        print(
+            f"{embedding_type.value}: quantized to {quantized_path} "
+            f"({os.path.getsize(model_path) / 2**20:.0f}MB -> "
+            f"{os.path.getsize(quantized_path) / 2**20:.0f}MB)"
+        )
+    return model_dir
+
+
+def _load_texts(parquet_file: str | None, limit: int) -> list[str]:
+    if not parquet_file:
+        return (SAMPLE_TEXTS * (limit // len(SAMPLE_TEXTS) + 1))[:limit]
+    df = pd.read_parquet(parquet_file, columns=["title", "overview"]).head(limit)
+    return [
+        f"Movie: {title}. Overview: {overview}"
+        for title, overview in zip(df["title"], df["overview"])
+    ]
+
+
+def _time_encode(model: Encoder, texts: list[str], batch_size: int) -> tuple[np.ndarray, float]:
+    # One warmup batch so lazy initialisation isn't counted.
+    model.encode(texts[:batch_size], batch_size=batch_size)
+    start = time.perf_counter()
+    embeddings = model.encode(texts, batch_size=batch_size)
+    return np.asarray(embeddings, dtype=np.float32), time.perf_counter() - start
+
+
+def _cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+
+
+def _benchmark(
+    embedding_type: EmbeddingTypes,
+    model_dir: str,
+    texts: list[str],
+    batch_size: int,
+    min_cosine: float = BENCHMARK_MIN_COSINE,
+) -> None:
+    baseline, baseline_time = _time_encode(
+        load_model(embedding_type, backend="torch"), texts, batch_size
+    )
+    print(
+        f"{embedding_type.value} torch: {len(texts) / baseline_time:.1f} texts/sec"
+    )
+    for backend, model_file in ONNX_MODEL_FILES.items():
+        if not os.path.exists(os.path.join(model_dir, model_file)):
+            continue
+        embeddings, elapsed = _time_encode(
+            OnnxSentenceEncoder(model_dir, model_file), texts, batch_size
+        )
+        cosine = _cosine(baseline, embeddings)
+        print(
+            f"{embedding_type.value} {backend}: {len(texts) / elapsed:.1f} texts/sec, "
+            f"{baseline_time / elapsed:.2f}x speedup, cosine to torch "
+            f"mean {cosine.mean():.5f} min {cosine.min():.5f}"
+        )
+        if cosine.min() < min_cosine:
+            raise RuntimeError(
+                f"{embedding_type.value} {backend} embeddings differ from torch "
+                f"(min cosine {cosine.min():.5f} < {min_cosine})"
+            )
+
+
+def _main(
+    output_dir: str = EMBEDDINGS_ONNX_PATH,
+    embedding_types: list[EmbeddingTypes] | None = None,
+    quantize: bool = True,
+    benchmark: bool = True,
+    parquet_file: str | None = None,
+    num_texts: int = BENCHMARK_TEXTS,
+    batch_size: int = BENCHMARK_BATCH_SIZE,
+    min_cosine: float = BENCHMARK_MIN_COSINE,
+) -> None:
+    texts = _load_texts(parquet_file, num_texts) if benchmark else []
+    for embedding_type in embedding_types or list(EmbeddingTypes):
+        model_dir = _export(embedding_type, output_dir, quantize)
+        if benchmark:
+            _benchmark(embedding_type, model_dir, texts, batch_size, min_cosine)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Exports the SBERT models to ONNX, optionally int8 quantized, "
+        "and compares them against the PyTorch models"
+    )
+    parser.add_argument("--output_dir", type=str, default=EMBEDDINGS_ONNX_PATH)
+    parser.add_argument(
+        "--type",
+        choices=[t.value for t in EmbeddingTypes],
+        action="append",
+        help="defaults to every embedding type",
+    )
+    parser.add_argument("--no_quantize", action="store_true")
+    parser.add_argument("--no_benchmark", action="store_true")
+    parser.add_argument(
+        "--parquet_file",
+        type=str,
+        default=None,
+        help="benchmark on the title and overview of these movies instead of sample texts",
+    )
+    parser.add_argument("--num_texts", type=int, default=BENCHMARK_TEXTS)
+    parser.add_argument("--batch_size", type=int, default=BENCHMARK_BATCH_SIZE)
+    parser.add_argument(
+        "--min_cosine",
+        type=float,
+        default=BENCHMARK_MIN_COSINE,
+        help="fail when an ONNX embedding is less similar than this to the torch one",
+    )
+
+    args = parser.parse_args()
+    _main(
+        output_dir=args.output_dir,
+        embedding_types=[EmbeddingTypes(t) for t in args.type] if args.type else None,
+        quantize=not args.no_quantize,
+        benchmark=not args.no_benchmark,
+        parquet_file=args.parquet_file,
+        num_texts=args.num_texts,
+        batch_size=args.batch_size,
+        min_cosine=args.min_cosine,
+    )
@@ -1,13 +1,291 @@
 import os
+import time
+import shutil
+import hashlib
 import argparse
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
-from embedding_generator import EmbeddingTypes, get_embedding_sbert
+from embedding_generator import (
+    EMBEDDINGS_BACKEND,
+    MODEL_NAMES,
+    EmbeddingTypes,
+    get_embedding_sbert,
+    get_embeddings_sbert,
+)
 
 
-def _main(data_folder: str, verbose: bool = False) -> None:
+ENCODE_BATCH_SIZE = 64
+ROW_GROUP_SIZE = 1000
+OUTPUT_FILE_NAME = "movies_with_embeddings.parquet"
+# Texts encoded between two checkpoints of an incremental run.
+CHECKPOINT_ROWS = 2000
+# Next to every embedding column, the hash of the model and text it was
+# computed from, so the next incremental run can reuse it.
+HASH_COLUMN_SUFFIX = "_hash"
+VECTOR_DTYPES = ["float32", "float16"]
+# The file format backend/services/movies_reader.py reads. _read_table and
+# _write_table mirror its read_table and write_movies_table: the generator is
+# built into its own image without the backend package, so it can't import them.
+ARROW_IPC_SUFFIXES = (".arrow", ".feather")
+
+EMBEDDING_COLUMNS = {
+    EmbeddingTypes.SYMMETRIC: "sbert_symmetric_embedding",
+    EmbeddingTypes.ASYMMETRIC: "sbert_asymmetric_embedding",
+}
+
+
+def _get_movie_texts(df: pd.DataFrame) -> list[str]:
+    titles = df["title"] if "title" in df else [None] * len(df)
+    overviews = df["overview"] if "overview" in df else [None] * len(df)
+    return [
+        f"Movie: {title}. Overview: {overview}"
+        for title, overview in zip(titles, overviews)
+    ]
+
+
+def _print_throughput(model_times: dict[EmbeddingTypes, float], total: int) -> None:
+    for embedding_type, elapsed in model_times.items():
+        print(
+            f"{embedding_type.value}: {total} texts in {elapsed:.2f}s "
+            f"({total / elapsed if elapsed else 0:.1f} texts/sec)"
+        )
+
+
+def _encode_sorted_by_length(
+    texts: list[str],
+    embedding_type: EmbeddingTypes,
+    batch_size: int,
+    verbose: bool = False,
+) -> np.ndarray:
+    # Batching texts of similar length keeps the padding inside each batch small.
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+    embeddings: np.ndarray | None = None
+    for start in range(0, len(order), batch_size):
+        indexes = order[start : start + batch_size]
+        batch = get_embeddings_sbert(
+            [texts[i] for i in indexes], embedding_type, batch_size=batch_size
+        )
+        if embeddings is None:
+            embeddings = np.empty((len(texts), batch.shape[1]), dtype=np.float32)
+        embeddings[indexes] = batch
+        if verbose and (start // batch_size) % 20 == 0:
+            print(f"{embedding_type.value}: {start + len(indexes)}/{len(texts)}")
+    if embeddings is None:
+        return np.empty((0, 0), dtype=np.float32)
+    return embeddings
+
+
+def _embeddings_to_arrow(embeddings: np.ndarray, dtype: str = "float32") -> pa.Array:
+    # fixed_size_list columns read back as one (rows, dims) buffer, without
+    # list offsets or a python list per row.
+    flat = pa.array(np.ascontiguousarray(embeddings, dtype=dtype).reshape(-1))
+    return pa.FixedSizeListArray.from_arrays(flat, embeddings.shape[1])
+
+
+def _openai_embeddings_to_arrow(openai_df: pd.DataFrame, dtype: str = "float32") -> pa.Array:
+    return _embeddings_to_arrow(np.stack(openai_df["embedding"].to_numpy()), dtype)
+
+
+def _output_path(data_folder: str, output_file_name: str, vector_dtype: str) -> str:
+    # This pyarrow can't write float16 to parquet, those go to an Arrow IPC
+    # file, which the backend memory-maps.
+    if vector_dtype == "float16" and output_file_name.endswith(".parquet"):
+        output_file_name = output_file_name[: -len(".parquet")] + ".arrow"
+    return os.path.join(data_folder, output_file_name)
+
+
+def _read_table(file_path: str) -> pa.Table:
+    if file_path.endswith(ARROW_IPC_SUFFIXES):
+        return pa.ipc.open_file(pa.memory_map(file_path)).read_all()
+    return pq.read_table(file_path)
+
+
+def _write_table(table: pa.Table, file_path: str, row_group_size: int) -> None:
+    if file_path.endswith(ARROW_IPC_SUFFIXES):
+        with pa.OSFile(file_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=row_group_size)
+    else:
+        pq.write_table(table, file_path, row_group_size=row_group_size)
+
+
+def _text_hashes(
+    texts: list[str], embedding_type: EmbeddingTypes, vector_dtype: str
+) -> list[str]:
+    # The backend and the stored dtype are part of the model id: ONNX/int8
+    # vectors are close to but not the same as the PyTorch ones, and float16
+    # ones are rounded.
+    model_id = f"{MODEL_NAMES[embedding_type]}:{EMBEDDINGS_BACKEND}:{vector_dtype}\0".encode()
+    return [hashlib.sha1(model_id + text.encode()).hexdigest() for text in texts]
+
+
+def _arrow_to_matrix(column: pa.ChunkedArray | pa.Array) -> np.ndarray:
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    if len(column) == 0:
+        return np.empty((0, 0), dtype=np.float32)
+    values = column.flatten().to_numpy(zero_copy_only=False)
+    return values.reshape(len(column), -1).astype(np.float32, copy=False)
+
+
+def _load_known_embeddings(table: pa.Table, column: str) -> dict[str, np.ndarray]:
+    hash_column = column + HASH_COLUMN_SUFFIX
+    if column not in table.column_names or hash_column not in table.column_names:
+        return {}
+    return dict(zip(table.column(hash_column).to_pylist(), _arrow_to_matrix(table.column(column))))
+
+
+def _load_checkpoints(checkpoint_dir: str) -> dict[str, np.ndarray]:
+    known: dict[str, np.ndarray] = {}
+    if not os.path.isdir(checkpoint_dir):
+        return known
+    for file_name in sorted(os.listdir(checkpoint_dir)):
+        if file_name.endswith(".parquet"):
+            chunk = pq.read_table(os.path.join(checkpoint_dir, file_name))
+            known.update(_load_known_embeddings(chunk, "embedding"))
+    return known
+
+
+def _encode_incremental(
+    texts: list[str],
+    hashes: list[str],
+    embedding_type: EmbeddingTypes,
+    known: dict[str, np.ndarray],
+    checkpoint_dir: str,
+    batch_size: int,
+    checkpoint_rows: int = CHECKPOINT_ROWS,
+    verbose: bool = False,
+) -> tuple[np.ndarray, int]:
+    # Only texts whose hash isn't in the previous output or a checkpoint of an
+    # interrupted run are encoded, every checkpoint_rows of them are written
+    # to checkpoint_dir before moving on.
+    known.update(_load_checkpoints(checkpoint_dir))
+    missing: dict[str, int] = {}
+    for i, text_hash in enumerate(hashes):
+        if text_hash not in known and text_hash not in missing:
+            missing[text_hash] = i
+    missing_hashes = list(missing)
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    for start in range(0, len(missing_hashes), checkpoint_rows):
+        chunk_hashes = missing_hashes[start : start + checkpoint_rows]
+        embeddings = _encode_sorted_by_length(
+            [texts[missing[h]] for h in chunk_hashes], embedding_type, batch_size
+        )
+        checkpoint = pa.table(
+            {
+                "embedding_hash": chunk_hashes,
+                "embedding": _embeddings_to_arrow(embeddings),
+            }
+        )
+        checkpoint_path = os.path.join(checkpoint_dir, f"{time.time_ns()}.parquet")
+        pq.write_table(checkpoint, checkpoint_path + ".tmp")
+        os.replace(checkpoint_path + ".tmp", checkpoint_path)
+        known.update(zip(chunk_hashes, embeddings))
+        if verbose:
+            print(
+                f"{embedding_type.value}: encoded {start + len(chunk_hashes)}"
+                f"/{len(missing_hashes)} new or changed texts"
+            )
+    if not hashes:
+        return np.empty((0, 0), dtype=np.float32), 0
+    return np.stack([known[h] for h in hashes]).astype(np.float32, copy=False), len(missing)
+
+
+def _main_incremental(
+    data_folder: str,
+    batch_size: int = ENCODE_BATCH_SIZE,
+    row_group_size: int = ROW_GROUP_SIZE,
+    output_file_name: str = OUTPUT_FILE_NAME,
+    previous_file: str | None = None,
+    checkpoint_rows: int = CHECKPOINT_ROWS,
+    vector_dtype: str = "float32",
+    verbose: bool = False,
+) -> None:
+    df = pd.read_parquet(os.path.join(data_folder, "movie_features.parquet"))
+    openai_df = pd.read_parquet(os.path.join(data_folder, "openai_embeddings.parquet"))
+    texts = _get_movie_texts(df)
+
+    output_path = _output_path(data_folder, output_file_name, vector_dtype)
+    # Like the output, relative to data_folder (an absolute path is kept).
+    previous_path = os.path.join(data_folder, previous_file) if previous_file else output_path
+    previous = _read_table(previous_path) if os.path.exists(previous_path) else None
+    checkpoint_root = output_path + ".checkpoint"
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    model_times = {}
+    for embedding_type, column in EMBEDDING_COLUMNS.items():
+        hashes = _text_hashes(texts, embedding_type, vector_dtype)
+        known = _load_known_embeddings(previous, column) if previous is not None else {}
+        start = time.perf_counter()
+        embeddings, encoded = _encode_incremental(
+            texts,
+            hashes,
+            embedding_type,
+            known,
+            os.path.join(checkpoint_root, column),
+            batch_size,
+            checkpoint_rows,
+            verbose,
+        )
+        model_times[embedding_type] = time.perf_counter() - start
+        print(
+            f"{embedding_type.value}: encoded {encoded} texts, "
+            f"reused {len(texts) - encoded} rows in {model_times[embedding_type]:.2f}s"
+        )
+        table = table.append_column(column, _embeddings_to_arrow(embeddings, vector_dtype))
+        table = table.append_column(column + HASH_COLUMN_SUFFIX, pa.array(hashes, pa.string()))
+    table = table.append_column(
+        "openai_embedding", _openai_embeddings_to_arrow(openai_df, vector_dtype)
+    )
+
+    # The previous output is usually the file being replaced.
+    base, extension = os.path.splitext(output_path)
+    _write_table(table, f"{base}.tmp{extension}", row_group_size)
+    os.replace(f"{base}.tmp{extension}", output_path)
+    shutil.rmtree(checkpoint_root, ignore_errors=True)
+    print(f"Wrote {table.num_rows} movies to {output_path}")
+
+
+def _main_batched(
+    data_folder: str,
+    batch_size: int = ENCODE_BATCH_SIZE,
+    row_group_size: int = ROW_GROUP_SIZE,
+    output_file_name: str = OUTPUT_FILE_NAME,
+    vector_dtype: str = "float32",
+    verbose: bool = False,
+) -> None:
+    df = pd.read_parquet(os.path.join(data_folder, "movie_features.parquet"))
+    openai_df = pd.read_parquet(os.path.join(data_folder, "openai_embeddings.parquet"))
+    texts = _get_movie_texts(df)
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    model_times = {}
+    for embedding_type, column in EMBEDDING_COLUMNS.items():
+        start = time.perf_counter()
+        embeddings = _encode_sorted_by_length(texts, embedding_type, batch_size, verbose)
+        model_times[embedding_type] = time.perf_counter() - start
+        table = table.append_column(column, _embeddings_to_arrow(embeddings, vector_dtype))
+        table = table.append_column(
+            column + HASH_COLUMN_SUFFIX,
+            pa.array(_text_hashes(texts, embedding_type, vector_dtype), pa.string()),
+        )
+    table = table.append_column(
+        "openai_embedding", _openai_embeddings_to_arrow(openai_df, vector_dtype)
+    )
+    _print_throughput(model_times, len(texts))
+
+    output_path = _output_path(data_folder, output_file_name, vector_dtype)
+    _write_table(table, output_path, row_group_size)
+    print(f"Wrote {table.num_rows} movies to {output_path}")
+
+
+def _main_per_row(data_folder: str, verbose: bool = False) -> None:
     # pd.options.mode.chained_assignment = None
 
+    model_times = {embedding_type: 0.0 for embedding_type in EMBEDDING_COLUMNS}
+    total_texts = 0
     batches = [(0, 1), (1, 2), (2, 3), (3, 4), (4, 5), (5, 6), (6, 7)]
     for batch in batches:
         offset = batch[0] * 1000
@@ -24,23 +302,74 @@ def _main(data_folder: str, verbose: bool = False) -> None:
         for i, row in df.iterrows():
             count += 1
             text = f"Movie: {row.get('title')}. Overview: {row.get('overview')}"
+            start = time.perf_counter()
             symetric_embeddings.append(get_embedding_sbert(text, EmbeddingTypes.SYMMETRIC))
+            model_times[EmbeddingTypes.SYMMETRIC] += time.perf_counter() - start
+            start = time.perf_counter()
             asymetric_embeddings.append(get_embedding_sbert(text, EmbeddingTypes.ASYMMETRIC))
+            model_times[EmbeddingTypes.ASYMMETRIC] += time.perf_counter() - start
             if verbose and count % 500 == 0:
                 print(f"Generated {count}/{total} embeddings")
+        total_texts += total
         df["sbert_symmetric_embedding"] = symetric_embeddings
         df["sbert_asymmetric_embedding"] = asymetric_embeddings
         df["openai_embedding"] = openai_df["embedding"]
         df.to_parquet(os.path.join(data_folder, f"movies_with_embeddings_{offset}-{limit}.parquet"))
+    _print_throughput(model_times, total_texts)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generates SBERT embeddings for the movies")
     parser.add_argument("--data_folder", "-f", type=str, default="../data/")
     parser.add_argument("--verbose", "-v", action="store_true")
+    parser.add_argument(
+        "--mode",
+        choices=["batched", "incremental", "per_row"],
+        default="batched",
+        help="incremental only encodes texts that changed since the previous output, "
+        "per_row is the original one-text-at-a-time path, kept as a baseline",
+    )
+    parser.add_argument("--batch_size", type=int, default=ENCODE_BATCH_SIZE)
+    parser.add_argument("--row_group_size", type=int, default=ROW_GROUP_SIZE)
+    parser.add_argument("--output", type=str, default=OUTPUT_FILE_NAME)
+    parser.add_argument(
+        "--previous",
+        type=str,
+        default=None,
+        help="output of an earlier run to reuse embeddings from, in --data_folder like "
+        "--output, defaults to --output",
+    )
+    parser.add_argument("--checkpoint_rows", type=int, default=CHECKPOINT_ROWS)
+    parser.add_argument(
+        "--vector_dtype",
+        choices=VECTOR_DTYPES,
+        default="float32",
+        help="float16 halves the vectors on disk and writes an Arrow IPC (.arrow) file",
+    )
 
     args = parser.parse_args()
     data_folder = args.data_folder
     verbose = args.verbose
 
-    _main(data_folder, verbose)
+    if args.mode == "per_row":
+        _main_per_row(data_folder, verbose)
+    elif args.mode == "incremental":
+        _main_incremental(
+            data_folder,
+            batch_size=args.batch_size,
+            row_group_size=args.row_group_size,
+            output_file_name=args.output,
+            previous_file=args.previous,
+            checkpoint_rows=args.checkpoint_rows,
+            vector_dtype=args.vector_dtype,
+            verbose=verbose,
+        )
+    else:
+        _main_batched(
+            data_folder,
+            batch_size=args.batch_size,
+            row_group_size=args.row_group_size,
+            output_file_name=args.output,
+            vector_dtype=args.vector_dtype,
+            verbose=verbose,
+        )
@@ -1,15 +1,120 @@
-from typing import Any
+import os
+from typing import Any, Awaitable, Callable
 
-from fastapi import FastAPI
+import numpy as np
+from fastapi import FastAPI, Header, Request, Response
 
-from schemas import EmbeddingsRequest, EmbeddingsResponse
-from embedding_generator import get_embedding_sbert
+from batcher import DynamicBatcher
+from schemas import (
+    BatchEmbeddingsRequest,
+    BatchEmbeddingsResponse,
+    BatcherStatsResponse,
+    EmbeddingsRequest,
+    EmbeddingsResponse,
+)
+from embedding_generator import get_embeddings_sbert
 
 
+MAX_BATCH_SIZE = int(os.environ.get("EMBEDDINGS_MAX_BATCH_SIZE", 32))
+MAX_WAIT_MS = float(os.environ.get("EMBEDDINGS_MAX_WAIT_MS", 5))
+# Requests admitted at once per process (so per serve.py worker), the rest get
+# an immediate 503 instead of queueing behind work that would make them time
+# out anyway. A few full batches by default; 0 disables the limit.
+MAX_IN_FLIGHT_BATCHES = 4
+MAX_IN_FLIGHT = int(
+    os.environ.get("EMBEDDINGS_MAX_IN_FLIGHT", MAX_IN_FLIGHT_BATCHES * MAX_BATCH_SIZE)
+)
+RETRY_AFTER_SECONDS = 1
+UNLIMITED_PATHS = {"/stats"}
+
+# Raw little-endian float32, row-major. Batch responses carry the vector
+# dimensions in a header so the client can reshape without parsing JSON.
+FLOAT32_MEDIA_TYPE = "application/x-float32"
+EMBEDDING_DIMS_HEADER = "X-Embedding-Dims"
+
 app = FastAPI()
 
+batcher = DynamicBatcher(
+    get_embeddings_sbert, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS
+)
+
+
+class InFlightLimit:
+    def __init__(self, max_in_flight: int) -> None:
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.rejected = 0
+
+
+in_flight_limit = InFlightLimit(MAX_IN_FLIGHT)
+
+
+@app.middleware("http")
+async def limit_in_flight(
+    request: Request, call_next: Callable[[Request], Awaitable[Response]]
+) -> Response:
+    # Only touched from the event loop, so the counters need no lock.
+    if request.url.path in UNLIMITED_PATHS:
+        return await call_next(request)
+    limit = in_flight_limit
+    if limit.max_in_flight and limit.in_flight >= limit.max_in_flight:
+        limit.rejected += 1
+        return Response(status_code=503, headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+    limit.in_flight += 1
+    try:
+        return await call_next(request)
+    finally:
+        limit.in_flight -= 1
+
+
+def _float32_response(embeddings: np.ndarray) -> Response:
+    return Response(
+        content=np.ascontiguousarray(embeddings, dtype="<f4").tobytes(),
+        media_type=FLOAT32_MEDIA_TYPE,
+        headers={EMBEDDING_DIMS_HEADER: str(embeddings.shape[-1])},
+    )
+
+
+@app.on_event("startup")
+async def start_batcher() -> None:
+    await batcher.start()
+
+
+@app.on_event("shutdown")
+async def stop_batcher() -> None:
+    await batcher.stop()
+
 
 @app.post("/embedding", response_model=EmbeddingsResponse)
-def get_embbeding_for_text(body: EmbeddingsRequest) -> Any:
-    embedding = get_embedding_sbert(body.text, body.type)
-    return {"embedding": embedding}
+async def get_embbeding_for_text(
+    body: EmbeddingsRequest, accept: str | None = Header(default=None)
+) -> Any:
+    embedding = await batcher.submit(body.text, body.type)
+    if accept and FLOAT32_MEDIA_TYPE in accept:
+        return _float32_response(embedding)
+    return {"embedding": embedding.tolist()}
+
+
+@app.post("/embeddings", response_model=BatchEmbeddingsResponse)
+async def get_embeddings_for_texts(
+    body: BatchEmbeddingsRequest, accept: str | None = Header(default=None)
+) -> Any:
+    embeddings = await batcher.run_exclusive(
+        lambda: get_embeddings_sbert(body.texts, body.type, batch_size=MAX_BATCH_SIZE)
+    )
+    if accept and FLOAT32_MEDIA_TYPE in accept:
+        return _float32_response(embeddings)
+    return {"embeddings": embeddings.tolist()}
+
+
+@app.get("/stats", response_model=BatcherStatsResponse)
+def get_batcher_stats() -> Any:
+    return {
+        "max_batch_size": batcher.max_batch_size,
+        "max_wait_ms": batcher.max_wait * 1000,
+        "queue_depth": batcher.queue_depth(),
+        "in_flight": in_flight_limit.in_flight,
+        "max_in_flight": in_flight_limit.max_in_flight,
+        "rejected": in_flight_limit.rejected,
+        "models": {t.value: stats.to_dict() for t, stats in batcher.stats.items()},
+    }
@@ -1,9 +1,16 @@
+import os
+
 from pydantic import BaseModel, Field
-from typing import List
+from typing import Dict, List
 
 from embedding_generator import EmbeddingTypes
 
 
+# Texts accepted by one /embeddings request; the batch is encoded as a whole,
+# so this bounds the time a request holds the model.
+MAX_BATCH_TEXTS = int(os.environ.get("EMBEDDINGS_MAX_BATCH_TEXTS", 1024))
+
+
 class EmbeddingsRequest(BaseModel):
     text: str
     type: EmbeddingTypes = Field(default=EmbeddingTypes.SYMMETRIC)
@@ -11,3 +18,22 @@ class EmbeddingsRequest(BaseModel):
 
 class EmbeddingsResponse(BaseModel):
     embedding: List[float]
+
+
+class BatchEmbeddingsRequest(BaseModel):
+    texts: List[str] = Field(min_items=1, max_items=MAX_BATCH_TEXTS)
+    type: EmbeddingTypes = Field(default=EmbeddingTypes.SYMMETRIC)
+
+
+class BatchEmbeddingsResponse(BaseModel):
+    embeddings: List[List[float]]
+
+
+class BatcherStatsResponse(BaseModel):
+    max_batch_size: int
+    max_wait_ms: float
+    queue_depth: Dict[str, int]
+    in_flight: int
+    max_in_flight: int
+    rejected: int
+    models: Dict[str, dict]
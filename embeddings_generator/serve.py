@@ -0,0 +1,152 @@
+import os
+import gc
+import sys
+import signal
+import socket
+import time
+import argparse
+import traceback
+
+import uvicorn
+
+
+DEFAULT_WORKERS = int(os.environ.get("EMBEDDINGS_WORKERS", 1))
+RESTART_DELAY_SECONDS = 1
+# Set before numpy/torch are imported, the native thread pools read them once.
+THREAD_ENV_VARS = [
+    "EMBEDDINGS_NUM_THREADS",
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+]
+
+
+def _bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(sock: socket.socket, host: str, port: int) -> None:
+    from embedding_generator import set_num_threads
+    from main import app
+
+    gc.enable()
+    set_num_threads()
+    config = uvicorn.Config(app, host=host, port=port, workers=1)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def _spawn_worker(sock: socket.socket, host: str, port: int) -> int:
+    pid = os.fork()
+    if pid:
+        return pid
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    code = 0
+    try:
+        _run_worker(sock, host, port)
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def _main(
+    host: str,
+    port: int,
+    workers: int = DEFAULT_WORKERS,
+    threads_per_worker: int | None = None,
+    max_in_flight: int | None = None,
+    preload: bool = True,
+) -> None:
+    threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+    for env_var in THREAD_ENV_VARS:
+        os.environ[env_var] = str(threads_per_worker)
+    if max_in_flight is not None:
+        os.environ["EMBEDDINGS_MAX_IN_FLIGHT"] = str(max_in_flight)
+
+    # Nothing collected until the workers start, and everything loaded so far
+    # moved to the permanent generation, so collections in the workers don't
+    # write to (and un-share) the pages holding the model weights.
+    gc.disable()
+    import main  # noqa: F401
+    from embedding_generator import EMBEDDINGS_BACKEND, preload_models
+
+    if preload and EMBEDDINGS_BACKEND == "torch":
+        preload_models()
+    elif preload:
+        # ONNX Runtime sessions own thread pools that don't survive fork, each
+        # worker creates its own on the first request.
+        print(f"Not preloading the {EMBEDDINGS_BACKEND} models, they load per worker")
+    gc.freeze()
+
+    sock = _bind_socket(host, port)
+    print(
+        f"Serving on {host}:{port} with {workers} workers, "
+        f"{threads_per_worker} threads per worker"
+    )
+    children = {_spawn_worker(sock, host, port) for _ in range(workers)}
+    stopping = False
+
+    def stop(signum: int, frame: object) -> None:
+        nonlocal stopping
+        stopping = True
+        # SIGINT from a terminal already reaches the whole process group, a
+        # second signal would make uvicorn skip the graceful shutdown.
+        if signum == signal.SIGTERM:
+            for pid in children:
+                os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited with status {status}, restarting it", file=sys.stderr)
+            time.sleep(RESTART_DELAY_SECONDS)
+            children.add(_spawn_worker(sock, host, port))
+    sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serves the embeddings generator from forked workers sharing the "
+        "preloaded models"
+    )
+    parser.add_argument("--host", type=str, default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument(
+        "--threads_per_worker",
+        type=int,
+        default=None,
+        help="torch/BLAS threads per worker, defaults to cores / workers",
+    )
+    parser.add_argument(
+        "--max_in_flight",
+        type=int,
+        default=None,
+        help="requests admitted at once per worker before answering 503, defaults to "
+        "4 batches (EMBEDDINGS_MAX_IN_FLIGHT), 0 disables the limit",
+    )
+    parser.add_argument("--no_preload", action="store_true")
+
+    args = parser.parse_args()
+    _main(
+        args.host,
+        args.port,
+        workers=args.workers,
+        threads_per_worker=args.threads_per_worker,
+        max_in_flight=args.max_in_flight,
+        preload=not args.no_preload,
+    )